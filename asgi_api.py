@@ -0,0 +1,282 @@
+# 正式環境的非同步 (ASGI) 服務模式，需要額外安裝: pip install starlette uvicorn
+# 路由與 JSON 格式與 flask_api 完全相同，Unity 端不需修改；啟動: python asgi_api.py --workers 4
+import argparse
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from jinja2 import Template
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import flask_api as core
+
+# 儀表板只依賴固定的 BASE_STATS，啟動時渲染一次即可
+DASHBOARD_PAGE = Template(core.DASHBOARD_HTML).render(BASE_STATS=core.BASE_STATS, SSE_ENABLED=core.SSE_ENABLED)
+SSE_POLL_INTERVAL = 0.1
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def _admin_authorized(request):
+    return core.admin_authorized(request.headers.get("X-Admin-Token"), request.client.host if request.client else None)
+
+
+def _bad_request():
+    return JSONResponse({"error": "請求內容必須是 JSON"}, status_code=400)
+
+
+async def dashboard(request):
+    return HTMLResponse(DASHBOARD_PAGE)
+
+
+async def get_history(request):
+    return JSONResponse(await run_in_threadpool(core.SESSION_STORE.snapshot))
+
+
+async def players(request):
+    return JSONResponse(await run_in_threadpool(core.list_players))
+
+
+async def player_history(request):
+    player_id = request.path_params["player_id"]
+    try:
+        since = int(request.query_params.get("since", 0))
+    except ValueError:
+        since = 0
+    delta = await run_in_threadpool(core.history_delta, player_id, since)
+    if delta is None:
+        return JSONResponse({"error": f"找不到玩家 {player_id}"}, status_code=404)
+    return JSONResponse(delta)
+
+
+def _int_param(request, name, default):
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+async def series(request):
+    player_id = request.path_params["player_id"]
+    try:
+        result = await run_in_threadpool(core.player_series, player_id,
+                                         _int_param(request, "width", core.DEFAULT_WIDTH),
+                                         request.query_params.get("method", "lttb"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if result is None:
+        return JSONResponse({"error": f"找不到玩家 {player_id}"}, status_code=404)
+    return JSONResponse(result)
+
+
+async def cohorts(request):
+    try:
+        return JSONResponse(await run_in_threadpool(core.cohort_summary, _int_param(request, "width", None),
+                                                    request.query_params.get("method", "lttb"),
+                                                    request.query_params.get("series", "1") != "0"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+async def events(request):
+    if not core.SSE_ENABLED:
+        return JSONResponse({"error": "推播已停用 (多 worker 模式)，請改用輪詢"}, status_code=404)
+    subscription = core.EVENT_BROKER.subscribe(request.query_params.get("player_id"))
+
+    async def stream():
+        # 以非阻塞方式輪詢訂閱佇列，避免每條 SSE 連線佔住一個執行緒
+        try:
+            yield "retry: 2000\n\n"
+            idle = 0.0
+            while True:
+                message = subscription.get(timeout=0)
+                if message is not None:
+                    idle = 0.0
+                    yield f"data: {message}\n\n"
+                    continue
+                await asyncio.sleep(SSE_POLL_INTERVAL)
+                idle += SSE_POLL_INTERVAL
+                if idle >= core.SSE_HEARTBEAT:
+                    idle = 0.0
+                    yield ": keep-alive\n\n"
+        finally:
+            core.EVENT_BROKER.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# 執行緒池函式先標記 dispatch (等待池中空閒執行緒的時間)，其餘階段與 flask_api 相同
+def _adjust(data, timer):
+    timer.mark("dispatch")
+    result, log_row = core.process_adjustment(data, timer)
+    core.LOG_WRITER.write(core.LOG_FILE, log_row)
+    timer.mark("log")
+    return result
+
+
+def _adjust_batch(payloads, timer):
+    timer.mark("dispatch")
+    results, log_rows = core.adjust_batch(payloads, timer)
+    core.LOG_WRITER.write_many(core.LOG_FILE, log_rows)
+    timer.mark("log")
+    return results
+
+
+def _final_result(data, timer):
+    timer.mark("dispatch")
+    log_row = core.process_final_result(data)
+    timer.mark("record")
+    core.LOG_WRITER.write(core.FINAL_RESULT_FILE, log_row)
+    timer.mark("log")
+
+
+def _timed_response(timer, content):
+    response = JSONResponse(content)
+    timer.mark("encode")
+    timer.done()
+    return response
+
+
+# 寫入類路由：session 鎖、SQLite 與日誌佇列的背壓等待都可能阻塞，一律移到執行緒池，不佔用事件迴圈
+async def adjust_difficulty(request):
+    timer = core.METRICS.timer("adjust_difficulty")
+    data = await _json_body(request)
+    timer.mark("parse")
+    if not isinstance(data, dict):
+        return _bad_request()
+    return _timed_response(timer, await run_in_threadpool(_adjust, data, timer))
+
+
+async def adjust_difficulty_batch(request):
+    timer = core.METRICS.timer("adjust_difficulty_batch")
+    data = await _json_body(request)
+    timer.mark("parse")
+    payloads = data.get("players", []) if isinstance(data, dict) else data
+    if not isinstance(payloads, list):
+        return JSONResponse({"error": "players 必須是陣列"}, status_code=400)
+    return _timed_response(timer, {"results": await run_in_threadpool(_adjust_batch, payloads, timer)})
+
+
+async def submit_final_result(request):
+    timer = core.METRICS.timer("submit_final_result")
+    data = await _json_body(request)
+    timer.mark("parse")
+    if not isinstance(data, dict):
+        return _bad_request()
+    await run_in_threadpool(_final_result, data, timer)
+    return _timed_response(timer, {"status": "success"})
+
+
+async def model_version(request):
+    return JSONResponse(core.MODEL_REGISTRY.current.info())
+
+
+async def optimizer(request):
+    info = core.optimizer_info(request.query_params.get("player_id"), request.query_params.get("mode", "1"))
+    if info is None:
+        return JSONResponse({"error": "該玩家尚無最佳化狀態"}, status_code=404)
+    return JSONResponse(info)
+
+
+async def metrics(request):
+    text = await run_in_threadpool(core.METRICS.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+async def profiler(request):
+    if not _admin_authorized(request):
+        return JSONResponse({"error": "未授權"}, status_code=403)
+    if request.method == "GET" and request.query_params.get("format") == "collapsed":
+        return PlainTextResponse(core.PROFILER.collapsed())
+    body = await _json_body(request) if request.method == "POST" else None
+    try:
+        return JSONResponse(await run_in_threadpool(core.profiler_control, body if isinstance(body, dict) else None))
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+async def healthz(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def readyz(request):
+    ready, info = core.readiness()
+    return JSONResponse(info, status_code=200 if ready else 503)
+
+
+async def reload_model(request):
+    if not _admin_authorized(request):
+        return JSONResponse({"error": "未授權"}, status_code=403)
+    body = await _json_body(request)
+    try:
+        return JSONResponse(await run_in_threadpool(core.reload_model, body if isinstance(body, dict) else None))
+    except (ValueError, OSError) as e:
+        return JSONResponse({"error": str(e), "version": core.MODEL_REGISTRY.current.version}, status_code=400)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # 啟動時建立執行期狀態 (不需匯入 Flask)，完成前 uvicorn 不會開始接受連線
+    await run_in_threadpool(core.start)
+    yield
+    # 關閉前把佇列中的日誌全部寫入檔案，並為記憶體 session 做最後一次 checkpoint
+    await run_in_threadpool(core.shutdown)
+
+
+app = Starlette(routes=[
+    Route("/", dashboard),
+    Route("/get_history", get_history),
+    Route("/players", players),
+    Route("/get_history/{player_id}", player_history),
+    Route("/series/{player_id}", series),
+    Route("/cohorts", cohorts),
+    Route("/events", events),
+    Route("/adjust_difficulty", adjust_difficulty, methods=["POST"]),
+    Route("/adjust_difficulty_batch", adjust_difficulty_batch, methods=["POST"]),
+    Route("/submit_final_result", submit_final_result, methods=["POST"]),
+    Route("/model_version", model_version),
+    Route("/optimizer", optimizer),
+    Route("/metrics", metrics),
+    Route("/admin/profiler", profiler, methods=["GET", "POST"]),
+    Route("/admin/reload_model", reload_model, methods=["POST"]),
+    Route("/healthz", healthz),
+    Route("/readyz", readyz),
+], lifespan=lifespan)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="DDA API (ASGI 模式)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5050)
+    # 多個 worker 是各自獨立的行程，只有 session (改用 SQLite) 與 CSV 日誌 (跨行程檔案鎖) 是共用的：
+    # - SSE 推播只送到同一 worker 的連線，因此停用 /events，監控面板改為定期輪詢
+    # - /cohorts 的族群統計、線上最佳化 (DDA_ONLINE_OPT)、/metrics 與查表快取都是每個 worker 各自一份
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("DDA_WORKERS", 1)),
+                        help="worker 行程數；大於 1 時 SSE 停用、族群統計與線上最佳化為各 worker 分開")
+    args = parser.parse_args()
+    if args.workers > 1:
+        # 設定由 uvicorn 啟動的 worker 行程繼承
+        if "DDA_SESSION_BACKEND" not in os.environ:
+            os.environ["DDA_SESSION_BACKEND"] = "sqlite"
+            print("ℹ️ 多 worker 模式，自動改用 SQLite session 儲存。")
+        elif os.environ["DDA_SESSION_BACKEND"] == "memory":
+            # 每個 worker 各有一份玩家狀態，且會同時寫入並還原同一個 WAL 目錄，互相破壞對方的紀錄
+            parser.error("DDA_SESSION_BACKEND=memory 不能與 --workers > 1 併用 (各 worker 會共用同一個 session WAL)；"
+                         "請改用 sqlite 或 --workers 1")
+        os.environ.setdefault("DDA_SSE", "0")
+        os.environ.setdefault("DDA_LOG_INTERPROCESS", "1")
+        print("ℹ️ 多 worker 模式：CSV 日誌以跨行程鎖附加；SSE 推播停用，監控面板改為輪詢。")
+        if os.environ.get("DDA_ONLINE_OPT"):
+            print("⚠️ 線上最佳化的狀態不跨 worker 共用，同一玩家的請求分散到不同 worker 時各自演化。")
+    uvicorn.run("asgi_api:app", host=args.host, port=args.port, workers=args.workers)
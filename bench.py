@@ -0,0 +1,274 @@
+# 請求路徑壓測：以 scenario.py 的劇本模擬 N 位同時遊玩的玩家，直接打在行程內的 app 上 (不經網路)
+# 用法: python bench.py --players 200 --concurrency 16 [--server asgi] [--batch 50] [--output result.json]
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from scenario import step_payload, final_payload, iter_steps
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_FILES = ("P_Strong.json", "P_Weak.json")
+# 冷啟動量測在全新的子行程中執行：匯入 -> 建立執行期狀態 (就緒) -> 第一個請求，最後等背景預載結束
+STARTUP_SCRIPT = r"""
+import json, sys, time
+spawned, server, payload = float(sys.argv[1]), sys.argv[2], json.loads(sys.argv[3])
+t0 = time.perf_counter()
+import flask_api as core
+if server == "asgi":
+    import asgi_api
+t1 = time.perf_counter()
+app = core.create_app() if server == "flask" else (core.start(), asgi_api.app)[1]
+t2 = time.perf_counter()
+ready_at = time.time()
+if server == "flask":
+    client = app.test_client()
+else:
+    from starlette.testclient import TestClient
+    client = TestClient(app)
+t3 = time.perf_counter()
+assert client.post("/adjust_difficulty", json=payload).status_code == 200
+t4 = time.perf_counter()
+while core.PRELOAD and core.STARTUP["preload_s"] is None and time.perf_counter() - t4 < 10:
+    time.sleep(0.01)
+core.shutdown()
+print(json.dumps({"spawn_to_ready_s": ready_at - spawned, "import_s": t1 - t0, "ready_s": t2 - t1,
+                  "phases": core.STARTUP["phases"], "first_request_s": t4 - t3,
+                  "preload_s": core.STARTUP["preload_s"]}))
+"""
+
+
+def deep_sizeof(obj):
+    """
+    粗估物件圖的總記憶體 (位元組)，沿著 gc 參照走訪，略過型別、模組與函式等共用物件
+    """
+    seen, stack, total = set(), [obj], 0
+    skip = (type, type(sys), type(deep_sizeof))
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, skip):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+        # __slots__ 物件的屬性不一定出現在 gc 參照中
+        for name in getattr(type(o), "__slots__", ()):
+            if hasattr(o, name):
+                stack.append(getattr(o, name))
+    return total
+
+
+def session_memory(api):
+    store = api.SESSION_STORE
+    return deep_sizeof(store.sessions) if hasattr(store, "sessions") else 0
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+
+    def report(self, elapsed):
+        result = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            ms = np.asarray(values) * 1000.0
+            result[endpoint] = {"count": len(values), "rps": len(values) / elapsed,
+                                "p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+                                "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max())}
+        return result
+
+
+def make_client_factory(server):
+    # 每個執行緒各自建立一個測試客戶端 (TestClient 未進入 lifespan，因此直接呼叫 start())
+    import flask_api
+    if server == "flask":
+        app = flask_api.create_app()
+        return flask_api, lambda: app.test_client()
+    from starlette.testclient import TestClient
+    import asgi_api
+    flask_api.start()
+    return flask_api, lambda: TestClient(asgi_api.app)
+
+
+def measure_startup(server="flask", runs=3):
+    """
+    冷啟動量測：每次在新的子行程與空目錄 (沒有 session 快照與舊日誌) 中啟動，模擬自動擴展新開的實例
+    回傳各項耗時的中位數 (秒)：行程建立到就緒、模組匯入、start() 各階段與第一個請求
+    """
+    payload = json.dumps(step_payload("Startup_Probe", 3, 1, "Alive", 1))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (REPO_DIR, os.environ.get("PYTHONPATH")))))
+    samples = []
+    for _ in range(runs):
+        run_dir = tempfile.mkdtemp(prefix="startup_", dir=os.getcwd())
+        for name in MODEL_FILES:
+            if os.path.exists(os.path.join(REPO_DIR, name)):
+                shutil.copy(os.path.join(REPO_DIR, name), run_dir)
+        out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, repr(time.time()), server, payload], cwd=run_dir,
+                             env=env, capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    def median(values):
+        values = sorted(v for v in values if v is not None)
+        return values[len(values) // 2] if values else None
+
+    result = {key: median(s[key] for s in samples)
+              for key in ("spawn_to_ready_s", "import_s", "ready_s", "first_request_s", "preload_s")}
+    result["phases"] = {phase: median(s["phases"].get(phase) for s in samples) for phase in samples[0]["phases"]}
+    result["runs"] = runs
+    return result
+
+
+def run_player(client, recorder, p_id, rounds):
+    for _ in range(rounds):
+        for _, kills, deaths, status, step in iter_steps():
+            t0 = time.perf_counter()
+            res = client.post("/adjust_difficulty", json=step_payload(p_id, kills, deaths, status, step))
+            recorder.add("/adjust_difficulty", time.perf_counter() - t0)
+            assert res.status_code == 200, res.status_code
+    t0 = time.perf_counter()
+    client.post("/submit_final_result", json=final_payload(p_id))
+    recorder.add("/submit_final_result", time.perf_counter() - t0)
+
+
+def run_batched(client, recorder, p_ids, rounds):
+    # 每個 tick 把這組玩家的遙測合併成一次 /adjust_difficulty_batch
+    for _ in range(rounds):
+        for _, kills, deaths, status, step in iter_steps():
+            payloads = [step_payload(p_id, kills, deaths, status, step) for p_id in p_ids]
+            t0 = time.perf_counter()
+            res = client.post("/adjust_difficulty_batch", json={"players": payloads})
+            recorder.add("/adjust_difficulty_batch", time.perf_counter() - t0)
+            assert res.status_code == 200, res.status_code
+    for p_id in p_ids:
+        t0 = time.perf_counter()
+        client.post("/submit_final_result", json=final_payload(p_id))
+        recorder.add("/submit_final_result", time.perf_counter() - t0)
+
+
+def run_benchmark(players=100, concurrency=8, rounds=1, server="flask", batch=0, dashboard_polls=0):
+    """
+    執行一次壓測並回傳結果 dict (各端點 rps 與 p50/p95/p99 延遲、session 記憶體成長)
+    """
+    api, new_client = make_client_factory(server)
+    recorder = Recorder()
+    mem_before = session_memory(api)
+    p_ids = [f"Bench_{i:05d}" for i in range(players)]
+    tls = threading.local()
+
+    def client():
+        if not hasattr(tls, "client"):
+            tls.client = new_client()
+        return tls.client
+
+    def poll_dashboard(n):
+        c = client()
+        for _ in range(n):
+            t0 = time.perf_counter()
+            c.get("/players")
+            recorder.add("/players", time.perf_counter() - t0)
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if batch:
+            groups = [p_ids[i:i + batch] for i in range(0, len(p_ids), batch)]
+            futures = [executor.submit(lambda g=group: run_batched(client(), recorder, g, rounds)) for group in groups]
+        else:
+            futures = [executor.submit(lambda p=p_id: run_player(client(), recorder, p, rounds)) for p_id in p_ids]
+        if dashboard_polls:
+            futures.append(executor.submit(poll_dashboard, dashboard_polls))
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - t_start
+    api.LOG_WRITER.flush()
+
+    total = sum(len(v) for v in recorder.latencies.values())
+    mem_after = session_memory(api)
+    steps = players * rounds * sum(1 for _ in iter_steps())
+    return {
+        "config": {"players": players, "concurrency": concurrency, "rounds": rounds, "server": server,
+                   "batch": batch, "session_backend": api.SESSION_BACKEND, "online_opt": api.ONLINE_OPT_SCOPE or None},
+        "elapsed_s": elapsed, "total_requests": total, "rps": total / elapsed,
+        "endpoints": recorder.report(elapsed),
+        "session_memory": {"before_bytes": mem_before, "after_bytes": mem_after,
+                           "growth_bytes": mem_after - mem_before,
+                           "bytes_per_step": (mem_after - mem_before) / steps if steps else 0.0},
+        "log_writer": api.LOG_WRITER.stats(),
+        # 伺服器端各階段耗時 (由 /metrics 的直方圖估計)，用來判斷延遲花在哪個階段
+        "stages": api.METRICS.stage_summary(),
+    }
+
+
+def print_report(result):
+    cfg = result["config"]
+    print(f"📊 {cfg['server']} | 玩家 {cfg['players']} | 並行 {cfg['concurrency']} | 回合 {cfg['rounds']} | "
+          f"批次 {cfg['batch'] or '-'} | session 後端 {cfg['session_backend']} | 線上最佳化 {cfg['online_opt'] or '-'}")
+    print(f"   總請求 {result['total_requests']}，耗時 {result['elapsed_s']:.2f}s，整體 {result['rps']:.0f} req/s")
+    for endpoint, s in result["endpoints"].items():
+        print(f"   {endpoint:28s} n={s['count']:6d}  {s['rps']:8.0f} req/s  p50={s['p50_ms']:.2f}ms  "
+              f"p95={s['p95_ms']:.2f}ms  p99={s['p99_ms']:.2f}ms  max={s['max_ms']:.2f}ms")
+    mem = result["session_memory"]
+    print(f"   session 記憶體成長 {mem['growth_bytes'] / 1024:.1f} KiB (每步 {mem['bytes_per_step']:.0f} B)")
+    print(f"   日誌寫入器 {result['log_writer']}")
+    for route, stages in result["stages"].items():
+        print(f"   {route} 各階段: " + "  ".join(f"{stage} p50={s['p50_ms']:.3f}/p99={s['p99_ms']:.3f}ms"
+                                                 for stage, s in stages.items()))
+    startup = result.get("startup")
+    if startup:
+        phases = ", ".join(f"{phase} {seconds * 1000:.1f}" for phase, seconds in startup["phases"].items())
+        preload = f"{startup['preload_s'] * 1000:.1f} ms" if startup["preload_s"] is not None else "-"
+        print(f"   冷啟動 (中位數 {startup['runs']} 次): 行程建立到就緒 {startup['spawn_to_ready_s'] * 1000:.1f} ms "
+              f"(匯入 {startup['import_s'] * 1000:.1f} ms，就緒 {startup['ready_s'] * 1000:.1f} ms: {phases})，"
+              f"第一個請求 {startup['first_request_s'] * 1000:.2f} ms，背景預載 {preload}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DDA API 延遲與吞吐量壓測")
+    parser.add_argument("--players", type=int, default=100, help="同時模擬的玩家數")
+    parser.add_argument("--concurrency", type=int, default=8, help="送出請求的執行緒數")
+    parser.add_argument("--rounds", type=int, default=1, help="每位玩家重複劇本的次數")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--batch", type=int, default=0, help="每次批次請求包含的玩家數 (0 為逐一請求)")
+    parser.add_argument("--dashboard-polls", type=int, default=0, help="同時模擬的儀表板 /players 查詢次數")
+    parser.add_argument("--online-opt", choices=("player", "cohort"), help="啟用伺服器端線上最佳化 (DDA_ONLINE_OPT)")
+    parser.add_argument("--startup-runs", type=int, default=3, help="冷啟動量測的子行程次數 (0 為不量測)")
+    parser.add_argument("--output", help="將結果寫成 JSON，方便比較回歸")
+    args = parser.parse_args()
+
+    # 在暫存目錄執行，避免壓測資料寫進正式的實驗 CSV
+    work_dir = tempfile.mkdtemp(prefix="dda_bench_")
+    for name in MODEL_FILES:
+        if os.path.exists(os.path.join(REPO_DIR, name)):
+            shutil.copy(os.path.join(REPO_DIR, name), work_dir)
+    output = os.path.abspath(args.output) if args.output else None
+    if args.online_opt:
+        os.environ["DDA_ONLINE_OPT"] = args.online_opt
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+
+    # 冷啟動先量 (子行程)，避免本行程已匯入的模組與暖機影響結果
+    startup = measure_startup(args.server, args.startup_runs) if args.startup_runs else None
+    result = run_benchmark(args.players, args.concurrency, args.rounds, args.server, args.batch,
+                           args.dashboard_polls)
+    result["startup"] = startup
+    print_report(result)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    # 先關閉背景寫入 (日誌、遙測、session 快照) 再刪除暫存目錄，避免結束時的 atexit 寫入已刪除的路徑
+    import flask_api
+    flask_api.shutdown()
+    shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,123 @@
+# 等價性檢查：以隨機遙測比對 DDA 的三條路徑，確保之後的修改不會讓它們悄悄分岔
+#   1. model_core.adjust_difficulty_dda_batch (向量化) 與逐一呼叫 session_step 完全相同 (倍率逐位元相等)
+#   2. replay.replay (打包成 (步數, 玩家數) 的重播) 的最終倍率與 session_step 完全相同
+#   3. dda_table.DifficultyTable.session_step 的決策與 session_step 相同，倍率誤差不超過 accuracy_bound()
+# 用法: python -m check_equivalence --rounds 5 --players 64 --steps 200 --seed 0  (任何不一致時結束碼為 1)
+import argparse
+import random
+import sys
+
+import numpy as np
+
+from model_core import session_step, adjust_difficulty_dda_batch, DDAPolicy, DEFAULT_POLICY, PARAM_KEYS, ACTIONS
+from model_registry import DEFAULT_P_STRONG, DEFAULT_P_WEAK
+from dda_table import DifficultyTable, verify
+from replay import replay, pack_traces, _trace_from_steps
+
+# 與 flask_api.BASE_STATS 相同 (只影響查表的顯示字串，不影響倍率)
+BASE_STATS = {"HP": 100.0, "ATK": 10.0, "DET": 20.0, "SPD": 2.5}
+
+
+def random_case(rng):
+    # 隨機產生一組 P_Strong / P_Weak 與門檻、速率 (第 0 輪固定使用預設值，見 main)
+    strong = {key: round(rng.uniform(1.0, 2.0), 3) for key in PARAM_KEYS}
+    weak = {key: round(rng.uniform(0.3, 1.0), 3) for key in PARAM_KEYS}
+    weak_threshold = rng.uniform(0.1, 0.6)
+    policy = DDAPolicy(weak_threshold + rng.uniform(0.0, 0.8), weak_threshold, rng.uniform(0.02, 0.3),
+                       rng.uniform(0.02, 0.3), rng.uniform(0.3, 0.9), rng.randint(0, 6), rng.uniform(0.1, 0.9))
+    return strong, weak, policy
+
+
+def random_traces(rng, players, steps):
+    # 每位玩家長度不同 (重播時第 t 步只處理仍有資料的玩家)，包含死亡、教學關卡、控制組與開場前的 game_time
+    traces = {}
+    for p in range(players):
+        control = rng.random() < 0.1
+        traces[f"p{p}"] = [(rng.choice((0, 0, 1, 2, 3, 5, 8, 13)), rng.choice((0, 0, 1, 2, 3, 4)),
+                            rng.random() < 0.08, rng.random() < 0.05, control or rng.random() < 0.02,
+                            rng.choice((0, 1, 2, 3)) if t < 3 else t * 5)
+                           for t in range(rng.randint(1, steps))]
+    return traces
+
+
+def check_batch(traces, P_Strong, P_Weak, policy):
+    """
+    逐步比對 session_step 與 adjust_difficulty_dda_batch，回傳 (session_step 的最終倍率, 不一致的訊息)
+    """
+    player_ids = list(traces)
+    state = {p: ({key: 1.0 for key in PARAM_KEYS}, 0, False) for p in player_ids}
+    params = np.ones((len(player_ids), 4))
+    recovery = np.zeros(len(player_ids), dtype=int)
+    calibrated = np.zeros(len(player_ids), dtype=bool)
+    errors = []
+    for t in range(max(len(s) for s in traces.values())):
+        # 只取仍有資料的玩家 (不連續的子集)，同時檢查批次路徑對任意列的處理
+        rows = [j for j, p in enumerate(player_ids) if t < len(traces[p])]
+        steps = [traces[player_ids[j]][t] for j in rows]
+        kill, death, dead, tutorial, control, game_time = (np.array(column) for column in zip(*steps))
+        new_params, new_recovery, new_calibrated, actions = adjust_difficulty_dda_batch(
+            params[rows], recovery[rows], calibrated[rows], kill, death, dead, tutorial, control, game_time,
+            P_Strong, P_Weak, policy)
+        params[rows], recovery[rows], calibrated[rows] = new_params, new_recovery, new_calibrated
+        for i, j in enumerate(rows):
+            p = player_ids[j]
+            k, d, is_dead, is_tutorial, is_control, gt = steps[i]
+            data = {"kill_count": k, "death_count": d, "game_time": gt}
+            scalar, rc, cal, action = session_step(*state[p], data, P_Strong, P_Weak, dead=is_dead,
+                                                   tutorial=is_tutorial, control=is_control, policy=policy)
+            state[p] = (scalar, rc, cal)
+            expected = [scalar[key] for key in PARAM_KEYS]
+            got = (params[j].tolist(), int(recovery[j]), bool(calibrated[j]), ACTIONS[actions[i]])
+            if got != (expected, rc, cal, action) and len(errors) < 5:
+                errors.append(f"{p} 第 {t} 步: session_step={(expected, rc, cal, action)} batch={got}")
+    return {p: [state[p][0][key] for key in PARAM_KEYS] for p in player_ids}, errors
+
+
+def check_replay(traces, final, P_Strong, P_Weak, policy):
+    # replay 只回傳最終倍率，逐位元比對每位玩家的結果
+    grid = pack_traces({p: _trace_from_steps(steps) for p, steps in traces.items()})
+    result = replay(grid, P_Strong, P_Weak, policy)
+    errors = []
+    for p, got in zip(grid["player_ids"], result["final_params"].tolist()):
+        if got != final[p] and len(errors) < 5:
+            errors.append(f"{p}: session_step={final[p]} replay={got}")
+    return errors
+
+
+def main(rounds=5, players=64, steps=200, seed=0):
+    rng = random.Random(seed)
+    failures = 0
+    for r in range(rounds):
+        P_Strong, P_Weak, policy = (DEFAULT_P_STRONG, DEFAULT_P_WEAK, DEFAULT_POLICY) if r == 0 else random_case(rng)
+        traces = random_traces(rng, players, steps)
+        n_steps = sum(len(s) for s in traces.values())
+        final, batch_errors = check_batch(traces, P_Strong, P_Weak, policy)
+        replay_errors = check_replay(traces, final, P_Strong, P_Weak, policy)
+        table = DifficultyTable(P_Strong, P_Weak, BASE_STATS, policy)
+        max_error, mismatches = verify(table, players=max(players // 4, 1), steps=steps, seed=seed + r)
+        bound = table.accuracy_bound()
+        table_ok = mismatches == 0 and max_error <= bound
+
+        print(f"🔁 第 {r} 輪 ({players} 位玩家、{n_steps} 步)："
+              f"批次 {'✅' if not batch_errors else '❌'}  重播 {'✅' if not replay_errors else '❌'}  "
+              f"查表 {'✅' if table_ok else '❌'} (誤差 {max_error:.2e} / 上界 {bound:.2e}，決策不一致 {mismatches} 步)")
+        for message in batch_errors + replay_errors:
+            print(f"   ⚠️ {message}")
+        if batch_errors or replay_errors or not table_ok:
+            print(f"   策略: {policy}\n   P_Strong: {P_Strong}\n   P_Weak: {P_Weak}")
+            failures += 1
+    if failures:
+        print(f"❌ {failures} / {rounds} 輪不一致")
+        return 1
+    print(f"✅ {rounds} 輪全部一致")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="隨機比對 session_step、批次 DDA、重播與查表的結果")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--players", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(main(args.rounds, args.players, args.steps, args.seed))
@@ -0,0 +1,237 @@
+# 監控面板的伺服器端彙總：長 session 的歷史依圖表寬度降採樣 (LTTB 或每區間最小/最大值)，
+# 以及依模式 (控制組 "0" 與 DDA 各組) 在資料寫入時增量累計的跨玩家統計，面板不必下載與重畫完整歷史
+import threading
+from collections import deque
+
+# 圖表寬度 (像素) 的預設值與上限；降採樣後的點數不超過寬度
+DEFAULT_WIDTH = 800
+MAX_WIDTH = 4000
+METHODS = ("lttb", "minmax")
+# 歷史紀錄中繪圖的欄位 (HistoryRecord 屬性)
+SERIES_FIELDS = ("kd", "hp", "atk", "det", "spd")
+# 族群時間序列的區間長度 (秒) 與保留的區間數 (預設 60 秒 × 1440 = 最近 24 小時)
+COHORT_BUCKET = 60.0
+COHORT_BUCKETS = 1440
+# 族群時間序列的欄位：區間內的平均 K/D 與四個倍率
+COHORT_FIELDS = ("kd", "HP_Mult", "ATK_Mult", "Det_Range", "Move_Speed")
+CONTROL_MODE = "0"
+# 計為「完成」的通關結果字串：Unity 端寫入 Success / Loss，舊版客戶端使用 Completed
+SUCCESS_RESULTS = ("Success", "Completed")
+
+
+def lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets：保留首尾點，其餘每個區間挑出與前一個選中點、下一區間平均點
+    圍成三角形面積最大的點，能以少量點保留曲線的峰谷形狀；points 為依 x 排序的 (x, y)
+    """
+    n = len(points)
+    if threshold >= n or n <= 2:
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]]
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        count = avg_end - avg_start
+        avg_x = sum(points[j][0] for j in range(avg_start, avg_end)) / count
+        avg_y = sum(points[j][1] for j in range(avg_start, avg_end)) / count
+        ax, ay = points[a]
+        best, best_area = int(i * every) + 1, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def minmax(points, width):
+    """
+    每兩個像素一個區間，保留區間內的最小與最大值 (依 x 先後)，尖峰一定會出現在圖上
+    """
+    n = len(points)
+    if width >= n:
+        return list(points)
+    buckets = max(1, width // 2)
+    sampled = []
+    for b in range(buckets):
+        chunk = points[b * n // buckets:(b + 1) * n // buckets]
+        if not chunk:
+            continue
+        low = min(range(len(chunk)), key=lambda j: chunk[j][1])
+        high = max(range(len(chunk)), key=lambda j: chunk[j][1])
+        sampled.extend(chunk[j] for j in sorted({low, high}))
+    return sampled
+
+
+def downsample(points, width=DEFAULT_WIDTH, method="lttb"):
+    if method not in METHODS:
+        raise ValueError(f"method 必須是 {' / '.join(METHODS)}")
+    width = max(2, min(int(width), MAX_WIDTH))
+    return lttb(points, width) if method == "lttb" else minmax(points, width)
+
+
+def history_series(records, first_seq, width=DEFAULT_WIDTH, method="lttb"):
+    """
+    將 HistoryRecord 序列轉成各欄位的 [[序號, 值], ...]，每個欄位各自降採樣 (峰谷位置不同)
+    """
+    series = {}
+    for field in SERIES_FIELDS:
+        points = [(first_seq + i, getattr(r, field)) for i, r in enumerate(records)]
+        series[field] = [list(p) for p in downsample(points, width, method)]
+    return series
+
+
+def _group(mode):
+    return "control" if mode == CONTROL_MODE else "dda"
+
+
+class _Cohort:
+    """
+    單一模式的累計量：全部以總和與計數保存 (不保留玩家 ID)，不同模式可直接相加合併 (例如所有 DDA 模式)
+    """
+    __slots__ = ("players", "steps", "kd_sum", "kd_sq", "param_sums", "actions", "deaths", "finals", "completed",
+                 "final_sums", "buckets")
+
+    def __init__(self, max_buckets=COHORT_BUCKETS):
+        self.players = 0
+        self.steps = 0
+        self.kd_sum = self.kd_sq = 0.0
+        self.param_sums = [0.0] * 4
+        self.actions = {}
+        self.deaths = 0
+        self.finals = self.completed = 0
+        self.final_sums = {"completionTime": 0.0, "kills": 0.0, "deaths": 0.0, "totalDamage": 0.0,
+                           "damageTaken": 0.0}
+        # 每個區間為 [起始時間, 筆數, K/D 總和, 四個倍率總和]
+        self.buckets = deque(maxlen=max_buckets)
+
+    def merge(self, other):
+        self.players += other.players
+        self.steps += other.steps
+        self.kd_sum += other.kd_sum
+        self.kd_sq += other.kd_sq
+        self.param_sums = [a + b for a, b in zip(self.param_sums, other.param_sums)]
+        for action, n in other.actions.items():
+            self.actions[action] = self.actions.get(action, 0) + n
+        self.deaths += other.deaths
+        self.finals += other.finals
+        self.completed += other.completed
+        for key, value in other.final_sums.items():
+            self.final_sums[key] += value
+        merged = {b[0]: list(b) for b in self.buckets}
+        for bucket in other.buckets:
+            if bucket[0] in merged:
+                merged[bucket[0]] = [bucket[0]] + [a + b for a, b in zip(merged[bucket[0]][1:], bucket[1:])]
+            else:
+                merged[bucket[0]] = list(bucket)
+        self.buckets = deque(sorted(merged.values()), maxlen=max(self.buckets.maxlen, other.buckets.maxlen))
+        return self
+
+    def summary(self, width=None, method="lttb", series=True):
+        steps = self.steps
+        mean_kd = self.kd_sum / steps if steps else None
+        finals = self.finals
+        result = {"players": self.players, "steps": steps, "mean_kd": mean_kd,
+                  "std_kd": max(0.0, self.kd_sq / steps - mean_kd ** 2) ** 0.5 if steps else None,
+                  "mean_params": {key: total / steps if steps else None
+                                  for key, total in zip(COHORT_FIELDS[1:], self.param_sums)},
+                  "actions": dict(sorted(self.actions.items())), "deaths": self.deaths,
+                  "death_rate": self.deaths / steps if steps else None,
+                  "finals": finals, "completion_rate": self.completed / finals if finals else None,
+                  "final_means": {key: total / finals if finals else None for key, total in self.final_sums.items()}}
+        if series:
+            # 每個區間的平均值 [[區間起始時間, 值], ...]；指定 width 時依寬度降採樣
+            result["series"] = {}
+            for k, field in enumerate(COHORT_FIELDS):
+                points = [(b[0], b[2 + k] / b[1]) for b in self.buckets if b[1]]
+                result["series"][field] = [list(p) for p in (downsample(points, width, method) if width else points)]
+        return result
+
+
+class CohortStats:
+    """
+    依模式增量累計跨玩家統計：每一步與每筆通關結果寫入時更新 (一次持鎖、只做加法)，查詢時不需掃描 session
+    記憶體只隨模式數與時間區間數成長；玩家數是在該模式開始的 session 數 (同一玩家換模式會各計一次)
+    統計只涵蓋本行程啟動後的資料；多 worker 部署時每個 worker 各自累計
+    """
+
+    def __init__(self, bucket_seconds=COHORT_BUCKET, max_buckets=COHORT_BUCKETS, success_results=SUCCESS_RESULTS):
+        self.bucket_seconds = bucket_seconds
+        self.max_buckets = max_buckets
+        self.success_results = frozenset(success_results)
+        self.started_at = None
+        self._cohorts = {}
+        self._lock = threading.Lock()
+
+    def _cohort(self, mode):
+        # 呼叫端須持有 self._lock
+        cohort = self._cohorts.get(mode)
+        if cohort is None:
+            cohort = self._cohorts[mode] = _Cohort(self.max_buckets)
+        return cohort
+
+    def record_step(self, ts, mode, status, kd, params, action, new_player=False):
+        """
+        new_player 為該玩家 session 的第一步 (呼叫端由歷史序號判斷)，用於累計玩家數
+        """
+        start = ts - ts % self.bucket_seconds
+        values = (params["HP_Mult"], params["ATK_Mult"], params["Det_Range"], params["Move_Speed"])
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = ts
+            c = self._cohort(mode)
+            c.players += new_player
+            c.steps += 1
+            c.kd_sum += kd
+            c.kd_sq += kd * kd
+            c.param_sums = [s + v for s, v in zip(c.param_sums, values)]
+            c.actions[action] = c.actions.get(action, 0) + 1
+            if status == "Dead":
+                c.deaths += 1
+            buckets = c.buckets
+            # 同一區間的資料累加到最後一個區間 (時間略早的批次資料也併入，避免逐一搜尋)
+            if not buckets or start > buckets[-1][0]:
+                buckets.append([start, 0, 0.0, 0.0, 0.0, 0.0, 0.0])
+            bucket = buckets[-1]
+            bucket[1] += 1
+            bucket[2] += kd
+            for k, v in enumerate(values):
+                bucket[3 + k] += v
+
+    def record_final(self, ts, mode, data):
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = ts
+            c = self._cohort(mode)
+            c.finals += 1
+            c.completed += data.get("result") in self.success_results
+            for key in c.final_sums:
+                try:
+                    c.final_sums[key] += float(data.get(key) or 0)
+                except (TypeError, ValueError):
+                    pass
+
+    def summary(self, width=None, method="lttb", series=True):
+        """
+        回傳 {"modes": {模式: 統計}, "groups": {"control": ..., "dda": ...}}；groups 為控制組與所有 DDA 模式的合併
+        series=False 時省略時間序列 (只需要表格數字的面板)
+        """
+        if method not in METHODS:
+            raise ValueError(f"method 必須是 {' / '.join(METHODS)}")
+        with self._lock:
+            # 先在鎖內複製累計量 (只有少數幾個模式)，合併與降採樣在鎖外進行
+            cohorts = {mode: _Cohort(self.max_buckets).merge(c) for mode, c in self._cohorts.items()}
+            started_at = self.started_at
+        groups = {"control": _Cohort(self.max_buckets), "dda": _Cohort(self.max_buckets)}
+        for mode, cohort in cohorts.items():
+            groups[_group(mode)].merge(cohort)
+        return {"since": started_at, "bucket_seconds": self.bucket_seconds,
+                "modes": {mode: cohort.summary(width, method, series) for mode, cohort in sorted(cohorts.items())},
+                "groups": {name: cohort.summary(width, method, series) for name, cohort in groups.items()}}
@@ -0,0 +1,17 @@
+# 批次路由的波次切分：/adjust_difficulty_batch 以 model_core.adjust_difficulty_dda_batch 向量化計算每個波次，
+# 玩家狀態一律保存在 session 儲存中 (不另外維護陣列副本)
+
+
+def split_waves(player_ids):
+    """
+    將一批玩家切成多個波次，同一波次內每位玩家只出現一次，且同一玩家的先後順序不變
+    回傳每個波次在原序列中的索引清單
+    """
+    waves, seen_count = [], {}
+    for i, player_id in enumerate(player_ids):
+        n = seen_count.get(player_id, 0)
+        seen_count[player_id] = n + 1
+        if n == len(waves):
+            waves.append([])
+        waves[n].append(i)
+    return waves
@@ -0,0 +1,223 @@
+# 查表式 DDA：倍率只會以幾個固定速率朝 P_Strong / P_Weak 內插，預先把量化網格上每個值的下一步算好，
+# 請求時只需換算網格索引並查表；顯示用的兩位小數與 BASE_STATS 實值字串也一併預先產生
+# 用法: python dda_table.py --step 0.0001  (輸出表格大小、誤差上界、實測誤差與每步耗時)
+import argparse
+import math
+import random
+import threading
+import time
+
+from model_core import session_step, DEFAULT_POLICY, PARAM_KEYS
+
+# 網格間距；誤差上界與間距成正比 (見 DifficultyTable.accuracy_bound)
+TABLE_STEP = 1e-4
+# 與 flask_api.BASE_STATS 對應的鍵與 CSV 實值格式
+BASE_KEYS = ("HP", "ATK", "DET", "SPD")
+REAL_FORMATS = ("{:.1f}", "{:.1f}", "{:.1f}", "{:.2f}")
+# 轉移種類：朝 P_Strong (開場校準 / 一般 / 冷靜期受限) 或 P_Weak (開場校準 / 一般 / 死亡急降) 內插
+MAPS = ("up_fast", "up_normal", "up_restricted", "down_fast", "down_normal", "emergency")
+UP_FAST, UP_NORMAL, UP_RESTRICTED, DOWN_FAST, DOWN_NORMAL, EMERGENCY = range(len(MAPS))
+
+
+def format_display(params, base_stats):
+    """
+    精確路徑的顯示值，格式與 DifficultyTable.display 相同：(兩位小數倍率, 倍率字串, BASE_STATS 實值字串)
+    """
+    values = [params[key] for key in PARAM_KEYS]
+    return (tuple(round(v, 2) for v in values), tuple(f"{v:.2f}" for v in values),
+            tuple(real_format.format(v * base_stats[base_key])
+                  for v, real_format, base_key in zip(values, REAL_FORMATS, BASE_KEYS)))
+
+
+class DifficultyTable:
+    """
+    一組 P_Strong / P_Weak 的轉移表：每個倍率各自一條網格，範圍是 1.0 與兩個目標值圍出的區間 (可達狀態都在其中)
+    session_step() 的決策 (動作、冷靜期、校準) 與 model_core.session_step 完全相同，只有倍率落在網格上
+    """
+
+    def __init__(self, P_Strong, P_Weak, base_stats, policy=None, step=TABLE_STEP):
+        # numpy 只在建表時使用，未啟用查表的伺服器不需載入
+        import numpy as np
+        self.policy = policy = policy or DEFAULT_POLICY
+        self.step_size = step
+        self.P_Strong = P_Strong
+        self.P_Weak = P_Weak
+        self.lo, self.size, self.values = [], [], []
+        self.next = [[None] * len(PARAM_KEYS) for _ in MAPS]
+        self.rounded, self.mult_text, self.real_text = [], [], []
+        # 多個請求執行緒共用同一張表，改走精確計算的次數以鎖累加 (只在超出網格時發生，不影響查表路徑)
+        self.fallbacks = 0
+        self._fallback_lock = threading.Lock()
+        for k, key in enumerate(PARAM_KEYS):
+            strong, weak = P_Strong[key], P_Weak[key]
+            first = math.floor(min(1.0, strong, weak) / step)
+            last = math.ceil(max(1.0, strong, weak) / step)
+            grid = np.round(np.arange(first, last + 1) * step, 12)
+            self.lo.append(first * step)
+            self.size.append(len(grid))
+            self.values.append(grid.tolist())
+            for m, (target, rate, damping) in enumerate(self._maps(strong, weak)):
+                lerped = grid + (target - grid) * rate
+                if damping is not None:
+                    lerped = grid + (lerped - grid) * damping
+                self.next[m][k] = np.clip(np.rint((lerped - self.lo[k]) / step), 0, len(grid) - 1).astype(int).tolist()
+            self.rounded.append([round(v, 2) for v in self.values[k]])
+            self.mult_text.append([f"{v:.2f}" for v in self.values[k]])
+            real_format, base = REAL_FORMATS[k], base_stats[BASE_KEYS[k]]
+            self.real_text.append([real_format.format(v * base) for v in self.values[k]])
+        self._one = [self.index_of(k, 1.0) for k in range(len(PARAM_KEYS))]
+        # 每個倍率的 (鍵, 下界, 1/間距, 格數)，請求路徑以區域變數展開，避免逐一呼叫 index_of
+        self._axes = tuple(zip(PARAM_KEYS, self.lo, [1.0 / step] * len(PARAM_KEYS), self.size))
+
+    def _maps(self, strong, weak):
+        # 與 session_step 相同的運算順序：受限加難是先內插再乘上抑制比例
+        p = self.policy
+        return ((strong, p.rate_fast, None), (strong, p.rate_normal, None), (strong, p.rate_normal, p.recovery_damping),
+                (weak, p.rate_fast, None), (weak, p.rate_normal, None), (weak, p.emergency_rate, None))
+
+    def index_of(self, k, value):
+        # 不在網格範圍內 (例如熱更新前留下的倍率) 回傳 None
+        i = int((value - self.lo[k]) / self.step_size + 0.5)
+        return i if 0 <= i < self.size[k] else None
+
+    def indices(self, params):
+        idx = []
+        for key, lo, inv, size in self._axes:
+            i = int((params[key] - lo) * inv + 0.5)
+            if not 0 <= i < size:
+                return None
+            idx.append(i)
+        return idx
+
+    def params_of(self, idx):
+        values = self.values
+        return {"HP_Mult": values[0][idx[0]], "ATK_Mult": values[1][idx[1]], "Det_Range": values[2][idx[2]],
+                "Move_Speed": values[3][idx[3]]}
+
+    def display(self, idx):
+        """
+        回傳 (四捨五入到兩位的倍率, 倍率字串, BASE_STATS 實值字串)，皆依 PARAM_KEYS 順序
+        """
+        i0, i1, i2, i3 = idx
+        rounded, mult, real = self.rounded, self.mult_text, self.real_text
+        return ((rounded[0][i0], rounded[1][i1], rounded[2][i2], rounded[3][i3]),
+                (mult[0][i0], mult[1][i1], mult[2][i2], mult[3][i3]),
+                (real[0][i0], real[1][i1], real[2][i2], real[3][i3]))
+
+    def _apply(self, m, idx):
+        table = self.next[m]
+        return [table[0][idx[0]], table[1][idx[1]], table[2][idx[2]], table[3][idx[3]]]
+
+    def session_step(self, params, recovery_counter, has_calibrated, player_data, dead=False, tutorial=False,
+                     control=False):
+        """
+        與 model_core.session_step 相同的介面，回傳 (新倍率, 新冷靜期計數, 新校準旗標, 動作, 網格索引)
+        倍率不在網格範圍內時改走精確計算，網格索引為 None
+        """
+        idx = self.indices(params)
+        if idx is None:
+            with self._fallback_lock:
+                self.fallbacks += 1
+            return session_step(params, recovery_counter, has_calibrated, player_data, self.P_Strong, self.P_Weak,
+                                dead, tutorial, control, self.policy) + (None,)
+        policy = self.policy
+        if control:
+            idx = self._one
+            return self.params_of(idx), recovery_counter, has_calibrated, "Monitoring (Control)", idx
+        if dead:
+            idx = self._apply(EMERGENCY, idx)
+            return self.params_of(idx), policy.recovery_steps, has_calibrated, "Emergency Down (Death)", idx
+
+        recovering = recovery_counter > 0
+        if recovering:
+            recovery_counter -= 1
+            is_first = False
+        else:
+            is_first = not has_calibrated and player_data.get("game_time", 0) > 2 and not tutorial
+            has_calibrated = has_calibrated or is_first
+        if tutorial:
+            return params, recovery_counter, has_calibrated, "Tutorial Monitoring", idx
+
+        kill = player_data.get("kill_count", 0)
+        death = player_data.get("death_count", 0)
+        ratio = kill / (death if death > 0 else 0.5)
+        if ratio > policy.strong_threshold:
+            if recovering:
+                m, action = UP_RESTRICTED, "Adjusted Up (Restricted)"
+            else:
+                m, action = (UP_FAST if is_first else UP_NORMAL), "Adjusted Up"
+        elif ratio < policy.weak_threshold:
+            m, action = (DOWN_FAST if is_first else DOWN_NORMAL), "Adjusted Down"
+        else:
+            return params, recovery_counter, has_calibrated, "Stay Balanced", idx
+        idx = self._apply(m, idx)
+        return self.params_of(idx), recovery_counter, has_calibrated, action, idx
+
+    def accuracy_bound(self):
+        """
+        與精確浮點路徑相比，任意長度軌跡上每個倍率的最大絕對誤差
+        每次移動的誤差為 e' <= (1 - r) e + step / 2 (r 為該步速率，不移動時誤差不變，控制組歸零)，
+        因此 e <= step / (2 * 最小速率)；另加網格值本身的捨入 (1e-12)
+        """
+        p = self.policy
+        rates = (p.rate_fast, p.rate_normal, p.rate_normal * p.recovery_damping, p.emergency_rate)
+        return self.step_size / (2 * min(rates)) + 1e-12
+
+    def stats(self):
+        return {"step": self.step_size, "entries": sum(self.size), "transitions": sum(self.size) * len(MAPS),
+                "accuracy_bound": self.accuracy_bound(), "fallbacks": self.fallbacks}
+
+
+def verify(table, players=200, steps=500, seed=0):
+    """
+    以隨機遙測同時跑查表與精確路徑，回傳 (倍率最大絕對誤差, 決策不一致的步數)
+    """
+    rng = random.Random(seed)
+    max_error, mismatches = 0.0, 0
+    for _ in range(players):
+        exact = grid = {key: 1.0 for key in PARAM_KEYS}
+        exact_state = grid_state = (0, False)
+        for t in range(steps):
+            data = {"kill_count": rng.choice((0, 0, 1, 2, 3, 5, 8)), "death_count": rng.choice((0, 1, 1, 2, 3, 4)),
+                    "game_time": t * 5}
+            flags = {"dead": rng.random() < 0.05, "tutorial": rng.random() < 0.05, "control": rng.random() < 0.01}
+            exact, *rest = session_step(exact, *exact_state, data, table.P_Strong, table.P_Weak, policy=table.policy,
+                                        **flags)
+            exact_state, exact_action = tuple(rest[:2]), rest[2]
+            grid, *rest = table.session_step(grid, *grid_state, data, **flags)
+            grid_state, grid_action = tuple(rest[:2]), rest[2]
+            mismatches += exact_action != grid_action or exact_state != grid_state
+            max_error = max(max_error, max(abs(exact[key] - grid[key]) for key in PARAM_KEYS))
+    return max_error, mismatches
+
+
+if __name__ == "__main__":
+    from model_registry import ModelRegistry
+
+    parser = argparse.ArgumentParser(description="建立 DDA 查表並檢查誤差上界")
+    parser.add_argument("--step", type=float, default=TABLE_STEP, help="網格間距")
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=500)
+    args = parser.parse_args()
+
+    profiles = ModelRegistry("P_Strong.json", "P_Weak.json").current
+    base_stats = {"HP": 100.0, "ATK": 10.0, "DET": 20.0, "SPD": 2.5}
+    t0 = time.perf_counter()
+    table = DifficultyTable(profiles.strong, profiles.weak, base_stats, step=args.step)
+    print(f"📋 模型 {profiles.version}：{table.stats()}，建表 {time.perf_counter() - t0:.3f}s")
+    max_error, mismatches = verify(table, args.players, args.steps)
+    print(f"   實測最大誤差 {max_error:.2e} (上界 {table.accuracy_bound():.2e})，決策不一致 {mismatches} 步")
+
+    # 每步耗時包含產生歷史與 CSV 顯示值 (伺服器每個請求都需要)
+    data = {"kill_count": 3, "death_count": 1, "game_time": 30}
+    params = table.params_of(table.indices({key: 1.0 for key in PARAM_KEYS}))
+    n = 100000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        format_display(session_step(params, 0, True, data, profiles.strong, profiles.weak)[0], base_stats)
+    exact_us = (time.perf_counter() - t0) / n * 1e6
+    t0 = time.perf_counter()
+    for _ in range(n):
+        table.display(table.session_step(params, 0, True, data)[4])
+    table_us = (time.perf_counter() - t0) / n * 1e6
+    print(f"   每步耗時 (含顯示值)：精確 {exact_us:.2f} µs，查表 {table_us:.2f} µs")
@@ -0,0 +1,69 @@
+import json
+import queue
+import threading
+
+
+class Subscription:
+    """
+    單一訂閱者的有界佇列；佇列滿時丟棄最舊的訊息，慢速客戶端不會阻塞發佈端
+    """
+
+    def __init__(self, maxsize, player_id=None):
+        self.player_id = player_id
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def offer(self, player_id, message):
+        if self.player_id is not None and self.player_id != player_id:
+            return
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        # 逾時回傳 None，呼叫端可藉此送出心跳
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """
+    將新的歷史紀錄與最終結果推播給所有訂閱者 (SSE 連線)
+    """
+
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, player_id=None):
+        subscription = Subscription(self.queue_size, player_id)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, player_id, event):
+        # 沒有訂閱者時直接返回；有的話只序列化一次再分送
+        if not self._subscribers:
+            return
+        message = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.offer(player_id, message)
@@ -1,13 +1,27 @@
-from flask import Flask, request, jsonify, render_template_string
-from model_core import evaluate_from_unity, adjust_difficulty_dda
-import pickle
+# 啟動流程：匯入本模組只定義設定與處理函式 (不讀檔、不啟動執行緒，也不匯入 Flask 或 numpy)；
+# 執行期狀態由 start() 建立，Flask 路由由 create_app() 建立，ASGI 模式 (asgi_api) 只需要 start()
+# 啟動: python flask_api.py，或以 WSGI 伺服器載入 "flask_api:create_app()" (舊的 flask_api:app 仍可使用)
+from model_core import session_step, adjust_difficulty_dda_batch, PARAM_KEYS, ACTIONS
+from session_store import create_session_store, new_session, HistoryRecord
+from session_journal import SessionJournal
+from log_writer import BatchedCSVWriter, FileLock
+from event_broker import EventBroker
+from model_registry import ModelRegistry
+from telemetry_store import TelemetryStore, LOG_HEADER, FINAL_HEADER, HEADER_ALIASES
+from metrics import Metrics, SamplingProfiler, NULL_TIMER
+from dda_table import DifficultyTable, format_display, TABLE_STEP
+from dda_engine import split_waves
+from dashboard_agg import CohortStats, history_series, DEFAULT_WIDTH, COHORT_BUCKET, SUCCESS_RESULTS
+import atexit
+import hmac
+import ipaddress
+import threading
 import json
 import csv
+import time
 from datetime import datetime
 import os
 
-app = Flask(__name__)
-
 # --- 1. 殭屍基礎數值定義 (與 Unity 初始設定同步) ---
 BASE_STATS = {
     "HP": 100.0,
@@ -16,39 +30,142 @@ BASE_STATS = {
     "SPD": 2.5
 }
 
-# --- 2. 載入模型參數 ---
-try:
-    with open("P_Strong.pkl", "rb") as f:
-        P_Strong = pickle.load(f)
-    with open("P_Weak.pkl", "rb") as f:
-        P_Weak = pickle.load(f)
-    print("✅ 成功載入模型參數。")
-except FileNotFoundError:
-    print("⚠️ 找不到模型檔案，使用預設安全邊界。")
-    P_Strong = {"HP_Mult": 1.4, "ATK_Mult": 1.2, "Det_Range": 1.1, "Move_Speed": 1.2}
-    P_Weak = {"HP_Mult": 0.8, "ATK_Mult": 0.8, "Det_Range": 0.9, "Move_Speed": 0.9}
+# --- 2. 模型參數設定 ---
+# 模型由 MODEL_REGISTRY 管理 (start() 載入 JSON 模型檔)：檔案更新或呼叫 /admin/reload_model 時原子替換，不需重啟伺服器
+MODEL_FILES = ("P_Strong.json", "P_Weak.json")
+MODEL_WATCH_INTERVAL = float(os.environ.get("DDA_MODEL_WATCH_INTERVAL", 5.0))
+MODEL_REGISTRY = None
+# 設定後 /admin/* 需帶 X-Admin-Token 標頭；未設定時只接受本機 (loopback) 連線，伺服器綁定 0.0.0.0 也不會對外開放
+ADMIN_TOKEN = os.environ.get("DDA_ADMIN_TOKEN")
+# 線上最佳化：DDA_ONLINE_OPT=player (每位玩家) 或 cohort (每個模式一組)，以真實遙測在 GA 模型附近調整目標；未設定則固定使用 GA 模型
+ONLINE_OPT_SCOPE = os.environ.get("DDA_ONLINE_OPT", "")
+OPTIMIZER = None
+# 查表模式：DDA_LOOKUP_TABLE=1 時單筆調整改用預先計算的轉移表 (倍率落在 DDA_LOOKUP_STEP 網格上，誤差有上界)，
+# 適合低功耗的邊緣伺服器；線上最佳化的目標每位玩家不同，啟用時不使用查表
+LOOKUP_TABLE = os.environ.get("DDA_LOOKUP_TABLE", "0") == "1"
+LOOKUP_STEP = float(os.environ.get("DDA_LOOKUP_STEP", TABLE_STEP))
+# (模型版本, 轉移表) 以單一 tuple 整體替換，讀取端不會拿到舊表配新版本
+_lookup = (None, None)
+_lookup_lock = threading.Lock()
 
 # --- 3. 全域狀態管理與 CSV 標題初始化 ---
-PLAYER_SESSIONS = {}
+# 以下為 None 的狀態皆由 start() 建立
+# DDA_SESSION_BACKEND=sqlite 時多個 worker 共用 SESSION_DB_FILE；預設為單一行程的記憶體儲存
+SESSION_BACKEND = os.environ.get("DDA_SESSION_BACKEND", "memory")
+SESSION_DB_FILE = os.environ.get("DDA_SESSION_DB", "dda_sessions.db")
+# 記憶體上限：每位玩家的歷史深度，以及閒置多久 (秒) 後把 session 落地到 SESSION_SPILL_DIR
+HISTORY_DEPTH = int(os.environ.get("DDA_HISTORY_DEPTH", 2000))
+IDLE_TIMEOUT = float(os.environ.get("DDA_IDLE_TIMEOUT", 1800))
+SESSION_SPILL_DIR = os.environ.get("DDA_SPILL_DIR", "session_spill")
+SESSION_STORE = None
+# 記憶體 session 的 WAL 與 checkpoint (SQLite 後端本身已持久化)：重啟或滾動部署後玩家沿用原本的難度
+SNAPSHOT_DIR = os.environ.get("DDA_SNAPSHOT_DIR", "session_snapshots")
+SESSION_JOURNAL = None
 LOG_FILE = "dda_experiment_logs.csv"
 FINAL_RESULT_FILE = "final_experiment_results.csv"
 
 
-def init_csv_files():
-    log_header = ["時間", "玩家ID", "模式", "場景", "狀態", "K/D值", "HP倍率", "ATK倍率", "DET倍率", "SPD倍率",
-                  "HP實值", "ATK實值", "DET實值", "SPD實值", "動作"]
-    if not os.path.exists(LOG_FILE) or os.path.getsize(LOG_FILE) == 0:
-        with open(LOG_FILE, 'w', newline='', encoding='utf-8') as f:
-            csv.writer(f).writerow(log_header)
-
-    final_header = ["紀錄時間", "玩家ID", "模式", "總造成傷害", "總受到傷害", "擊殺數", "死亡數", "通關時間",
-                    "結果狀態"]
-    if not os.path.exists(FINAL_RESULT_FILE) or os.path.getsize(FINAL_RESULT_FILE) == 0:
-        with open(FINAL_RESULT_FILE, 'w', newline='', encoding='utf-8') as f:
-            csv.writer(f).writerow(final_header)
+def _ensure_csv_header(path, header):
+    """
+    建立或遷移 CSV 標題，回傳是否可以繼續附加資料列
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(header)
+        return True
+    with open(path, newline='', encoding='utf-8') as f:
+        existing = next(csv.reader(f), [])
+    if existing == header:
+        return True
+    # 舊版檔案缺少後來新增的欄位 (或欄位改過名稱) 時，一次性改寫標題並將舊資料列補空值
+    if [HEADER_ALIASES.get(name, name) for name in existing] == header[:len(existing)]:
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))[1:]
+        pad = [""] * (len(header) - len(existing))
+        with open(path + ".tmp", 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(row + pad if row else row for row in rows)
+        os.replace(path + ".tmp", path)
+        return True
+    # 欄位對不上時不可附加，否則新資料列的欄數與標題不一致
+    print(f"⚠️ {path} 的標題無法遷移 ({','.join(existing)})，本次執行不寫入此檔案；請改名或移走舊檔後重啟。")
+    return False
 
 
-init_csv_files()
+def init_csv_files():
+    # 回傳標題無法遷移、不可附加資料列的檔案；多行程寫檔時在跨行程鎖內檢查，避免兩個 worker 同時建立或改寫標題
+    refused = []
+    for path, header in ((LOG_FILE, LOG_HEADER), (FINAL_RESULT_FILE, FINAL_HEADER)):
+        if LOG_INTERPROCESS:
+            lock = FileLock(path)
+            try:
+                with lock:
+                    ok = _ensure_csv_header(path, header)
+            finally:
+                lock.close()
+        else:
+            ok = _ensure_csv_header(path, header)
+        if not ok:
+            refused.append(path)
+    return refused
+
+
+# 背景批次寫檔：請求只負責排入佇列；DDA_LOG_FSYNC 可設為 never / batch / interval
+LOG_WRITER = None
+# 多個行程 (asgi_api --workers) 寫同一組 CSV 時設為 1：標題檢查與每批附加都以 FileLock 跨行程互斥
+LOG_INTERPROCESS = os.environ.get("DDA_LOG_INTERPROCESS", "0") == "1"
+# 欄位式遙測 (完整精度與 epoch 時間)，供分析用 telemetry_store 的查詢 API 讀取；DDA_TELEMETRY_DIR 設為空字串可停用
+TELEMETRY_DIR = os.environ.get("DDA_TELEMETRY_DIR", "telemetry")
+TELEMETRY = None
+
+# 監控面板推播：每個 SSE 連線一個有界佇列，慢速客戶端只會丟失自己的舊訊息
+EVENT_BROKER = EventBroker(queue_size=int(os.environ.get("DDA_SSE_QUEUE", 256)))
+SSE_HEARTBEAT = 15.0
+# 推播只送給同一行程內的訂閱者；多 worker 時 (DDA_SSE=0) 停用 /events，面板改為定期輪詢，才看得到其他 worker 處理的玩家
+SSE_ENABLED = os.environ.get("DDA_SSE", "1") != "0"
+# 面板的族群比較：依模式增量累計 (每一步只做幾次加法)，/cohorts 查詢時不需掃描所有 session
+# DDA_SUCCESS_RESULTS 為以逗號分隔、計入完成率的通關結果字串
+COHORTS = CohortStats(bucket_seconds=float(os.environ.get("DDA_COHORT_BUCKET", COHORT_BUCKET)),
+                      success_results=os.environ.get("DDA_SUCCESS_RESULTS", ",".join(SUCCESS_RESULTS)).split(","))
+
+# 請求各階段計時與 /metrics (Prometheus 格式)；DDA_METRICS=0 停用計時與計數，只保留即時狀態
+METRICS = Metrics(enabled=os.environ.get("DDA_METRICS", "1") != "0")
+# 「活躍玩家」的判定：最近幾秒內有送出遙測
+ACTIVE_WINDOW = float(os.environ.get("DDA_ACTIVE_WINDOW", 60.0))
+# 取樣分析器預設關閉，由 /admin/profiler 在執行中開關
+PROFILER = SamplingProfiler()
+
+
+def _collect_gauges():
+    # 每次輸出 /metrics 時才讀取的即時狀態
+    samples = [("ready", "是否可接受流量 (與 /readyz 相同)", (), int(STARTUP["state"] == "ready"))]
+    samples += [("startup_phase_seconds", "start() 各階段的耗時", (("phase", phase),), seconds)
+                for phase, seconds in STARTUP["phases"].items()]
+    if SESSION_STORE is None:
+        return samples
+    sessions = SESSION_STORE.stats(ACTIVE_WINDOW)
+    writer = LOG_WRITER.stats()
+    samples += [("sessions", "目前的 session 數 (memory 為記憶體中，cold 為已落地或尚未載回，stored 為 SQLite 中的總數)",
+                 (("state", state),), sessions.get(key))
+                for state, key in (("memory", "in_memory"), ("cold", "cold"), ("stored", "stored"))]
+    samples += [("active_sessions", f"最近 {ACTIVE_WINDOW:g} 秒內有更新的玩家數", (), sessions["active"]),
+                ("history_records", "記憶體中保留的歷史紀錄總筆數", (), sessions["history_records"]),
+                ("log_queue_pending", "CSV 日誌佇列中尚未寫入的項目數", (), writer["pending"])]
+    for state in ("written", "backpressured", "dropped", "refused"):
+        samples.append(("log_rows", "CSV 日誌寫入器累計處理的資料列 (依結果)", (("state", state),), writer[state]))
+    samples.append(("sse_subscribers", "目前的 SSE 訂閱連線數", (), EVENT_BROKER.subscriber_count()))
+    samples.append(("model_info", "目前使用的模型版本", (("version", MODEL_REGISTRY.current.version),), 1))
+    samples.append(("profiler_running", "取樣分析器是否開啟", (), int(PROFILER.running)))
+    table = _lookup[1]
+    if table is not None:
+        samples.append(("lookup_fallbacks", "查表模式中倍率超出網格、改走精確計算的次數", (), table.fallbacks))
+    if OPTIMIZER is not None:
+        samples.append(("optimizer_states", "線上最佳化保留的狀態數", (), OPTIMIZER.stats()["states"]))
+    return samples
+
+
+METRICS.register_gauges(_collect_gauges)
 
 # --- 4. 監控面板 HTML 模板 (恢復完整欄位版) ---
 DASHBOARD_HTML = """
@@ -145,26 +262,113 @@ DASHBOARD_HTML = """
             <div class="bg-slate-800 p-6 rounded-2xl h-[400px] shadow-xl"><canvas id="kdChart"></canvas></div>
             <div class="bg-slate-800 p-6 rounded-2xl h-[400px] shadow-xl"><canvas id="paramChart"></canvas></div>
         </div>
+
+        <!-- 4. 族群比較 (控制組 vs DDA，伺服器端增量統計) -->
+        <div class="bg-slate-800/80 p-5 rounded-2xl border border-slate-700 shadow-xl mt-6">
+            <h3 class="text-sm font-bold text-indigo-400 mb-3 border-b border-slate-700 pb-2">族群比較 (控制組 vs DDA)</h3>
+            <table class="w-full text-xs text-center">
+                <thead class="text-slate-500 uppercase">
+                    <tr><th class="p-2">組別 / 模式</th><th>玩家數</th><th>步數</th><th>平均 K/D</th><th>平均 HP 倍率</th><th>死亡率</th><th>通關數</th><th>完成率</th><th>平均通關耗時</th></tr>
+                </thead>
+                <tbody id="cohortRows" class="font-mono"></tbody>
+            </table>
+        </div>
     </div>
 
     <script>
         let selectedPlayer = 'latest';
         const BASE = {{ BASE_STATS | tojson }};
-        const kdChart = new Chart(document.getElementById('kdChart').getContext('2d'), { type: 'line', data: { labels: [], datasets: [{ label: 'K/D Ratio', borderColor: '#22d3ee', data: [], tension: 0.4 }] }, options: { responsive: true, maintainAspectRatio: false }});
-        const paramChart = new Chart(document.getElementById('paramChart').getContext('2d'), { type: 'line', data: { labels: [], datasets: [
+        const SSE_ENABLED = {{ SSE_ENABLED | tojson }};
+        // 圖表資料為 [[序號, 值], ...]，x 軸以序號定位，降採樣後的點仍落在正確位置
+        const lineOptions = { responsive: true, maintainAspectRatio: false, animation: false, elements: { point: { radius: 0 } } };
+        const kdChart = new Chart(document.getElementById('kdChart').getContext('2d'), { type: 'line', data: { datasets: [{ label: 'K/D Ratio', borderColor: '#22d3ee', data: [], tension: 0.4 }] }, options: { ...lineOptions, scales: { x: { type: 'linear' }}}});
+        const paramChart = new Chart(document.getElementById('paramChart').getContext('2d'), { type: 'line', data: { datasets: [
             { label: 'HP', borderColor: '#f87171', data: [], borderWidth: 3 },
             { label: 'ATK', borderColor: '#fbbf24', data: [], borderWidth: 2, borderDash: [5, 5] },
             { label: 'DET', borderColor: '#a78bfa', data: [], borderWidth: 2 },
             { label: 'SPD', borderColor: '#34d399', data: [], borderWidth: 3, borderDash: [2, 2] }
-        ]}, options: { responsive: true, maintainAspectRatio: false, scales: { y: { min: 0.6, max: 1.6 }}}});
+        ]}, options: { ...lineOptions, scales: { x: { type: 'linear' }, y: { min: 0.6, max: 1.6 }}}});
+        const PARAM_FIELDS = ['hp', 'atk', 'det', 'spd'];
+
+        // 圖表向伺服器要求依畫布寬度降採樣的序列 (/series)，長 session 也只傳送與繪製約每像素一點；
+        // 兩次同步之間推播的新資料點先接在尾端，超過 SERIES_REFRESH 毫秒後再整體重新降採樣
+        const SERIES_REFRESH = 5000;
+        const cache = {};
+        let renderedPlayer = null;
+        let seriesAt = 0;
+
+        function chartWidth() { return Math.max(100, Math.round(document.getElementById('kdChart').clientWidth)); }
+
+        function setSeries(series) {
+            kdChart.data.datasets[0].data = series.kd;
+            PARAM_FIELDS.forEach((f, i) => paramChart.data.datasets[i].data = series[f]);
+            kdChart.update('none');
+            paramChart.update('none');
+            seriesAt = Date.now();
+        }
 
-        async function updateDashboard() {
+        function appendPoint(seq, entry) {
+            kdChart.data.datasets[0].data.push([seq, entry.kd]);
+            PARAM_FIELDS.forEach((f, i) => paramChart.data.datasets[i].data.push([seq, entry[f]]));
+            kdChart.update('none');
+            paramChart.update('none');
+        }
+
+        function renderSession(targetID, session, last) {
+            document.getElementById('current-player').innerText = targetID;
+
+            // A. 更新指標卡片
+            document.getElementById('recovery-steps').innerText = session.recovery_counter || 0;
+
+            // B. 更新總結卡片
+            if(session.final_result) {
+                document.getElementById('finalResultCard').classList.remove('hidden');
+                const f = session.final_result;
+                document.getElementById('res-kills').innerText = f.kills || 0;
+                document.getElementById('res-deaths').innerText = f.deaths || 0;
+                document.getElementById('res-dmg-out').innerText = Math.round(f.totalDamage || 0);
+                document.getElementById('res-dmg-in').innerText = Math.round(f.damageTaken || 0);
+                document.getElementById('res-time').innerText = (f.completionTime || 0).toFixed(1) + 's';
+            } else { document.getElementById('finalResultCard').classList.add('hidden'); }
+
+            // C. 更新最新一筆紀錄的實值
+            if(last) {
+                document.getElementById('kd-display').innerText = last.kd;
+                document.getElementById('player-status').innerText = last.status;
+                document.getElementById('last-action').innerText = last.action;
+
+                document.getElementById('real-hp').innerText = (last.hp * BASE.HP).toFixed(1);
+                document.getElementById('mult-hp').innerText = `倍率: ${last.hp.toFixed(2)}x`;
+                document.getElementById('real-atk').innerText = (last.atk * BASE.ATK).toFixed(1);
+                document.getElementById('mult-atk').innerText = `倍率: ${last.atk.toFixed(2)}x`;
+                document.getElementById('real-det').innerText = (last.det * BASE.DET).toFixed(1);
+                document.getElementById('mult-det').innerText = `倍率: ${last.det.toFixed(2)}x`;
+                document.getElementById('real-spd').innerText = (last.spd * BASE.SPD).toFixed(2);
+                document.getElementById('mult-spd').innerText = `倍率: ${last.spd.toFixed(2)}x`;
+            }
+        }
+
+        function fmt(value, digits, suffix = '') { return value === null || value === undefined ? '--' : value.toFixed(digits) + suffix; }
+
+        async function updateCohorts() {
             try {
-                const res = await fetch('/get_history');
-                const allData = await res.json();
-                const players = Object.keys(allData);
+                const summary = await (await fetch('/cohorts?series=0')).json();
+                const rows = [['控制組', summary.groups.control], ['DDA (全部)', summary.groups.dda],
+                              ...Object.entries(summary.modes).map(([mode, c]) => [`模式 ${mode}`, c])];
+                document.getElementById('cohortRows').innerHTML = rows.map(([name, c]) => `<tr class="border-t border-slate-700">
+                    <td class="p-2 text-cyan-400">${name}</td><td>${c.players}</td><td>${c.steps}</td><td>${fmt(c.mean_kd, 2)}</td>
+                    <td>${fmt(c.mean_params.HP_Mult, 3)}</td><td>${fmt(c.death_rate === null ? null : c.death_rate * 100, 1, '%')}</td>
+                    <td>${c.finals}</td><td>${fmt(c.completion_rate === null ? null : c.completion_rate * 100, 1, '%')}</td>
+                    <td>${fmt(c.final_means.completionTime, 1, 's')}</td></tr>`).join('');
+            } catch (e) { console.error(e); }
+        }
 
-                const sortedPlayers = players.sort((a, b) => allData[a].last_updated - allData[b].last_updated);
+        let knownPlayers = [];
+        async function updateDashboard() {
+            try {
+                const res = await fetch('/players');
+                const sortedPlayers = (await res.json()).map(p => p.player_id);
+                knownPlayers = sortedPlayers;
 
                 const select = document.getElementById('playerSelect');
                 if(sortedPlayers.length !== (select.options.length - 1)) {
@@ -175,160 +379,621 @@ DASHBOARD_HTML = """
 
                 if(sortedPlayers.length > 0) {
                     const targetID = (selectedPlayer === 'latest') ? sortedPlayers[sortedPlayers.length - 1] : selectedPlayer;
-                    const session = allData[targetID];
-                    document.getElementById('current-player').innerText = targetID;
-
-                    // A. 更新指標卡片
-                    document.getElementById('recovery-steps').innerText = session.recovery_counter || 0;
-
-                    // B. 更新總結卡片
-                    if(session.final_result) {
-                        document.getElementById('finalResultCard').classList.remove('hidden');
-                        const f = session.final_result;
-                        document.getElementById('res-kills').innerText = f.kills || 0;
-                        document.getElementById('res-deaths').innerText = f.deaths || 0;
-                        document.getElementById('res-dmg-out').innerText = Math.round(f.totalDamage || 0);
-                        document.getElementById('res-dmg-in').innerText = Math.round(f.damageTaken || 0);
-                        document.getElementById('res-time').innerText = (f.completionTime || 0).toFixed(1) + 's';
-                    } else { document.getElementById('finalResultCard').classList.add('hidden'); }
-
-                    // C. 更新歷史與實值
-                    if(session.history.length > 0) {
-                        const last = session.history[session.history.length - 1];
-                        document.getElementById('kd-display').innerText = last.kd;
-                        document.getElementById('player-status').innerText = last.status;
-                        document.getElementById('last-action').innerText = last.action;
-
-                        document.getElementById('real-hp').innerText = (last.hp * BASE.HP).toFixed(1);
-                        document.getElementById('mult-hp').innerText = `倍率: ${last.hp.toFixed(2)}x`;
-                        document.getElementById('real-atk').innerText = (last.atk * BASE.ATK).toFixed(1);
-                        document.getElementById('mult-atk').innerText = `倍率: ${last.atk.toFixed(2)}x`;
-                        document.getElementById('real-det').innerText = (last.det * BASE.DET).toFixed(1);
-                        document.getElementById('mult-det').innerText = `倍率: ${last.det.toFixed(2)}x`;
-                        document.getElementById('real-spd').innerText = (last.spd * BASE.SPD).toFixed(2);
-                        document.getElementById('mult-spd').innerText = `倍率: ${last.spd.toFixed(2)}x`;
-
-                        kdChart.data.labels = session.history.map((_, i) => i);
-                        kdChart.data.datasets[0].data = session.history.map(h => h.kd);
-                        kdChart.update('none');
-                        paramChart.data.labels = session.history.map((_, i) => i);
-                        paramChart.data.datasets[0].data = session.history.map(h => h.hp);
-                        paramChart.data.datasets[1].data = session.history.map(h => h.atk);
-                        paramChart.data.datasets[2].data = session.history.map(h => h.det);
-                        paramChart.data.datasets[3].data = session.history.map(h => h.spd);
-                        paramChart.update('none');
-                    }
+                    const data = await (await fetch(`/series/${encodeURIComponent(targetID)}?width=${chartWidth()}`)).json();
+                    const { series, latest, ...state } = data;
+                    cache[targetID] = { cursor: data.cursor, state, latest };
+                    renderSession(targetID, state, latest);
+                    setSeries(series);
+                    renderedPlayer = targetID;
                 }
             } catch (e) { console.error(e); }
         }
-        setInterval(updateDashboard, 2000);
+
+        // 推播事件合併成一次同步，避免大量玩家同時更新時連續發出請求
+        let syncTimer = null;
+        function scheduleUpdate() {
+            if(syncTimer === null) { syncTimer = setTimeout(() => { syncTimer = null; updateDashboard(); }, 200); }
+        }
+
+        function applyEvent(ev) {
+            if(ev.type === 'final_result') { updateCohorts(); }
+            // 新玩家或「自動追蹤最新」需要切換時，改走一次增量同步
+            if(!knownPlayers.includes(ev.player_id) || (selectedPlayer === 'latest' && ev.player_id !== renderedPlayer)) { scheduleUpdate(); return; }
+            if(ev.player_id !== renderedPlayer) return;
+            const cached = cache[ev.player_id];
+            if(ev.type === 'history') {
+                // 序號不連續代表漏接 (佇列溢出或重新連線)，回頭重新同步
+                if(ev.seq !== cached.cursor) { scheduleUpdate(); return; }
+                cached.cursor += 1;
+                cached.latest = ev.entry;
+                Object.assign(cached.state, ev.state);
+                renderSession(ev.player_id, cached.state, ev.entry);
+                appendPoint(ev.seq, ev.entry);
+                if(Date.now() - seriesAt > SERIES_REFRESH) { scheduleUpdate(); }
+            } else if(ev.type === 'final_result') {
+                cached.state.final_result = ev.final_result;
+                renderSession(ev.player_id, cached.state, cached.latest);
+            }
+        }
+
+        if(window.EventSource && SSE_ENABLED) {
+            const stream = new EventSource('/events');
+            stream.onopen = () => updateDashboard();
+            stream.onmessage = e => applyEvent(JSON.parse(e.data));
+        } else {
+            setInterval(updateDashboard, 2000);
+        }
         function changePlayer() { selectedPlayer = document.getElementById('playerSelect').value; updateDashboard(); }
+        updateCohorts();
+        setInterval(updateCohorts, 5000);
     </script>
 </body>
 </html>
 """
 
 
-# --- 5. 路由處理邏輯 ---
+# --- 5. 請求處理邏輯 (Flask 路由與 asgi_api 共用) ---
+
+def list_players():
+    # 輕量玩家清單：只回傳摘要與最後更新時間 (由舊到新排序)，不含歷史資料
+    return sorted(SESSION_STORE.players(), key=lambda p: p["last_updated"])
+
 
-@app.route('/')
-def dashboard():
-    return render_template_string(DASHBOARD_HTML, BASE_STATS=BASE_STATS)
+def history_delta(player_id, since):
+    # 增量查詢：since 為客戶端已取得的序號，只回傳之後的新紀錄；游標已淘汰或超出範圍時 reset=true 並回傳保留的歷史
+    with SESSION_STORE.view(player_id) as session:
+        if session is None:
+            return None
+        history, reset = session["history"].since(since)
+        return {"player_id": player_id, "cursor": session["history"].total, "reset": reset, "history": history,
+                "params": dict(session["params"]), "recovery_counter": session["recovery_counter"],
+                "has_calibrated": session["has_calibrated"], "final_result": session["final_result"],
+                "mode": session["mode"], "last_updated": session["last_updated"]}
 
 
-@app.route('/get_history')
-def get_history_api():
-    return jsonify(PLAYER_SESSIONS)
+def player_series(player_id, width=DEFAULT_WIDTH, method="lttb"):
+    """
+    面板圖表用：依圖表寬度降採樣的 K/D 與倍率序列 ([[序號, 值], ...])、最新一筆紀錄與目前狀態
+    鎖內只複製紀錄參照，降採樣在鎖外進行
+    """
+    with SESSION_STORE.view(player_id) as session:
+        if session is None:
+            return None
+        history = session["history"]
+        records, first_seq = list(history), history.first_seq
+        result = {"player_id": player_id, "cursor": history.total, "first_seq": first_seq, "points": len(records),
+                  "params": dict(session["params"]), "recovery_counter": session["recovery_counter"],
+                  "has_calibrated": session["has_calibrated"], "final_result": session["final_result"],
+                  "mode": session["mode"], "last_updated": session["last_updated"]}
+    result["latest"] = records[-1].to_dict() if records else None
+    result["method"] = method
+    result["series"] = history_series(records, first_seq, width, method)
+    return result
 
 
-@app.route("/adjust_difficulty", methods=["POST"])
-def adjust_difficulty():
-    global PLAYER_SESSIONS
-    data = request.get_json()
+def cohort_summary(width=None, method="lttb", series=True):
+    # 依模式 (控制組 "0" 與各 DDA 模式) 的跨玩家統計，另含控制組 / DDA 的合併比較
+    return COHORTS.summary(width, method, series)
+
+
+def _parse_adjustment(data):
     player_id = (data.get("player_id") or data.get("playerID") or "Subject").strip()
-    status = data.get("status", "Alive")
-    scene = data.get("scene_name", "Unknown")
-    mode = str(data.get("mode", "0"))
-    game_time = data.get("game_time", 0)
-
-    if player_id not in PLAYER_SESSIONS:
-        PLAYER_SESSIONS[player_id] = {
-            "params": {"HP_Mult": 1.0, "ATK_Mult": 1.0, "Det_Range": 1.0, "Move_Speed": 1.0},
-            "history": [], "has_calibrated": False, "recovery_counter": 0,
-            "final_result": None, "mode": mode, "last_updated": datetime.now().timestamp()
-        }
+    return player_id, data.get("status", "Alive"), data.get("scene_name", "Unknown"), str(data.get("mode", "0"))
 
-    session = PLAYER_SESSIONS[player_id]
-    session["last_updated"] = datetime.now().timestamp()
-    session["mode"] = mode
-    is_tut = (scene == "Tutorial")
 
-    # 死亡與恢復期邏輯
-    if mode == "0":
-        session["params"] = {"HP_Mult": 1.0, "ATK_Mult": 1.0, "Det_Range": 1.0, "Move_Speed": 1.0}
-        action = "Monitoring (Control)"
-    else:
-        if status == "Dead":
-            for key in session["params"]:
-                session["params"][key] = session["params"][key] + (P_Weak[key] - session["params"][key]) * 0.7
-            action = "Emergency Down (Death)"
-            session["recovery_counter"] = 4
-        else:
-            if session["recovery_counter"] > 0:
-                new_params, action = adjust_difficulty_dda(session["params"], data, P_Strong, P_Weak, is_tut, False)
-                if "Up" in action:
-                    for key in session["params"]:
-                        session["params"][key] += (new_params[key] - session["params"][key]) * 0.3
-                    action += " (Restricted)"
-                else:
-                    session["params"] = new_params
-                session["recovery_counter"] -= 1
-            else:
-                is_first = (not session["has_calibrated"] and game_time > 2 and not is_tut)
-                if is_first: session["has_calibrated"] = True
-                new_params, action = adjust_difficulty_dda(session["params"], data, P_Strong, P_Weak, is_tut, is_first)
-                session["params"] = new_params
-
-    # 數據日誌記錄
+def _record_step(player_id, session, data, status, scene, mode, action, version, display=None):
+    # 寫入歷史並產生推播事件與 CSV 日誌列 (呼叫端須持有該玩家的 session 鎖)
+    # display 為查表模式預先產生的 (兩位小數倍率, 倍率字串, 實值字串)，未提供時依目前倍率計算
     kill = data.get('kill_count', 0)
     death = data.get('death_count', 0)
     kd = kill / (death if death > 0 else 0.5)
-    session["history"].append({"kd": round(kd, 2), "hp": round(session["params"]["HP_Mult"], 2),
-                               "atk": round(session["params"]["ATK_Mult"], 2),
-                               "det": round(session["params"]["Det_Range"], 2),
-                               "spd": round(session["params"]["Move_Speed"], 2), "action": action, "status": status})
-
-    with open(LOG_FILE, 'a', newline='', encoding='utf-8') as f:
-        csv.writer(f).writerow([datetime.now().strftime("%H:%M:%S"), player_id, mode, scene, status, f"{kd:.2f}",
-                                f"{session['params']['HP_Mult']:.2f}", f"{session['params']['ATK_Mult']:.2f}",
-                                f"{session['params']['Det_Range']:.2f}", f"{session['params']['Move_Speed']:.2f}",
-                                f"{session['params']['HP_Mult'] * BASE_STATS['HP']:.1f}",
-                                f"{session['params']['ATK_Mult'] * BASE_STATS['ATK']:.1f}",
-                                f"{session['params']['Det_Range'] * BASE_STATS['DET']:.1f}",
-                                f"{session['params']['Move_Speed'] * BASE_STATS['SPD']:.2f}", action])
-
-    return jsonify({"adjusted_params": session["params"], "adjustment_action": action})
-
-
-@app.route("/submit_final_result", methods=["POST"])
-def submit_final_result():
-    data = request.get_json()
+    params = dict(session["params"])
+    rounded, mult_text, real_text = display or format_display(params, BASE_STATS)
+    record = HistoryRecord(round(kd, 2), *rounded, action, status, version)
+    session["history"].append(record)
+    event = {"type": "history", "player_id": player_id, "seq": session["history"].total - 1,
+             "entry": record.to_dict(),
+             "state": {"params": params, "recovery_counter": session["recovery_counter"],
+                       "has_calibrated": session["has_calibrated"], "mode": mode,
+                       "last_updated": session["last_updated"]}}
+    log_row = [datetime.now().strftime("%H:%M:%S"), player_id, mode, scene, status, f"{kd:.2f}",
+               *mult_text, *real_text, action, version]
+    METRICS.count("actions", (("action", action),), help_text="DDA 調整動作的累計次數")
+    COHORTS.record_step(session["last_updated"], mode, status, kd, params, action,
+                        new_player=session["history"].total == 1)
+    if TELEMETRY is not None:
+        TELEMETRY.record_step(session["last_updated"], player_id, mode, scene, status, kd, params, data, action,
+                              version)
+    return {"adjusted_params": params, "adjustment_action": action}, log_row, event
+
+
+def _lookup_table(profiles):
+    # 目前模型版本的轉移表，熱更新後第一個請求重新建立 (約數十毫秒)
+    global _lookup
+    version, table = _lookup
+    if version == profiles.version:
+        return table
+    with _lookup_lock:
+        version, table = _lookup
+        if version != profiles.version:
+            table = DifficultyTable(profiles.strong, profiles.weak, BASE_STATS, step=LOOKUP_STEP)
+            _lookup = (profiles.version, table)
+            print(f"📋 已建立 DDA 查表 (模型 {profiles.version})：{table.stats()}")
+        return table
+
+
+def _targets(player_id, session, data, mode, profiles):
+    # 這一步的加難/降難目標；啟用線上最佳化時先把遙測計入上一步的候選 (呼叫端須持有該玩家的 session 鎖)
+    if OPTIMIZER is None or mode == "0":
+        return profiles.strong, profiles.weak
+    history = session["history"]
+    last_action = history[-1].action if len(history) else None
+    return OPTIMIZER.step(player_id, mode, last_action, data, profiles)
+
+
+def process_adjustment(data, timer=NULL_TIMER):
+    """
+    處理單一玩家的一步遙測：更新 session、推播事件，回傳 (回應內容, 日誌列)
+    timer 為 metrics.StageTimer，依序標記 session (取鎖與載入)、compute、record (歷史、遙測與推播) 三個階段
+    """
+    player_id, status, scene, mode = _parse_adjustment(data)
+    # 整個請求固定使用同一版模型，熱更新只影響之後的請求
+    profiles = MODEL_REGISTRY.current
+
+    # 同一玩家的讀-改-寫在鎖內依序完成，不同玩家可平行處理
+    with SESSION_STORE.session(player_id, create=lambda: new_session(mode, HISTORY_DEPTH)) as session:
+        timer.mark("session")
+        P_Strong, P_Weak = _targets(player_id, session, data, mode, profiles)
+        session["last_updated"] = datetime.now().timestamp()
+        session["mode"] = mode
+
+        # 控制組、死亡與恢復期邏輯由 model_core.session_step 統一處理 (離線重播使用同一份狀態機)
+        display = None
+        if LOOKUP_TABLE and OPTIMIZER is None:
+            table = _lookup_table(profiles)
+            session["params"], session["recovery_counter"], session["has_calibrated"], action, idx = \
+                table.session_step(session["params"], session["recovery_counter"], session["has_calibrated"], data,
+                                   dead=(status == "Dead"), tutorial=(scene == "Tutorial"), control=(mode == "0"))
+            display = table.display(idx) if idx is not None else None
+        else:
+            session["params"], session["recovery_counter"], session["has_calibrated"], action = session_step(
+                session["params"], session["recovery_counter"], session["has_calibrated"], data, P_Strong, P_Weak,
+                dead=(status == "Dead"), tutorial=(scene == "Tutorial"), control=(mode == "0"))
+        timer.mark("compute")
+
+        result, log_row, event = _record_step(player_id, session, data, status, scene, mode, action,
+                                              profiles.version, display)
+    EVENT_BROKER.publish(player_id, event)
+    timer.mark("record")
+    return result, log_row
+
+
+def process_adjustment_batch(payloads, timer=NULL_TIMER):
+    """
+    一次處理多位 (不重複) 玩家：集中鎖定後以 adjust_difficulty_dda_batch 向量化計算，回傳 [(回應內容, 日誌列)]
+    """
+    parsed = [_parse_adjustment(data) for data in payloads]
+    player_ids = [p[0] for p in parsed]
+    modes = {player_id: mode for player_id, _, _, mode in parsed}
+    profiles = MODEL_REGISTRY.current
+    outputs, events = [], []
+    with SESSION_STORE.batch(player_ids, create=lambda pid: new_session(modes[pid], HISTORY_DEPTH)) as sessions:
+        ordered = [sessions[player_id] for player_id in player_ids]
+        timer.mark("session")
+        P_Strong, P_Weak = profiles.strong, profiles.weak
+        if OPTIMIZER is not None:
+            targets = [_targets(player_id, session, data, mode, profiles)
+                       for data, (player_id, _, _, mode), session in zip(payloads, parsed, ordered)]
+            P_Strong = [[strong[key] for key in PARAM_KEYS] for strong, _ in targets]
+            P_Weak = [[weak[key] for key in PARAM_KEYS] for _, weak in targets]
+        new_params, new_recovery, new_calibrated, actions = adjust_difficulty_dda_batch(
+            [[s["params"][key] for key in PARAM_KEYS] for s in ordered],
+            [s["recovery_counter"] for s in ordered], [s["has_calibrated"] for s in ordered],
+            [data.get("kill_count", 0) for data in payloads], [data.get("death_count", 0) for data in payloads],
+            [status == "Dead" for _, status, _, _ in parsed], [scene == "Tutorial" for _, _, scene, _ in parsed],
+            [mode == "0" for _, _, _, mode in parsed], [data.get("game_time", 0) for data in payloads],
+            P_Strong, P_Weak)
+        timer.mark("compute")
+
+        now = datetime.now().timestamp()
+        for i, (data, (player_id, status, scene, mode), session) in enumerate(zip(payloads, parsed, ordered)):
+            session["last_updated"] = now
+            session["mode"] = mode
+            session["params"] = dict(zip(PARAM_KEYS, new_params[i].tolist()))
+            session["recovery_counter"] = int(new_recovery[i])
+            session["has_calibrated"] = bool(new_calibrated[i])
+            result, log_row, event = _record_step(player_id, session, data, status, scene, mode, ACTIONS[actions[i]],
+                                                  profiles.version)
+            outputs.append((result, log_row))
+            events.append((player_id, event))
+    for player_id, event in events:
+        EVENT_BROKER.publish(player_id, event)
+    timer.mark("record")
+    return outputs
+
+
+def adjust_batch(payloads, timer=NULL_TIMER):
+    """
+    批次調整：同一玩家在一批中出現多次時分成多個波次依序套用，回傳 (各筆結果, 日誌列)
+    """
+    results = [{"error": "每筆遙測資料必須是物件"}] * len(payloads)
+    valid = [i for i, payload in enumerate(payloads) if isinstance(payload, dict)]
+    log_rows = []
+    for wave in split_waves([_parse_adjustment(payloads[i])[0] for i in valid]):
+        indices = [valid[j] for j in wave]
+        for i, (result, log_row) in zip(indices, process_adjustment_batch([payloads[i] for i in indices], timer)):
+            result["player_id"] = log_row[1]
+            results[i] = result
+            log_rows.append(log_row)
+    return results, log_rows
+
+
+def process_final_result(data):
+    """
+    記錄通關結果並推播，回傳要寫入 FINAL_RESULT_FILE 的日誌列
+    """
     player_id = (data.get("player_id") or data.get("playerID") or "Unknown").strip()
     mode = str(data.get("mode", "N/A"))
 
-    if player_id in PLAYER_SESSIONS:
-        PLAYER_SESSIONS[player_id]["final_result"] = data
-        PLAYER_SESSIONS[player_id]["last_updated"] = datetime.now().timestamp()
-        if mode == "Game" or mode == "N/A":
-            mode = PLAYER_SESSIONS[player_id].get("mode", mode)
-
-    with open(FINAL_RESULT_FILE, 'a', newline='', encoding='utf-8') as f:
-        csv.writer(f).writerow(
-            [datetime.now().strftime("%Y-%m-%d %H:%M:%S"), player_id, mode, data.get("totalDamage", 0),
-             data.get("damageTaken", 0), data.get("kills", 0), data.get("deaths", 0), data.get("completionTime", 0),
-             data.get("result")])
-    return jsonify({"status": "success"})
+    with SESSION_STORE.session(player_id) as session:
+        if session is not None:
+            session["final_result"] = data
+            session["last_updated"] = datetime.now().timestamp()
+            if mode == "Game" or mode == "N/A":
+                mode = session.get("mode", mode)
+            EVENT_BROKER.publish(player_id, {"type": "final_result", "player_id": player_id, "final_result": data,
+                                             "last_updated": session["last_updated"]})
+
+    now = datetime.now()
+    version = MODEL_REGISTRY.current.version
+    COHORTS.record_final(now.timestamp(), mode, data)
+    if TELEMETRY is not None:
+        TELEMETRY.record_final(now.timestamp(), player_id, mode, data, version)
+    return [now.strftime("%Y-%m-%d %H:%M:%S"), player_id, mode, data.get("totalDamage", 0),
+            data.get("damageTaken", 0), data.get("kills", 0), data.get("deaths", 0),
+            data.get("completionTime", 0), data.get("result"), version]
+
+
+def admin_authorized(token, client_host):
+    """
+    管理端點的授權檢查：有 ADMIN_TOKEN 時比對標頭，否則只允許來自 loopback 位址的請求
+    """
+    if ADMIN_TOKEN:
+        return token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+    try:
+        return client_host is not None and ipaddress.ip_address(client_host).is_loopback
+    except ValueError:
+        return False
+
+
+def reload_model(body=None):
+    """
+    管理端重新載入模型：body 帶 P_Strong / P_Weak 時驗證後寫檔並切換，否則重新讀取模型檔
+    """
+    if body and ("P_Strong" in body or "P_Weak" in body):
+        profiles = MODEL_REGISTRY.publish(body.get("P_Strong"), body.get("P_Weak"))
+    else:
+        profiles = MODEL_REGISTRY.reload()
+    print(f"🔄 模型已重新載入，版本 {profiles.version}")
+    return profiles.info()
+
+
+def optimizer_info(player_id=None, mode="1"):
+    # 線上最佳化的整體統計；指定 player_id 時回傳該玩家 (或其族群) 目前的候選與分數
+    if OPTIMIZER is None:
+        return {"enabled": False}
+    if player_id is None:
+        return dict(OPTIMIZER.stats(), enabled=True)
+    return OPTIMIZER.state_info(player_id, mode)
+
+
+def profiler_control(body=None):
+    """
+    開關取樣分析器：body 為 {"enabled": true/false, "interval": 秒}，省略 enabled 時只回傳目前的報告
+    """
+    body = body or {}
+    if "enabled" in body:
+        if body["enabled"]:
+            interval = body.get("interval")
+            if PROFILER.start(float(interval) if interval is not None else None):
+                print(f"🔬 取樣分析器已開啟 (間隔 {PROFILER.interval * 1000:.1f} ms)")
+        elif PROFILER.stop():
+            print("🔬 取樣分析器已關閉")
+    return PROFILER.report(top=int(body.get("top", 20)))
+
+
+# --- 6. 啟動、就緒檢查與關閉 ---
+# state 依序為 stopped -> starting -> ready -> draining；phases 為 start() 各階段耗時 (秒)，供 /readyz 與 /metrics 查看
+STARTUP = {"state": "stopped", "started_at": None, "startup_s": None, "phases": {}, "preload_s": None}
+_start_lock = threading.Lock()
+# 就緒後在背景匯入批次路由需要的 numpy，第一個批次請求不必等待；DDA_PRELOAD=0 停用 (例如只處理單筆請求的邊緣節點)
+PRELOAD = os.environ.get("DDA_PRELOAD", "1") != "0"
+
+
+def start():
+    """
+    建立執行期狀態：載入模型、建立 session 儲存並由 WAL 還原、檢查 CSV 標題、啟動背景寫檔與遙測
+    可重複呼叫，只會執行一次；回傳 STARTUP
+    """
+    global MODEL_REGISTRY, OPTIMIZER, SESSION_STORE, SESSION_JOURNAL, LOG_WRITER, TELEMETRY
+    with _start_lock:
+        if STARTUP["state"] != "stopped":
+            return STARTUP
+        STARTUP["state"] = "starting"
+        STARTUP["started_at"] = datetime.now().timestamp()
+        t0 = last = time.perf_counter()
+
+        def phase(name):
+            nonlocal last
+            now = time.perf_counter()
+            STARTUP["phases"][name] = now - last
+            last = now
+
+        MODEL_REGISTRY = ModelRegistry(*MODEL_FILES)
+        MODEL_REGISTRY.start_watcher(interval=MODEL_WATCH_INTERVAL)
+        if ONLINE_OPT_SCOPE:
+            from online_optimizer import OnlineOptimizer
+            OPTIMIZER = OnlineOptimizer(ONLINE_OPT_SCOPE)
+        phase("model")
+
+        SESSION_STORE = create_session_store(SESSION_BACKEND, SESSION_DB_FILE, history_depth=HISTORY_DEPTH,
+                                             idle_timeout=IDLE_TIMEOUT, spill_dir=SESSION_SPILL_DIR)
+        if SESSION_BACKEND == "memory":
+            SESSION_STORE.start_evictor(interval=min(60.0, IDLE_TIMEOUT))
+        if SESSION_BACKEND == "memory" and SNAPSHOT_DIR:
+            SESSION_JOURNAL = SessionJournal(SNAPSHOT_DIR,
+                                             flush_interval=float(os.environ.get("DDA_SNAPSHOT_INTERVAL", 1.0)),
+                                             checkpoint_interval=float(os.environ.get("DDA_CHECKPOINT_INTERVAL", 300.0)))
+            SESSION_JOURNAL.restore(SESSION_STORE)
+            SESSION_JOURNAL.start(SESSION_STORE)
+        phase("sessions")
+
+        refused = init_csv_files()
+        LOG_WRITER = BatchedCSVWriter(max_queue=int(os.environ.get("DDA_LOG_QUEUE", 10000)),
+                                      batch_size=int(os.environ.get("DDA_LOG_BATCH", 256)),
+                                      flush_interval=float(os.environ.get("DDA_LOG_FLUSH_INTERVAL", 0.5)),
+                                      fsync_policy=os.environ.get("DDA_LOG_FSYNC", "never"),
+                                      interprocess=LOG_INTERPROCESS)
+        for path in refused:
+            LOG_WRITER.refuse(path)
+        if TELEMETRY_DIR:
+            TELEMETRY = TelemetryStore(TELEMETRY_DIR, attrs={"base_stats": BASE_STATS})
+            TELEMETRY.start_flusher(interval=float(os.environ.get("DDA_TELEMETRY_FLUSH_INTERVAL", 30.0)))
+        phase("logs")
+
+        # 查表在啟動時建好，第一個請求不必等待
+        if LOOKUP_TABLE and OPTIMIZER is None:
+            _lookup_table(MODEL_REGISTRY.current)
+            phase("lookup_table")
+
+        atexit.register(shutdown)
+        STARTUP["startup_s"] = time.perf_counter() - t0
+        STARTUP["state"] = "ready"
+    print(f"🚀 伺服器就緒，啟動耗時 {STARTUP['startup_s'] * 1000:.1f} ms "
+          f"({', '.join(f'{name} {seconds * 1000:.1f}' for name, seconds in STARTUP['phases'].items())})")
+    if PRELOAD:
+        threading.Thread(target=_preload, name="preload", daemon=True).start()
+    return STARTUP
+
+
+def _preload():
+    # 批次路由 (adjust_difficulty_dda_batch) 需要 numpy；匯入期間單筆請求照常處理
+    t0 = time.perf_counter()
+    import numpy  # noqa: F401
+    STARTUP["preload_s"] = time.perf_counter() - t0
+
+
+def shutdown():
+    """
+    停止接受流量 (/readyz 回報 draining) 並關閉背景工作：寫完日誌佇列與遙測緩衝，為記憶體 session 做最後一次 checkpoint
+    ASGI lifespan 與 atexit 都會呼叫，只執行一次
+    """
+    with _start_lock:
+        if STARTUP["state"] != "ready":
+            return
+        STARTUP["state"] = "draining"
+    MODEL_REGISTRY.stop_watcher()
+    PROFILER.stop()
+    LOG_WRITER.close()
+    if TELEMETRY is not None:
+        TELEMETRY.close()
+    if SESSION_JOURNAL is not None:
+        SESSION_JOURNAL.close(SESSION_STORE)
+
+
+def readiness():
+    """
+    就緒檢查：回傳 (是否可接受流量, 回應內容)；start() 完成前與 shutdown() 之後皆為未就緒
+    """
+    info = {"status": STARTUP["state"], "startup_s": STARTUP["startup_s"], "phases": dict(STARTUP["phases"]),
+            "preload_s": STARTUP["preload_s"]}
+    if MODEL_REGISTRY is not None:
+        info["model_version"] = MODEL_REGISTRY.current.version
+    return STARTUP["state"] == "ready", info
+
+
+
+# --- 7. Flask 應用程式工廠 ---
+
+def create_app():
+    """
+    先以 start() 建立執行期狀態，再匯入 Flask 並註冊路由；重複呼叫回傳同一個 app
+    """
+    global app
+    start()
+    with _start_lock:
+        if "app" not in globals():
+            t0 = time.perf_counter()
+            app = _build_flask_app()
+            STARTUP["phases"]["flask"] = time.perf_counter() - t0
+    return app
+
+
+def _build_flask_app():
+    from flask import Flask, Response, request, jsonify, render_template_string
+
+    app = Flask(__name__)
+
+    @app.route('/')
+    def dashboard():
+        return render_template_string(DASHBOARD_HTML, BASE_STATS=BASE_STATS, SSE_ENABLED=SSE_ENABLED)
+
+    @app.route('/get_history')
+    def get_history_api():
+        return jsonify(SESSION_STORE.snapshot())
+
+    @app.route('/players')
+    def players_api():
+        return jsonify(list_players())
+
+    @app.route('/get_history/<player_id>')
+    def player_history_api(player_id):
+        delta = history_delta(player_id, request.args.get("since", 0, type=int))
+        if delta is None:
+            return jsonify({"error": f"找不到玩家 {player_id}"}), 404
+        return jsonify(delta)
+
+    @app.route('/series/<player_id>')
+    def player_series_api(player_id):
+        # ?width= 為圖表寬度 (像素)，?method=lttb (預設) 或 minmax
+        try:
+            series = player_series(player_id, request.args.get("width", DEFAULT_WIDTH, type=int),
+                                   request.args.get("method", "lttb"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if series is None:
+            return jsonify({"error": f"找不到玩家 {player_id}"}), 404
+        return jsonify(series)
+
+    @app.route('/cohorts')
+    def cohorts_api():
+        # ?width= 時族群時間序列依寬度降採樣，?series=0 只回傳統計數字
+        try:
+            return jsonify(cohort_summary(request.args.get("width", None, type=int), request.args.get("method", "lttb"),
+                                          request.args.get("series", "1") != "0"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route('/events')
+    def events_api():
+        # Server-Sent Events：推送新的歷史紀錄與最終結果，可用 ?player_id= 只訂閱單一玩家
+        if not SSE_ENABLED:
+            return jsonify({"error": "推播已停用 (多 worker 模式)，請改用輪詢"}), 404
+        subscription = EVENT_BROKER.subscribe(request.args.get("player_id"))
+
+        def stream():
+            try:
+                yield "retry: 2000\n\n"
+                while True:
+                    message = subscription.get(timeout=SSE_HEARTBEAT)
+                    yield f"data: {message}\n\n" if message is not None else ": keep-alive\n\n"
+            finally:
+                EVENT_BROKER.unsubscribe(subscription)
+
+        return Response(stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.route("/adjust_difficulty", methods=["POST"])
+    def adjust_difficulty():
+        timer = METRICS.timer("adjust_difficulty")
+        data = request.get_json()
+        timer.mark("parse")
+        result, log_row = process_adjustment(data, timer)
+        LOG_WRITER.write(LOG_FILE, log_row)
+        timer.mark("log")
+        response = jsonify(result)
+        timer.mark("encode")
+        timer.done()
+        return response
+
+    @app.route("/adjust_difficulty_batch", methods=["POST"])
+    def adjust_difficulty_batch():
+        # 批次版本：接受 {"players": [...]} 或直接傳陣列，同一 tick 的多位玩家一次向量化計算，日誌一次排入佇列
+        timer = METRICS.timer("adjust_difficulty_batch")
+        data = request.get_json()
+        timer.mark("parse")
+        payloads = data.get("players", []) if isinstance(data, dict) else data
+        if not isinstance(payloads, list):
+            return jsonify({"error": "players 必須是陣列"}), 400
+        results, log_rows = adjust_batch(payloads, timer)
+        LOG_WRITER.write_many(LOG_FILE, log_rows)
+        timer.mark("log")
+        response = jsonify({"results": results})
+        timer.mark("encode")
+        timer.done()
+        return response
+
+    @app.route("/model_version")
+    def model_version_api():
+        return jsonify(MODEL_REGISTRY.current.info())
+
+    @app.route("/optimizer")
+    def optimizer_api():
+        info = optimizer_info(request.args.get("player_id"), request.args.get("mode", "1"))
+        if info is None:
+            return jsonify({"error": "該玩家尚無最佳化狀態"}), 404
+        return jsonify(info)
+
+    @app.route("/admin/reload_model", methods=["POST"])
+    def reload_model_api():
+        if not admin_authorized(request.headers.get("X-Admin-Token"), request.remote_addr):
+            return jsonify({"error": "未授權"}), 403
+        try:
+            return jsonify(reload_model(request.get_json(silent=True)))
+        except (ValueError, OSError) as e:
+            # 驗證失敗時保留目前版本
+            return jsonify({"error": str(e), "version": MODEL_REGISTRY.current.version}), 400
+
+    @app.route("/metrics")
+    def metrics_api():
+        return Response(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.route("/admin/profiler", methods=["GET", "POST"])
+    def profiler_api():
+        # GET 查看目前取樣結果 (?format=collapsed 輸出 flamegraph 格式)，POST 開關分析器
+        if not admin_authorized(request.headers.get("X-Admin-Token"), request.remote_addr):
+            return jsonify({"error": "未授權"}), 403
+        if request.method == "GET" and request.args.get("format") == "collapsed":
+            return Response(PROFILER.collapsed(), content_type="text/plain; charset=utf-8")
+        try:
+            body = request.get_json(silent=True) if request.method == "POST" else None
+            return jsonify(profiler_control(body if isinstance(body, dict) else None))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/submit_final_result", methods=["POST"])
+    def submit_final_result():
+        timer = METRICS.timer("submit_final_result")
+        data = request.get_json()
+        timer.mark("parse")
+        log_row = process_final_result(data)
+        timer.mark("record")
+        LOG_WRITER.write(FINAL_RESULT_FILE, log_row)
+        timer.mark("log")
+        response = jsonify({"status": "success"})
+        timer.mark("encode")
+        timer.done()
+        return response
+
+    @app.route("/healthz")
+    def healthz():
+        # 存活檢查：行程能回應即可 (重啟判斷用)，是否可接流量請看 /readyz
+        return jsonify({"status": "ok"})
+
+    @app.route("/readyz")
+    def readyz():
+        ready, info = readiness()
+        return jsonify(info), 200 if ready else 503
+
+    return app
+
+
+def __getattr__(name):
+    # 相容舊的載入方式 (WSGI 伺服器的 flask_api:app、測試的 flask_api.app)：第一次取用時才建立
+    if name == "app":
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5050, debug=False)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5050, debug=False)
@@ -0,0 +1,215 @@
+import csv
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 改用 msvcrt
+    fcntl = None
+    import msvcrt
+
+# fsync 策略：never (只交給作業系統緩衝)、batch (每批寫完都 fsync)、interval (至少間隔 fsync_interval 秒)
+FSYNC_POLICIES = ("never", "batch", "interval")
+_STOP = object()
+
+
+class FileLock:
+    """
+    跨行程的互斥鎖 (鎖定 path + ".lock")：多個 worker 行程寫同一個 CSV 時，標題檢查與每批附加依序進行
+    同一個物件可重複 with 使用，鎖定檔只開啟一次
+    """
+
+    def __init__(self, path):
+        self.path = path + ".lock"
+        self._fd = None
+
+    def __enter__(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class BatchedCSVWriter:
+    """
+    背景 CSV 日誌寫入器：請求只把資料列放進有界佇列，由寫入執行緒依數量或時間門檻批次寫檔
+    interprocess=True 時每批附加都持有 FileLock，多個行程寫同一個檔案時整批資料列不會交錯
+    """
+
+    def __init__(self, max_queue=10000, batch_size=256, flush_interval=0.5, fsync_policy="never",
+                 fsync_interval=5.0, put_timeout=0.05, interprocess=False):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"未知的 fsync 策略: {fsync_policy}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.put_timeout = put_timeout
+        self.interprocess = interprocess
+        self._file_locks = {}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._files = {}
+        # 標題不相容的檔案：寫入時直接計入 refused，不排入佇列
+        self._refused = set()
+        self._last_fsync = time.monotonic()
+        self._stats_lock = threading.Lock()
+        self._stats = {"queued": 0, "written": 0, "batches": 0, "backpressured": 0, "dropped": 0,
+                       "refused": 0}
+        self._closed = False
+        # 正在排入佇列的寫入數；close() 等它歸零後才放入 _STOP，資料列不會落在 _STOP 之後而遺失
+        self._putting = 0
+        self._put_cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="csv-log-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def refuse(self, path):
+        self._refused.add(path)
+
+    def write(self, path, row):
+        return self.write_many(path, [row])
+
+    def write_many(self, path, rows):
+        # 多列資料以單一佇列項目排入，批次請求只需一次排隊
+        # 佇列滿時先短暫等待 (backpressure)，仍然滿就丟棄並計數，不讓請求被磁碟拖住
+        rows = list(rows)
+        if not rows:
+            return 0
+        if path in self._refused:
+            self._count("refused", len(rows))
+            return 0
+        with self._put_cond:
+            if self._closed:
+                self._count("dropped", len(rows))
+                return 0
+            self._putting += 1
+        try:
+            try:
+                self._queue.put_nowait((path, rows))
+            except queue.Full:
+                self._count("backpressured", len(rows))
+                try:
+                    self._queue.put((path, rows), timeout=self.put_timeout)
+                except queue.Full:
+                    self._count("dropped", len(rows))
+                    return 0
+        finally:
+            with self._put_cond:
+                self._putting -= 1
+                if self._putting == 0:
+                    self._put_cond.notify_all()
+        self._count("queued", len(rows))
+        return len(rows)
+
+    def flush(self):
+        # 等待目前佇列中所有資料列寫入檔案
+        self._queue.join()
+
+    def close(self):
+        with self._put_cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._put_cond.wait_for(lambda: self._putting == 0)
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while item is not _STOP and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            entries = [entry for entry in batch if entry is not _STOP]
+            try:
+                self._write_batch(entries)
+            except Exception as e:
+                # 磁碟錯誤以外 (csv.Error、無法序列化的資料列、編碼錯誤) 也只丟棄這一批，寫入執行緒必須繼續運作，
+                # 否則佇列會被塞滿，之後的 flush() / close() 也會永遠等待
+                n_rows = sum(len(rows) for _, rows in entries)
+                print(f"⚠️ 日誌寫入失敗，丟棄 {n_rows} 筆: {e}")
+                self._count("dropped", n_rows)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(entries) < len(batch):
+                self._close_files()
+                return
+
+    def _write_batch(self, entries):
+        if not entries:
+            return
+        by_path = {}
+        for path, rows in entries:
+            by_path.setdefault(path, []).extend(rows)
+        for path, path_rows in by_path.items():
+            f = self._files.get(path)
+            if f is None:
+                f = self._files[path] = open(path, 'a', newline='', encoding='utf-8')
+            if self.interprocess:
+                lock = self._file_locks.get(path)
+                if lock is None:
+                    lock = self._file_locks[path] = FileLock(path)
+                # 整批先在鎖內寫入緩衝再 flush，寫入前不會有部分資料先被送出
+                with lock:
+                    csv.writer(f).writerows(path_rows)
+                    f.flush()
+            else:
+                csv.writer(f).writerows(path_rows)
+                f.flush()
+
+        now = time.monotonic()
+        if self.fsync_policy == "batch" or (
+                self.fsync_policy == "interval" and now - self._last_fsync >= self.fsync_interval):
+            for f in self._files.values():
+                os.fsync(f.fileno())
+            self._last_fsync = now
+        self._count("written", sum(len(rows) for rows in by_path.values()))
+        self._count("batches")
+
+    def _close_files(self):
+        for f in self._files.values():
+            f.flush()
+            if self.fsync_policy != "never":
+                os.fsync(f.fileno())
+            f.close()
+        self._files.clear()
+        for lock in self._file_locks.values():
+            lock.close()
+        self._file_locks.clear()
@@ -0,0 +1,305 @@
+# 請求路徑的輕量量測：各階段耗時直方圖、動作計數與即時狀態，以 Prometheus 文字格式輸出
+# 另附可在執行中開關的取樣分析器，延遲尖峰時不需重啟伺服器就能看到時間花在哪些呼叫堆疊
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# 直方圖上界 (秒)：10µs 到 2.5s，涵蓋單一步驟的計算到磁碟或鎖等待造成的尖峰
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5)
+# 取樣分析器的預設間隔 (秒) 與最多保留的不同堆疊數
+PROFILE_INTERVAL = 0.005
+MAX_PROFILE_STACKS = 5000
+# 這些模組位於堆疊最內層時代表執行緒正在等待 (佇列、鎖、socket)，不列入取樣
+IDLE_MODULES = ("threading.py", "queue.py", "selectors.py", "socketserver.py", "socket.py")
+
+
+class Histogram:
+    """
+    固定區間的累積直方圖，observe() 只做一次二分搜尋與計數 (由 Metrics 的鎖保護)
+    """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return list(self.counts), self.sum, self.count
+
+    @staticmethod
+    def quantile(buckets, counts, q):
+        # 以區間上下界線性內插估計分位數 (與 Prometheus histogram_quantile 相同)
+        count = sum(counts)
+        if count == 0:
+            return None
+        rank, seen, lower = q * count, 0, 0.0
+        for upper, n in zip(buckets, counts):
+            if seen + n >= rank:
+                return lower + (upper - lower) * ((rank - seen) / n if n else 0.0)
+            seen, lower = seen + n, upper
+        return buckets[-1]
+
+
+class StageTimer:
+    """
+    單一請求的階段計時：mark(stage) 把上次標記後經過的時間累加到該階段，done() 時一次寫入直方圖
+    """
+    __slots__ = ("_metrics", "_route", "_start", "_last", "_stages")
+
+    def __init__(self, metrics, route):
+        self._metrics = metrics
+        self._route = route
+        self._start = self._last = time.perf_counter()
+        self._stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self._stages[stage] = self._stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def done(self):
+        self._metrics.observe_request(self._route, self._stages, time.perf_counter() - self._start)
+
+
+class _NullTimer:
+    # 停用量測時使用，請求路徑不需判斷
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+    def done(self):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class Metrics:
+    """
+    伺服器量測的集中處：請求階段直方圖、具名計數器，以及輸出時才呼叫的即時量 (gauge) 回呼
+    """
+
+    def __init__(self, prefix="dda", enabled=True, buckets=LATENCY_BUCKETS):
+        self.prefix = prefix
+        self.enabled = enabled
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def timer(self, route):
+        return StageTimer(self, route) if self.enabled else NULL_TIMER
+
+    def _histogram(self, key):
+        # 呼叫端須持有 self._lock
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def observe_request(self, route, stages, total):
+        # 一個請求的所有階段在同一次持鎖中寫入
+        with self._lock:
+            for stage, seconds in stages.items():
+                self._histogram((route, stage)).observe(seconds)
+            self._histogram((route, "total")).observe(total)
+
+    def count(self, name, labels=(), n=1, help_text=None):
+        """
+        累加計數器；labels 為 ((名稱, 值), ...) 的 tuple
+        """
+        if not self.enabled:
+            return
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+            if help_text is not None and name not in self._help:
+                self._help[name] = help_text
+
+    def register_gauges(self, collect):
+        """
+        登記即時量回呼：collect() 回傳 [(名稱, 說明, labels, 數值), ...]，只在輸出 /metrics 時呼叫
+        """
+        self._gauges.append(collect)
+
+    def _histogram_snapshots(self):
+        with self._lock:
+            return [(key, histogram.snapshot()) for key, histogram in self._histograms.items()]
+
+    def stage_summary(self, route=None):
+        # 各路由、各階段的次數與估計分位數 (毫秒)，供壓測報告使用
+        summary = {}
+        # 同一路由內保留各階段第一次出現的順序，也就是請求處理的先後
+        for (r, stage), (counts, total, count) in sorted(self._histogram_snapshots(), key=lambda item: item[0][0]):
+            if route is not None and r != route:
+                continue
+            quantiles = {f"p{int(q * 100)}_ms": (Histogram.quantile(self.buckets, counts, q) or 0.0) * 1000.0
+                         for q in (0.5, 0.95, 0.99)}
+            summary.setdefault(r, {})[stage] = dict(quantiles, count=count,
+                                                     mean_ms=total / count * 1000.0 if count else 0.0)
+        return summary
+
+    def render(self):
+        """
+        以 Prometheus 文字格式 (0.0.4) 輸出所有量測
+        """
+        lines = []
+        name = f"{self.prefix}_request_stage_seconds"
+        lines += [f"# HELP {name} 請求各處理階段的耗時 (stage=total 為整個請求)", f"# TYPE {name} histogram"]
+        for (route, stage), (counts, total, count) in sorted(self._histogram_snapshots()):
+            cumulative = 0
+            for upper, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels((('route', route), ('stage', stage), ('le', _number(upper))))} "
+                             f"{cumulative}")
+            labels = _labels((("route", route), ("stage", stage)))
+            lines.append(f"{name}_sum{labels} {_number(total)}")
+            lines.append(f"{name}_count{labels} {count}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            help_texts = dict(self._help)
+        declared = set()
+        for (counter, labels), value in counters:
+            name = f"{self.prefix}_{counter}_total"
+            if counter not in declared:
+                declared.add(counter)
+                lines += [f"# HELP {name} {help_texts.get(counter, counter)}", f"# TYPE {name} counter"]
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        declared = set()
+        for collect in self._gauges:
+            try:
+                samples = collect()
+            except Exception as e:
+                # 單一回呼失敗不影響其他量測的輸出
+                print(f"⚠️ 量測回呼失敗: {e}")
+                continue
+            for gauge, help_text, labels, value in samples:
+                if value is None:
+                    continue
+                name = f"{self.prefix}_{gauge}"
+                if gauge not in declared:
+                    declared.add(gauge)
+                    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    取樣式分析器：背景執行緒每隔 interval 秒讀取所有執行緒目前的 Python 呼叫堆疊並計數
+    開啟期間每次取樣約數十微秒，不需重啟即可開關；結果可輸出為 flamegraph 使用的 collapsed 格式
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, max_stacks=MAX_PROFILE_STACKS):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._stacks = Counter()
+        self._samples = 0
+        self._dropped = 0
+        self._started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        # 重新開始時清空上一輪的取樣
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if interval is not None:
+                if interval <= 0:
+                    raise ValueError("取樣間隔必須大於 0")
+                self.interval = interval
+            self._stacks.clear()
+            self._samples = self._dropped = 0
+            self._started = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return False
+        self._stop.set()
+        thread.join()
+        return True
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                leaf = os.path.basename(frame.f_code.co_filename)
+                if leaf in IDLE_MODULES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    self._samples += 1
+                    if key in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[key] += 1
+                    else:
+                        self._dropped += 1
+
+    def collapsed(self):
+        # 每行 "外層;...;內層 次數"，可直接交給 flamegraph.pl 或 speedscope
+        with self._lock:
+            return "".join(f"{stack} {n}\n" for stack, n in self._stacks.most_common())
+
+    def report(self, top=20):
+        with self._lock:
+            stacks = self._stacks.most_common()
+            samples, dropped = self._samples, self._dropped
+        # 以最內層函式彙總 (self time)，通常比完整堆疊更容易看出熱點
+        leaves = Counter()
+        for stack, n in stacks:
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        return {"running": self.running, "interval": self.interval, "started": self._started,
+                "samples": samples, "dropped": dropped, "distinct_stacks": len(stacks),
+                "top_functions": [{"frame": frame, "samples": n, "ratio": n / samples if samples else 0.0}
+                                  for frame, n in leaves.most_common(top)],
+                "top_stacks": [{"stack": stack, "samples": n} for stack, n in stacks[:top]]}
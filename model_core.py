@@ -1,5 +1,6 @@
+# numpy 只在向量化 (批次) 函式內匯入：API 伺服器的單筆路徑與 session_step 不需要它，啟動時可省下約 0.1 秒
 import random
-import numpy as np
+from collections import namedtuple
 
 
 # --- 1. 模擬函式 (GA 訓練與驗證使用) ---
@@ -18,7 +19,33 @@ def simulate_game_run(hp_mult, atk_mult, det_range, move_speed_mult):
     }
 
 
+def simulate_game_run_batch(population):
+    """
+    simulate_game_run 的向量化版本：population 為 (N, 4) 倍率陣列，回傳每個欄位皆為 (N,) 陣列的字典
+    """
+    import numpy as np
+    pop = np.asarray(population, dtype=float).reshape(-1, 4)
+    hp_mult, atk_mult, det_range, move_speed_mult = pop[:, 0], pop[:, 1], pop[:, 2], pop[:, 3]
+    base_kill, base_death = 25, 3
+    base_dealt, base_taken, base_time = 2700, 200, 450
+    kill_count = base_kill / ((0.8 * hp_mult) + (0.1 * atk_mult) + (0.1 * move_speed_mult))
+    death_count = base_death * ((0.5 * atk_mult) + (0.2 * det_range) + (0.3 * hp_mult))
+    damage_dealt = base_dealt / ((0.7 * hp_mult) + (0.2 * atk_mult))
+    damage_taken = base_taken * ((0.6 * atk_mult) + (0.4 * move_speed_mult)) * hp_mult
+    game_time = base_time * ((0.5 * hp_mult) + (0.3 * atk_mult))
+    # np.round 與內建 round 同為「四捨六入五成雙」，結果與逐一模擬一致
+    return {
+        'kill_count': np.maximum(0, np.round(kill_count)), 'death_count': np.maximum(0, np.round(death_count)),
+        'damage_taken': np.maximum(0.0, damage_taken), 'damage_dealt': np.maximum(0.0, damage_dealt),
+        'game_time': np.maximum(1, np.round(game_time))
+    }
+
+
 # --- 2. 評估函式 (DDA 效果評分) ---
+# 權重係數：ALPHA(擊殺), BETA(死亡), GAMMA(受傷), DELTA(輸出), EPSILON(時長), ZETA(難度成本)
+ALPHA, BETA, GAMMA, DELTA, EPSILON, ZETA = 10.0, -15.0, -0.8, 0.005, -0.01, 0.5
+
+
 def evaluate_from_unity(individual, player_data):
     hp_mult, atk_mult, det_range, move_speed_mult = individual
     kill = player_data.get('kill_count', 0)
@@ -27,14 +54,32 @@ def evaluate_from_unity(individual, player_data):
     damage_dealt = player_data.get('damage_dealt', 0.0)
     game_time = player_data.get('game_time', 1)
 
-    # 權重係數：ALPHA(擊殺), BETA(死亡), GAMMA(受傷), DELTA(輸出), EPSILON(時長), ZETA(難度成本)
-    ALPHA, BETA, GAMMA, DELTA, EPSILON, ZETA = 10.0, -15.0, -0.8, 0.005, -0.01, 0.5
     raw_fitness = (ALPHA * kill) + (BETA * death) + (GAMMA * damage_taken) + (DELTA * damage_dealt) + (
                 EPSILON * game_time)
     parameter_cost = hp_mult + atk_mult + det_range + move_speed_mult
     return raw_fitness - (ZETA * parameter_cost)
 
 
+def evaluate_from_unity_batch(population, player_data):
+    """
+    evaluate_from_unity 的向量化版本：population 為 (N, 4) 倍率陣列，
+    player_data 的欄位可為純量或 (N,) 陣列，回傳 (N,) 適應度陣列
+    """
+    import numpy as np
+    pop = np.asarray(population, dtype=float).reshape(-1, 4)
+    kill = np.asarray(player_data.get('kill_count', 0), dtype=float)
+    death = np.asarray(player_data.get('death_count', 1), dtype=float)
+    damage_taken = np.asarray(player_data.get('damage_taken', 0.0), dtype=float)
+    damage_dealt = np.asarray(player_data.get('damage_dealt', 0.0), dtype=float)
+    game_time = np.asarray(player_data.get('game_time', 1), dtype=float)
+
+    raw_fitness = (ALPHA * kill) + (BETA * death) + (GAMMA * damage_taken) + (DELTA * damage_dealt) + (
+                EPSILON * game_time)
+    # 依序相加 (不用 sum)，確保浮點結果與逐一評估完全相同
+    parameter_cost = pop[:, 0] + pop[:, 1] + pop[:, 2] + pop[:, 3]
+    return raw_fitness - (ZETA * parameter_cost)
+
+
 # --- 3. DDA 調整引擎 (核心邏輯) ---
 # 正常調整速率 (12%)
 ADJUSTMENT_RATE_NORMAL = 0.12
@@ -46,10 +91,12 @@ STRONG_THRESHOLD = 0.7
 WEAK_THRESHOLD = 0.3
 
 
-def adjust_difficulty_dda(current_params, player_results, P_Strong, P_Weak, is_tutorial=False, is_first_game=False):
+def adjust_difficulty_dda(current_params, player_results, P_Strong, P_Weak, is_tutorial=False, is_first_game=False,
+                          policy=None):
     """
-    根據玩家表現動態計算下一階段的殭屍屬性倍率
+    根據玩家表現動態計算下一階段的殭屍屬性倍率 (policy 為 None 時使用本模組的門檻與速率常數)
     """
+    policy = policy or DEFAULT_POLICY
     # 教學關卡僅監測，回傳原參數
     if is_tutorial:
         return current_params, "Tutorial Monitoring"
@@ -60,13 +107,13 @@ def adjust_difficulty_dda(current_params, player_results, P_Strong, P_Weak, is_t
     ratio = kill / (death if death > 0 else 0.5)
 
     # 決定當前步長的調整速率
-    rate = ADJUSTMENT_RATE_FAST if is_first_game else ADJUSTMENT_RATE_NORMAL
+    rate = policy.rate_fast if is_first_game else policy.rate_normal
     new_params = current_params.copy()
 
     # 難度判定邏輯
-    if ratio > STRONG_THRESHOLD:
+    if ratio > policy.strong_threshold:
         target_params, action = P_Strong, "Adjusted Up"
-    elif ratio < WEAK_THRESHOLD:
+    elif ratio < policy.weak_threshold:
         target_params, action = P_Weak, "Adjusted Down"
     else:
         # 處於平衡區間，維持現狀
@@ -79,4 +126,110 @@ def adjust_difficulty_dda(current_params, player_results, P_Strong, P_Weak, is_t
         # 公式：現在值 + (目標值 - 現在值) * 速率
         new_params[key] = old_val + (target_val - old_val) * rate
 
-    return new_params, action
\ No newline at end of file
+    return new_params, action
+
+# --- 4. 向量化 DDA (一次計算多位玩家) ---
+PARAM_KEYS = ("HP_Mult", "ATK_Mult", "Det_Range", "Move_Speed")
+# 死亡急降速率、死亡後冷靜期步數，以及冷靜期內加難的抑制比例
+EMERGENCY_RATE = 0.7
+RECOVERY_STEPS = 4
+RECOVERY_DAMPING = 0.3
+# 動作代碼，對應 adjust_difficulty_dda 與伺服器死亡/恢復期邏輯產生的動作字串
+ACTIONS = ("Monitoring (Control)", "Emergency Down (Death)", "Tutorial Monitoring", "Adjusted Up", "Adjusted Down",
+           "Stay Balanced", "Adjusted Up (Restricted)")
+ACT_CONTROL, ACT_DEATH, ACT_TUTORIAL, ACT_UP, ACT_DOWN, ACT_BALANCED, ACT_UP_RESTRICTED = range(len(ACTIONS))
+
+
+def profile_vector(profile):
+    # dict 轉成長度 4 的向量；已是陣列 (例如每位玩家各自的 (N, 4) 目標) 則原樣回傳
+    import numpy as np
+    if isinstance(profile, dict):
+        return np.array([profile[key] for key in PARAM_KEYS], dtype=float)
+    return np.asarray(profile, dtype=float)
+
+
+def adjust_difficulty_dda_batch(params, recovery, calibrated, kill, death, dead, tutorial, control, game_time,
+                                P_Strong, P_Weak, policy=None):
+    """
+    多位玩家的 DDA 一次以遮罩陣列運算完成，結果與逐一呼叫 session_step 完全相同
+    params 為 (N, 4) 倍率陣列，其餘皆為長度 N 的陣列；P_Strong / P_Weak 可為 dict 或每位玩家一列的 (N, 4) 陣列
+    回傳 (新倍率, 新冷靜期計數, 新校準旗標, 動作代碼)
+    """
+    import numpy as np
+    policy = policy or DEFAULT_POLICY
+    params = np.asarray(params, dtype=float).reshape(-1, 4)
+    recovery = np.asarray(recovery, dtype=int)
+    calibrated = np.asarray(calibrated, dtype=bool)
+    dead = np.asarray(dead, dtype=bool)
+    tutorial = np.asarray(tutorial, dtype=bool)
+    control = np.asarray(control, dtype=bool)
+    death = np.asarray(death, dtype=float)
+    ratio = np.asarray(kill, dtype=float) / np.where(death > 0, death, 0.5)
+
+    up = ratio > policy.strong_threshold
+    down = ~up & (ratio < policy.weak_threshold)
+    emergency = dead & ~control
+    active = ~control & ~dead
+    recovering = recovery > 0
+    # 校準步只發生在非冷靜期、非教學關卡且尚未校準過的玩家
+    is_first = active & ~recovering & ~calibrated & (np.asarray(game_time) > 2) & ~tutorial
+    rate = np.where(is_first, policy.rate_fast, policy.rate_normal)[:, None]
+
+    strong = np.broadcast_to(profile_vector(P_Strong), params.shape)
+    weak = np.broadcast_to(profile_vector(P_Weak), params.shape)
+    target = np.where(up[:, None], strong, weak)
+    moves = active & ~tutorial & (up | down)
+    restricted = moves & recovering & up
+    lerped = params + (target - params) * rate
+
+    new_params = params.copy()
+    new_params[moves] = lerped[moves]
+    new_params[restricted] = params[restricted] + (lerped[restricted] - params[restricted]) * policy.recovery_damping
+    new_params[emergency] = params[emergency] + (weak[emergency] - params[emergency]) * policy.emergency_rate
+    new_params[control] = 1.0
+
+    new_recovery = recovery.copy()
+    new_recovery[active & recovering] -= 1
+    new_recovery[emergency] = policy.recovery_steps
+
+    actions = np.full(len(params), ACT_BALANCED, dtype=np.int8)
+    actions[active & up] = ACT_UP
+    actions[active & down] = ACT_DOWN
+    actions[restricted] = ACT_UP_RESTRICTED
+    actions[active & tutorial] = ACT_TUTORIAL
+    actions[emergency] = ACT_DEATH
+    actions[control] = ACT_CONTROL
+    return new_params, new_recovery, calibrated | is_first, actions
+
+
+# --- 5. Session 狀態機 (伺服器與離線重播共用) ---
+# 一組可替換的 DDA 參數；預設值即上方的模組常數
+DDAPolicy = namedtuple("DDAPolicy", ("strong_threshold", "weak_threshold", "rate_normal", "rate_fast",
+                                     "emergency_rate", "recovery_steps", "recovery_damping"))
+DEFAULT_POLICY = DDAPolicy(STRONG_THRESHOLD, WEAK_THRESHOLD, ADJUSTMENT_RATE_NORMAL, ADJUSTMENT_RATE_FAST,
+                           EMERGENCY_RATE, RECOVERY_STEPS, RECOVERY_DAMPING)
+
+
+def session_step(params, recovery_counter, has_calibrated, player_data, P_Strong, P_Weak, dead=False,
+                 tutorial=False, control=False, policy=None):
+    """
+    單一玩家一步的完整 DDA：控制組、死亡急降、冷靜期限制與開場校準，不修改傳入的物件
+    回傳 (新倍率, 新冷靜期計數, 新校準旗標, 動作)
+    """
+    policy = policy or DEFAULT_POLICY
+    if control:
+        return {key: 1.0 for key in PARAM_KEYS}, recovery_counter, has_calibrated, "Monitoring (Control)"
+    if dead:
+        new_params = {key: params[key] + (P_Weak[key] - params[key]) * policy.emergency_rate for key in params}
+        return new_params, policy.recovery_steps, has_calibrated, "Emergency Down (Death)"
+    if recovery_counter > 0:
+        new_params, action = adjust_difficulty_dda(params, player_data, P_Strong, P_Weak, tutorial, False, policy)
+        if "Up" in action:
+            # 冷靜期內加難只走一小段
+            new_params = {key: params[key] + (new_params[key] - params[key]) * policy.recovery_damping
+                          for key in params}
+            action += " (Restricted)"
+        return new_params, recovery_counter - 1, has_calibrated, action
+    is_first = not has_calibrated and player_data.get("game_time", 0) > 2 and not tutorial
+    new_params, action = adjust_difficulty_dda(params, player_data, P_Strong, P_Weak, tutorial, is_first, policy)
+    return new_params, recovery_counter, has_calibrated or is_first, action
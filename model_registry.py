@@ -0,0 +1,200 @@
+import hashlib
+import json
+import math
+import os
+import pickle
+import threading
+from datetime import datetime
+
+from model_core import PARAM_KEYS
+
+# 倍率合理範圍，超出視為訓練或檔案錯誤，拒絕載入
+MULT_MIN, MULT_MAX = 0.1, 5.0
+# 讀取期間模型檔又被改寫時重新讀取的次數上限
+LOAD_ATTEMPTS = 3
+# 找不到模型檔時使用的預設安全邊界
+DEFAULT_P_STRONG = {"HP_Mult": 1.4, "ATK_Mult": 1.2, "Det_Range": 1.1, "Move_Speed": 1.2}
+DEFAULT_P_WEAK = {"HP_Mult": 0.8, "ATK_Mult": 0.8, "Det_Range": 0.9, "Move_Speed": 0.9}
+
+
+class ModelProfiles:
+    """
+    一組不可變的 P_Strong / P_Weak 設定與版本標籤；請求開始時取一次，整個請求都使用同一組
+    """
+    __slots__ = ("strong", "weak", "version", "loaded_at", "source")
+
+    def __init__(self, strong, weak, source):
+        self.strong = strong
+        self.weak = weak
+        self.source = source
+        self.loaded_at = datetime.now().timestamp()
+        # 版本由內容雜湊決定，不同 worker 或重啟後載入同一組檔案會得到相同版本
+        digest = hashlib.sha1(json.dumps([strong, weak], sort_keys=True).encode("utf-8")).hexdigest()
+        self.version = digest[:10]
+
+    def info(self):
+        return {"version": self.version, "source": self.source, "loaded_at": self.loaded_at,
+                "P_Strong": self.strong, "P_Weak": self.weak}
+
+
+def read_profile(path):
+    """
+    讀取單一模型檔：.json 為 {倍率鍵: 數值} 的純文字；舊版 .pkl 仍可讀取，但 pickle 會執行任意程式碼，
+    且訓練輸出的 numpy 浮點數會在載入時連帶匯入 numpy，只作為轉換用途
+    """
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_profile(path, profile):
+    # 先寫暫存檔再原子替換，監看中的 worker 不會讀到寫到一半的檔案
+    if not path.endswith(".json"):
+        raise ValueError(f"模型檔只能寫成 JSON: {path}")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({key: float(profile[key]) for key in PARAM_KEYS}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def migrate_legacy(path):
+    """
+    path 為 .json 且不存在、但同名 .pkl 存在時，轉換一次並回傳 True (之後啟動只讀 JSON)
+    """
+    legacy = os.path.splitext(path)[0] + ".pkl"
+    if not path.endswith(".json") or os.path.exists(path) or not os.path.exists(legacy):
+        return False
+    write_profile(path, validate_profile(read_profile(legacy), legacy))
+    print(f"🔁 已將舊版模型檔 {legacy} 轉換為 {path}")
+    return True
+
+
+def validate_profile(profile, name):
+    if not isinstance(profile, dict):
+        raise ValueError(f"{name} 必須是 dict")
+    missing = [key for key in PARAM_KEYS if key not in profile]
+    if missing:
+        raise ValueError(f"{name} 缺少欄位: {missing}")
+    clean = {}
+    for key in PARAM_KEYS:
+        value = float(profile[key])
+        if not math.isfinite(value) or not MULT_MIN <= value <= MULT_MAX:
+            raise ValueError(f"{name}.{key}={value} 超出合理範圍 [{MULT_MIN}, {MULT_MAX}]")
+        clean[key] = value
+    return clean
+
+
+class ModelRegistry:
+    """
+    管理目前使用的模型設定：監看模型檔變動或接受管理端重新載入，驗證後以單一參照替換 (不阻塞進行中的請求)
+    P_Strong / P_Weak 是兩個檔案，監看只在兩者都比上次載入的新時才載入，避免讀到新舊混用的一組
+    """
+
+    def __init__(self, strong_path, weak_path, default_strong=DEFAULT_P_STRONG, default_weak=DEFAULT_P_WEAK):
+        self.strong_path = strong_path
+        self.weak_path = weak_path
+        for path in (strong_path, weak_path):
+            try:
+                migrate_legacy(path)
+            except (ValueError, OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+                print(f"⚠️ 舊版模型檔轉換失敗: {e}")
+        self._reload_lock = threading.Lock()
+        self._mtimes = None
+        self._partial = None
+        self._watcher = None
+        self._stop = threading.Event()
+        try:
+            self._current = self._load_files()
+            print("✅ 成功載入模型參數。")
+        except FileNotFoundError:
+            print("⚠️ 找不到模型檔案，使用預設安全邊界。")
+            self._current = ModelProfiles(validate_profile(default_strong, "P_Strong"),
+                                          validate_profile(default_weak, "P_Weak"), "default")
+
+    @property
+    def current(self):
+        return self._current
+
+    def _file_mtimes(self):
+        return os.stat(self.strong_path).st_mtime_ns, os.stat(self.weak_path).st_mtime_ns
+
+    def _load_files(self):
+        # 讀完後再檢查一次 mtime，讀取期間有檔案被替換就重讀，確保兩個檔案來自同一次寫入
+        for _ in range(LOAD_ATTEMPTS):
+            mtimes = self._file_mtimes()
+            try:
+                strong = read_profile(self.strong_path)
+                weak = read_profile(self.weak_path)
+            except (ValueError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+                raise ValueError(f"模型檔無法解析: {e}") from e
+            if self._file_mtimes() == mtimes:
+                break
+        else:
+            raise ValueError("模型檔在讀取期間持續被改寫")
+        profiles = ModelProfiles(validate_profile(strong, "P_Strong"), validate_profile(weak, "P_Weak"), "file")
+        self._mtimes = mtimes
+        return profiles
+
+    def reload(self):
+        # 重新讀檔；驗證失敗時保留舊版本並丟出例外
+        with self._reload_lock:
+            self._current = self._load_files()
+            return self._current
+
+    def publish(self, strong, weak):
+        """
+        驗證後寫回模型檔並切換；其他 worker 的檔案監看會接著載入同一版本
+        """
+        strong = validate_profile(strong, "P_Strong")
+        weak = validate_profile(weak, "P_Weak")
+        with self._reload_lock:
+            for path, profile in ((self.strong_path, strong), (self.weak_path, weak)):
+                write_profile(path, profile)
+            self._current = self._load_files()
+            return self._current
+
+    def check_for_update(self):
+        try:
+            mtimes = self._file_mtimes()
+        except FileNotFoundError:
+            return False
+        changed = mtimes != self._mtimes
+        # publish() 與訓練腳本都成對寫入；只有一個檔案較新時代表另一個還沒寫完，先不載入
+        if changed and self._mtimes is not None and not all(new > old for new, old in zip(mtimes, self._mtimes)):
+            if mtimes != self._partial:
+                self._partial = mtimes
+                print("ℹ️ 只有一個模型檔更新，等待另一個檔案 (或呼叫 /admin/reload_model 強制載入)")
+            return False
+        if changed:
+            try:
+                old_version = self._current.version
+                profiles = self.reload()
+                if profiles.version != old_version:
+                    print(f"🔄 模型已熱更新: {old_version} -> {profiles.version}")
+            except (ValueError, OSError) as e:
+                print(f"⚠️ 新模型檔驗證失敗，沿用版本 {self._current.version}: {e}")
+                # 記下這次的 mtime，避免每次輪詢都重複報錯；檔案正被替換或移除時留待下次輪詢
+                try:
+                    self._mtimes = self._file_mtimes()
+                except FileNotFoundError:
+                    pass
+        return changed
+
+    def start_watcher(self, interval=5.0):
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def run():
+            # 任何意外錯誤都只略過這一輪，監看執行緒不能結束，否則熱更新會無聲停止
+            while not self._stop.wait(interval):
+                try:
+                    self.check_for_update()
+                except Exception as e:
+                    print(f"⚠️ 模型檔監看發生錯誤，下次輪詢再試: {e}")
+
+        self._watcher = threading.Thread(target=run, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
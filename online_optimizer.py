@@ -0,0 +1,212 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from model_core import ALPHA, BETA, ZETA, PARAM_KEYS, profile_vector
+from model_registry import MULT_MIN, MULT_MAX
+
+# 每位玩家 (或每個族群) 的候選目標數、每個候選連續試用的步數，以及候選可偏離 GA 模型的最大幅度
+POP_SIZE = 6
+TRIAL_STEPS = 3
+SEARCH_RADIUS = 0.15
+# 適應度以指數移動平均累積，新子代的突變標準差 (相對 SEARCH_RADIUS)
+SCORE_EMA = 0.3
+MUTATION_SIGMA = 0.35
+# 預先產生的常態亂數表大小，每次突變只取下一列，不在請求中呼叫亂數產生器
+# 每位玩家從自己 ID 雜湊決定的位置開始取用，演化結果不受其他玩家請求順序影響
+NOISE_TABLE_SIZE = 4096
+# 同時保留最佳化狀態的玩家上限，超過時淘汰最久未使用者
+MAX_STATES = 10000
+# 族群範圍中每個狀態記住的「上一步分配給哪個候選」玩家數上限 (每位玩家範圍只有一筆)
+MAX_PENDING = 10000
+
+
+def _outcome(player_data, kills, deaths):
+    """
+    這一步遙測中玩家的表現：與上一步相比新增的擊殺與死亡 (Unity 傳來累計值)，權重同 evaluate_from_unity
+    /adjust_difficulty 的遙測沒有傷害欄位，因此只用擊殺與死亡；計數歸零 (新的一局) 時差值以 0 計
+    """
+    d_kill = max(0, player_data.get("kill_count", 0) - kills)
+    d_death = max(0, player_data.get("death_count", 0) - deaths)
+    return ALPHA * d_kill + BETA * d_death
+
+
+class _Side:
+    """
+    單邊 (加難或降難) 的候選族群：輪流試用每個候選，全部試完一輪後以最佳兩者產生子代取代最差者
+    ids 為每個候選的編號，子代取代後換新編號，遲到的評分不會算到新候選身上
+    """
+    __slots__ = ("center", "candidates", "scores", "trials", "active", "used", "ids", "_next_id")
+
+    def __init__(self, center, noise):
+        self.center = center
+        self.candidates = np.empty((POP_SIZE, 4))
+        # 第 0 個候選固定為 GA 模型本身，其餘在搜尋半徑內擾動
+        self.candidates[0] = center
+        self.candidates[1:] = center + SEARCH_RADIUS * noise[:POP_SIZE - 1]
+        self._clip_all()
+        self.scores = np.full(POP_SIZE, np.nan)
+        self.trials = np.zeros(POP_SIZE, dtype=int)
+        self.active = 0
+        self.used = 0
+        self.ids = list(range(POP_SIZE))
+        self._next_id = POP_SIZE
+
+    def _clip_all(self):
+        np.clip(self.candidates, np.maximum(self.center - SEARCH_RADIUS, MULT_MIN),
+                np.minimum(self.center + SEARCH_RADIUS, MULT_MAX), out=self.candidates)
+
+    def assign(self):
+        # 這一步分配的候選 (索引, 編號)
+        return self.active, self.ids[self.active]
+
+    def credit(self, i, candidate_id, outcome, strong, next_noise):
+        """
+        把一步的表現計入當時分配的候選 i；回傳 (是否計分, 是否產生了新子代)
+        與 GA 訓練相同的方向：加難目標越能壓低玩家表現、降難目標越能提升玩家表現越好，並計入候選本身的難度成本
+        """
+        if self.ids[i] != candidate_id:
+            return False, False
+        fitness = outcome - ZETA * float(self.candidates[i].sum())
+        score = -fitness if strong else fitness
+        self.scores[i] = score if self.trials[i] == 0 else self.scores[i] + (score - self.scores[i]) * SCORE_EMA
+        self.trials[i] += 1
+        self.used += 1
+        if self.used < TRIAL_STEPS:
+            return True, False
+        self.used = 0
+        self.active = (self.active + 1) % POP_SIZE
+        if self.active != 0:
+            return True, False
+        # 族群範圍中評分可能晚到，只在已評分的候選之間挑選親代與淘汰者
+        scored = np.flatnonzero(self.trials > 0)
+        if len(scored) < 3:
+            return True, False
+        order = scored[np.argsort(-self.scores[scored])]
+        best, second, worst = order[0], order[1], order[-1]
+        child = (self.candidates[best] + self.candidates[second]) * 0.5 + \
+            MUTATION_SIGMA * SEARCH_RADIUS * next_noise(1)[0]
+        self.candidates[worst] = child
+        self._clip_all()
+        self.scores[worst] = np.nan
+        self.trials[worst] = 0
+        self.ids[worst] = self._next_id
+        self._next_id += 1
+        return True, True
+
+    def target(self, i):
+        return dict(zip(PARAM_KEYS, self.candidates[i].tolist()))
+
+    def best(self):
+        scored = np.where(np.isnan(self.scores), -np.inf, self.scores)
+        i = int(np.argmax(scored)) if self.trials.any() else 0
+        return dict(zip(PARAM_KEYS, self.candidates[i].tolist()))
+
+    def info(self):
+        return {"candidates": self.candidates.round(4).tolist(),
+                "scores": [None if np.isnan(s) else round(float(s), 3) for s in self.scores],
+                "trials": self.trials.tolist(), "active": self.active, "best": self.best()}
+
+
+class _State:
+    """
+    pending 記錄每位玩家上一步分配到的候選：player_id -> (加難索引, 編號, 降難索引, 編號, 擊殺數, 死亡數)
+    族群範圍中其他玩家可能在同一玩家的兩步之間推進 active，評分一律依這裡的紀錄計入
+    """
+    __slots__ = ("lock", "version", "strong", "weak", "steps", "generations", "pending", "_noise", "_cursor")
+
+    def __init__(self, key, profiles, noise):
+        self.lock = threading.Lock()
+        self.version = profiles.version
+        self._noise = noise
+        self._cursor = zlib.crc32(key.encode("utf-8")) % NOISE_TABLE_SIZE
+        self.strong = _Side(profile_vector(profiles.strong), self.next_noise(POP_SIZE - 1))
+        self.weak = _Side(profile_vector(profiles.weak), self.next_noise(POP_SIZE - 1))
+        self.steps = 0
+        self.generations = 0
+        self.pending = OrderedDict()
+
+    def next_noise(self, n):
+        rows = self._noise.take(range(self._cursor, self._cursor + n), axis=0, mode="wrap")
+        self._cursor = (self._cursor + n) % NOISE_TABLE_SIZE
+        return rows
+
+
+class OnlineOptimizer:
+    """
+    伺服器端的線上難度最佳化：以真實遙測評估每位玩家 (或每個族群) 的候選 P_Strong / P_Weak 目標並逐步演化
+    每次請求只做一次評分與至多一次子代產生 (O(POP_SIZE))，不論玩家數多少，單一請求的計算量固定
+    """
+
+    def __init__(self, scope="player", max_states=MAX_STATES, seed=0):
+        if scope not in ("player", "cohort"):
+            raise ValueError(f"未知的最佳化範圍: {scope}")
+        self.scope = scope
+        self.max_states = max_states
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self._noise = np.random.default_rng(seed).standard_normal((NOISE_TABLE_SIZE, 4))
+        self._counts = {"steps": 0, "credited": 0, "generations": 0, "evicted": 0}
+
+    def _key(self, player_id, mode):
+        return player_id if self.scope == "player" else f"mode:{mode}"
+
+    def _state_for(self, key, profiles):
+        with self._lock:
+            state = self._states.get(key)
+            if state is None or state.version != profiles.version:
+                # 新玩家或模型已熱更新：以目前的 GA 模型為中心重新建立候選族群
+                state = self._states[key] = _State(key, profiles, self._noise)
+            self._states.move_to_end(key)
+            if len(self._states) > self.max_states:
+                self._states.popitem(last=False)
+                self._counts["evicted"] += 1
+            self._counts["steps"] += 1
+            return state
+
+    def step(self, player_id, mode, last_action, player_data, profiles):
+        """
+        將這一步的遙測計入上一步分配給這位玩家的候選，回傳這一步要使用的 (P_Strong, P_Weak) 目標
+        last_action 為上一步的動作，用來判斷當時朝哪一邊的目標移動 (維持不動的步驟不計分)
+        """
+        state = self._state_for(self._key(player_id, mode), profiles)
+        with state.lock:
+            state.steps += 1
+            pending = state.pending.pop(player_id, None)
+            credited = evolved = False
+            if pending is not None and last_action is not None:
+                strong_i, strong_id, weak_i, weak_id, kills, deaths = pending
+                outcome = _outcome(player_data, kills, deaths)
+                if "Up" in last_action:
+                    credited, evolved = state.strong.credit(strong_i, strong_id, outcome, True, state.next_noise)
+                elif "Down" in last_action:
+                    credited, evolved = state.weak.credit(weak_i, weak_id, outcome, False, state.next_noise)
+            state.generations += evolved
+            strong_i, strong_id = state.strong.assign()
+            weak_i, weak_id = state.weak.assign()
+            state.pending[player_id] = (strong_i, strong_id, weak_i, weak_id, player_data.get("kill_count", 0),
+                                        player_data.get("death_count", 0))
+            if len(state.pending) > MAX_PENDING:
+                state.pending.popitem(last=False)
+            targets = state.strong.target(strong_i), state.weak.target(weak_i)
+        if credited:
+            with self._lock:
+                self._counts["credited"] += 1
+                self._counts["generations"] += evolved
+        return targets
+
+    def state_info(self, player_id, mode="1"):
+        with self._lock:
+            state = self._states.get(self._key(player_id, mode))
+        if state is None:
+            return None
+        with state.lock:
+            return {"key": self._key(player_id, mode), "version": state.version, "steps": state.steps,
+                    "generations": state.generations, "P_Strong": state.strong.info(), "P_Weak": state.weak.info()}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, scope=self.scope, states=len(self._states), pop_size=POP_SIZE,
+                        trial_steps=TRIAL_STEPS, search_radius=SEARCH_RADIUS)
@@ -0,0 +1,254 @@
+# 離線重播：把過去的遙測以不同的門檻、速率與 P_Strong/P_Weak 重新跑一次 DDA，比較各策略的調整行為
+# 資料來源可為欄位式遙測 (telemetry_store，最精確)、dda_experiment_logs.csv 或每行一筆請求內容的 JSONL
+# 用法: python replay.py --telemetry telemetry --strong-threshold 0.6,0.7,0.8 --weak-threshold 0.2,0.3 --workers 8
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model_core import adjust_difficulty_dda_batch, DDAPolicy, DEFAULT_POLICY, PARAM_KEYS, ACTIONS, ACT_DEATH
+from model_registry import DEFAULT_P_STRONG, DEFAULT_P_WEAK, read_profile, validate_profile
+
+# 每位玩家一步的遙測欄位 (與 adjust_difficulty_dda_batch 的參數同名)
+STEP_FIELDS = ("kill", "death", "dead", "tutorial", "control", "game_time")
+
+
+def _trace_from_steps(steps):
+    # steps 為 [(kill, death, dead, tutorial, control, game_time)]
+    columns = list(zip(*steps))
+    return {field: np.asarray(values, dtype=float if field in ("kill", "death", "game_time") else bool)
+            for field, values in zip(STEP_FIELDS, columns)}
+
+
+def load_telemetry(root, **filters):
+    """
+    從欄位式遙測讀取每位玩家的步驟序列 (依時間排序)，filters 與 ColumnarTable.query 相同
+    """
+    from telemetry_store import TelemetryStore
+    data = TelemetryStore(root).steps.query(columns=("ts", "player_id", "mode", "scene", "status", "kill_count",
+                                                     "death_count", "game_time"), **filters)
+    players, codes = np.unique(data["player_id"], return_inverse=True)
+    order = np.lexsort((data["ts"], codes))
+    starts = np.searchsorted(codes[order], np.arange(len(players)))
+    traces = {}
+    for player_id, rows in zip(players, np.split(order, starts[1:])):
+        traces[player_id] = {"kill": data["kill_count"][rows], "death": data["death_count"][rows],
+                             "dead": data["status"][rows] == "Dead", "tutorial": data["scene"][rows] == "Tutorial",
+                             "control": data["mode"][rows] == "0", "game_time": data["game_time"][rows]}
+    return traces
+
+
+def load_csv(path):
+    """
+    從舊版 CSV 日誌讀取：只有 K/D (小數兩位) 沒有擊殺/死亡數與遊戲時間，以 kill=K/D、death=1 還原比值，
+    並假設開場校準延遲已過 (game_time 視為無限大)，結果為近似值
+    """
+    steps = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 6:
+                continue
+            _, player_id, mode, scene, status, kd = row[:6]
+            steps.setdefault(player_id, []).append(
+                (float(kd), 1.0, status == "Dead", scene == "Tutorial", mode == "0", float("inf")))
+    return {player_id: _trace_from_steps(s) for player_id, s in steps.items()}
+
+
+def load_payloads(path):
+    # 每行一筆 /adjust_difficulty 的 JSON 請求內容，依檔案順序重播
+    steps = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            player_id = (data.get("player_id") or data.get("playerID") or "Subject").strip()
+            steps.setdefault(player_id, []).append(
+                (data.get("kill_count", 0), data.get("death_count", 0), data.get("status", "Alive") == "Dead",
+                 data.get("scene_name", "Unknown") == "Tutorial", str(data.get("mode", "0")) == "0",
+                 data.get("game_time", 0)))
+    return {player_id: _trace_from_steps(s) for player_id, s in steps.items()}
+
+
+def pack_traces(traces):
+    """
+    將各玩家的序列打包成 (步數, 玩家數) 陣列；玩家依步數由多到少排序，第 t 步只需處理仍有資料的前幾位玩家
+    """
+    player_ids = sorted(traces, key=lambda p: -len(traces[p]["kill"]))
+    lengths = np.array([len(traces[p]["kill"]) for p in player_ids], dtype=int)
+    n_steps = int(lengths.max()) if len(lengths) else 0
+    grid = {"player_ids": player_ids, "lengths": lengths}
+    for field in STEP_FIELDS:
+        dtype = bool if field in ("dead", "tutorial", "control") else float
+        array = np.zeros((n_steps, len(player_ids)), dtype=dtype)
+        for j, player_id in enumerate(player_ids):
+            array[:lengths[j], j] = traces[player_id][field]
+        grid[field] = array
+    return grid
+
+
+def replay(grid, P_Strong, P_Weak, policy=DEFAULT_POLICY, columns=slice(None)):
+    """
+    以向量化 DDA 重播 grid 中 (columns 範圍內) 的所有玩家，回傳可相加的統計總和與每位玩家的最終倍率
+    """
+    lengths = grid["lengths"][columns]
+    n = len(lengths)
+    params = np.ones((n, 4))
+    recovery = np.zeros(n, dtype=int)
+    calibrated = np.zeros(n, dtype=bool)
+    action_counts = np.zeros(len(ACTIONS), dtype=np.int64)
+    movement = 0.0
+    deaths_per_player = np.zeros(n, dtype=int)
+    for t in range(int(lengths.max()) if n else 0):
+        k = int((lengths > t).sum())
+        step = [grid[field][t, columns][:k] for field in STEP_FIELDS]
+        new_params, new_recovery, new_calibrated, actions = adjust_difficulty_dda_batch(
+            params[:k], recovery[:k], calibrated[:k], *step, P_Strong, P_Weak, policy)
+        movement += float(np.abs(new_params - params[:k]).sum())
+        params[:k], recovery[:k], calibrated[:k] = new_params, new_recovery, new_calibrated
+        action_counts += np.bincount(actions, minlength=len(ACTIONS))
+        deaths_per_player[:k] += actions == ACT_DEATH
+    return {"players": n, "steps": int(lengths.sum()), "action_counts": action_counts, "movement": movement,
+            "final_sum": params.sum(axis=0), "final_sq_sum": (params ** 2).sum(axis=0),
+            "players_with_death": int((deaths_per_player > 0).sum()), "final_params": params}
+
+
+def summarize(totals):
+    n, steps = max(totals["players"], 1), max(totals["steps"], 1)
+    mean = totals["final_sum"] / n
+    std = np.sqrt(np.maximum(totals["final_sq_sum"] / n - mean ** 2, 0.0))
+    return {"players": totals["players"], "steps": totals["steps"],
+            "action_share": {name: float(c) / steps for name, c in zip(ACTIONS, totals["action_counts"]) if c},
+            "final_params_mean": dict(zip(PARAM_KEYS, mean.round(4).tolist())),
+            "final_params_std": dict(zip(PARAM_KEYS, std.round(4).tolist())),
+            "mean_step_change": totals["movement"] / steps,
+            "players_with_death": totals["players_with_death"]}
+
+
+# --- 多核心掃描：每個工作行程在啟動時取得一份 grid，任務只傳策略與玩家範圍 ---
+_GRID = None
+
+
+def _init_worker(grid):
+    global _GRID
+    _GRID = grid
+
+
+def _run_task(task):
+    variant, strong, weak, policy, columns = task
+    totals = replay(_GRID, strong, weak, policy, columns)
+    totals.pop("final_params")
+    return variant, totals
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    return {key: a[key] + b[key] for key in a}
+
+
+def sweep(grid, variants, workers=None):
+    """
+    variants 為 [(名稱, P_Strong, P_Weak, DDAPolicy)]；策略數少於核心數時再把玩家切塊分給多個行程
+    回傳 [(名稱, policy, 統計摘要)]，順序與 variants 相同
+    """
+    workers = workers or os.cpu_count() or 1
+    n_players = len(grid["player_ids"])
+    chunks = max(1, min(n_players, workers // max(len(variants), 1)))
+    bounds = np.linspace(0, n_players, chunks + 1).astype(int)
+    tasks = [(i, strong, weak, policy, slice(lo, hi)) for i, (_, strong, weak, policy) in enumerate(variants)
+             for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+    totals = [None] * len(variants)
+    if workers == 1:
+        _init_worker(grid)
+        results = map(_run_task, tasks)
+        for i, part in results:
+            totals[i] = _merge(totals[i], part)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(grid,)) as executor:
+            for i, part in executor.map(_run_task, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+                totals[i] = _merge(totals[i], part)
+    return [(name, policy, summarize(total)) for (name, _, _, policy), total in zip(variants, totals)]
+
+
+def load_profile(path):
+    return validate_profile(read_profile(path), os.path.basename(path))
+
+
+def _values(text, cast):
+    return [cast(v) for v in text.split(",")] if text else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以過去的遙測離線重播並掃描 DDA 策略")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--telemetry", help="欄位式遙測目錄 (DDA_TELEMETRY_DIR)")
+    source.add_argument("--csv", help="舊版 dda_experiment_logs.csv (K/D 只有兩位小數，為近似重播)")
+    source.add_argument("--payloads", help="每行一筆 /adjust_difficulty 請求內容的 JSONL")
+    parser.add_argument("--player", action="append", help="只重播指定玩家 (可重複)")
+    parser.add_argument("--mode", action="append", help="只重播指定模式 (僅 --telemetry)")
+    parser.add_argument("--start", help="起始時間 (僅 --telemetry)")
+    parser.add_argument("--end", help="結束時間 (僅 --telemetry)")
+    # 策略參數以逗號分隔多個值，所有組合 (笛卡兒積) 都會重播
+    for field in DDAPolicy._fields:
+        parser.add_argument("--" + field.replace("_", "-"), help=f"預設 {getattr(DEFAULT_POLICY, field)}")
+    parser.add_argument("--profiles", action="append", metavar="STRONG:WEAK",
+                        help="P_Strong 與 P_Weak 檔案 (.json 或舊版 .pkl)，可重複；預設為目前目錄的模型檔")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", help="將每個策略的結果寫成 JSON")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.telemetry:
+        traces = load_telemetry(args.telemetry, player_id=args.player, mode=args.mode, start=args.start,
+                                end=args.end)
+    else:
+        traces = load_csv(args.csv) if args.csv else load_payloads(args.payloads)
+        if args.player:
+            traces = {p: t for p, t in traces.items() if p in args.player}
+    if not traces:
+        raise SystemExit("❌ 沒有可重播的資料")
+    grid = pack_traces(traces)
+    t_load = time.perf_counter() - t0
+
+    profile_sets = []
+    for spec in args.profiles or []:
+        strong_path, weak_path = spec.split(":")
+        profile_sets.append((spec, load_profile(strong_path), load_profile(weak_path)))
+    if not profile_sets:
+        if os.path.exists("P_Strong.json") and os.path.exists("P_Weak.json"):
+            profile_sets.append(("P_Strong.json:P_Weak.json", load_profile("P_Strong.json"),
+                                 load_profile("P_Weak.json")))
+        else:
+            profile_sets.append(("default", DEFAULT_P_STRONG, DEFAULT_P_WEAK))
+
+    grids = []
+    for field in DDAPolicy._fields:
+        cast = int if field == "recovery_steps" else float
+        grids.append(_values(getattr(args, field), cast) or [getattr(DEFAULT_POLICY, field)])
+    variants = [(label, strong, weak, DDAPolicy(*values))
+                for (label, strong, weak), values in itertools.product(profile_sets, itertools.product(*grids))]
+
+    t0 = time.perf_counter()
+    results = sweep(grid, variants, args.workers)
+    elapsed = time.perf_counter() - t0
+    print(f"📊 {len(grid['player_ids'])} 位玩家 / {int(grid['lengths'].sum())} 步，{len(variants)} 個策略，"
+          f"載入 {t_load:.2f}s，重播 {elapsed:.2f}s ({args.workers} 行程)")
+    for (label, _, _, _), (_, policy, summary) in zip(variants, results):
+        share = summary["action_share"]
+        print(f"   {label} 強>{policy.strong_threshold} 弱<{policy.weak_threshold} 速率 {policy.rate_normal}/"
+              f"{policy.rate_fast} | 上調 {share.get('Adjusted Up', 0):.1%} 下調 {share.get('Adjusted Down', 0):.1%} "
+              f"平衡 {share.get('Stay Balanced', 0):.1%} | 平均最終 HP {summary['final_params_mean']['HP_Mult']:.3f} "
+              f"| 每步變動 {summary['mean_step_change']:.4f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([{"profiles": label, "policy": policy._asdict(), **summary}
+                       for (label, _, _, _), (_, policy, summary) in zip(variants, results)],
+                      f, ensure_ascii=False, indent=2)
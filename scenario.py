@@ -0,0 +1,44 @@
+# 模擬受試者的遊玩劇本 (test.py 示範與 bench.py 壓測共用)
+# 每一步為 (擊殺, 死亡, 狀態, 步數)
+
+PHASES = [
+    ("階段 1: 玩家表現強勢 (預期：難度上升)", [(12, 0, "Alive", i) for i in range(1, 11)]),
+    # K/D = 1 / 2 = 0.5 (落在 0.3~0.7 區間)
+    ("階段 2: 表現平衡 (預期：Stay Balanced)", [(1, 2, "Alive", i) for i in range(11, 16)]),
+    # K/D = 0 / 2 = 0
+    ("階段 3: 表現下滑 (預期：難度下降)", [(0, 2, "Alive", i) for i in range(16, 21)]),
+    ("階段 4: 玩家死亡 (預期：Emergency Down)", [(0, 1, "Dead", 21)]),
+    # 即使表現變好，回升速度也應該被限制
+    ("階段 5: 死亡後的冷靜期 (預期：Restricted Recovery)", [(10, 0, "Alive", i) for i in range(22, 26)]),
+]
+
+
+def step_payload(p_id, kills, deaths, status, step, mode="1"):
+    return {
+        "player_id": p_id,
+        "mode": mode,  # 測試 5秒組
+        "scene_name": "MainGame",
+        "status": status,
+        "kill_count": kills,
+        "death_count": deaths,
+        "game_time": step * 5
+    }
+
+
+def final_payload(p_id, mode="1"):
+    return {
+        "player_id": p_id,
+        "mode": mode,
+        "totalDamage": 5000,
+        "damageTaken": 800,
+        "kills": 150,
+        "deaths": 5,
+        "completionTime": 130.0,
+        "result": "Completed"
+    }
+
+
+def iter_steps():
+    for phase, steps in PHASES:
+        for kills, deaths, status, step in steps:
+            yield phase, kills, deaths, status, step
@@ -0,0 +1,245 @@
+# 記憶體 session 的持久化：每次寫入先記一筆 WAL (只含狀態與新增的歷史)，定期壓實成 checkpoint
+# 重啟時載入最新 checkpoint 的索引 (session 本體延遲載回)，再重播之後的 WAL，玩家不會回到 1.0 倍率重新校準
+import json
+import os
+import threading
+import time
+
+from session_store import HistoryRecord, new_session
+
+# 每次寫入都會完整記錄的 session 欄位 (歷史另以增量記錄)
+STATE_KEYS = ("params", "recovery_counter", "has_calibrated", "mode", "last_updated", "final_result")
+# WAL 寫入與 fsync 間隔 (秒)，也就是當機時最多遺失的時間範圍；checkpoint 間隔與 WAL 大小上限
+FLUSH_INTERVAL = 1.0
+CHECKPOINT_INTERVAL = 300.0
+MAX_WAL_BYTES = 64 * 1024 * 1024
+
+
+class CheckpointSource:
+    """
+    checkpoint 資料檔：所有 session 的 JSON 依序串接，索引記錄每位玩家的位移、長度與摘要
+    """
+
+    def __init__(self, path=None, index=None):
+        self.path = path
+        self.index = index or {}
+        self._lock = threading.Lock()
+
+    def read_raw(self, player_id):
+        # 持鎖讀取，避免與 checkpoint 切換檔案衝突
+        with self._lock:
+            offset, length, _ = self.index[player_id]
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+    def read(self, player_id):
+        return json.loads(self.read_raw(player_id))
+
+    def release(self, player_id):
+        # 資料仍留在 checkpoint 檔中，直到下一次 checkpoint 改寫
+        pass
+
+    def swap(self, path, index):
+        with self._lock:
+            self.path, self.index = path, index
+
+
+class SessionJournal:
+    """
+    MemorySessionStore 的 WAL + checkpoint；record() 只把一行 JSON 放進緩衝，由背景執行緒寫檔
+    """
+
+    def __init__(self, directory, flush_interval=FLUSH_INTERVAL, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 max_wal_bytes=MAX_WAL_BYTES):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.max_wal_bytes = max_wal_bytes
+        self.source = CheckpointSource()
+        self.gen = 0
+        self._lines = []
+        self._logged = {}
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._wal = None
+        self._wal_bytes = 0
+        self._last_checkpoint = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind, gen):
+        return os.path.join(self.directory, f"{kind}-{gen:08d}")
+
+    def _gens(self, kind, suffix):
+        gens = []
+        for name in os.listdir(self.directory):
+            if name.startswith(kind + "-") and name.endswith(suffix) and not name.endswith(".tmp"):
+                gens.append(int(name[len(kind) + 1:len(name) - len(suffix)]))
+        return sorted(gens)
+
+    def _open_wal(self, gen):
+        if self._wal is not None:
+            self._wal.close()
+        self.gen = gen
+        self._wal = open(self._path("wal", gen) + ".log", "a", encoding="utf-8")
+        self._wal_bytes = 0
+
+    def record(self, player_id, session):
+        """
+        記錄一位玩家的最新狀態與上次記錄後新增的歷史 (呼叫端須持有該玩家的 session 鎖)
+        """
+        history = session["history"]
+        records, _ = history.since(self._logged.get(player_id, 0))
+        line = json.dumps({"p": player_id, "t": history.total, "h": records,
+                           "s": {key: session[key] for key in STATE_KEYS}}, ensure_ascii=False)
+        with self._lock:
+            self._lines.append(line)
+        self._logged[player_id] = history.total
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+            if not lines or self._wal is None:
+                return 0
+            data = "\n".join(lines) + "\n"
+            self._wal.write(data)
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._wal_bytes += len(data)
+        return len(lines)
+
+    def restore(self, store):
+        """
+        從最新的完整 checkpoint 與之後的 WAL 還原到 store，回傳 (checkpoint 玩家數, 重播筆數)
+        """
+        t0 = time.perf_counter()
+        checkpoints = self._gens("checkpoint", ".idx")
+        base = checkpoints[-1] if checkpoints else 0
+        restored = 0
+        if checkpoints:
+            with open(self._path("checkpoint", base) + ".idx", encoding="utf-8") as f:
+                index = json.load(f)["players"]
+            self.source.swap(self._path("checkpoint", base) + ".dat", index)
+            for player_id, (_, _, summary) in index.items():
+                restored += store.register_cold(player_id, summary, self.source)
+
+        replayed = 0
+        wal_gens = [gen for gen in self._gens("wal", ".log") if gen >= base]
+        for gen in wal_gens:
+            replayed += self._replay(store, self._path("wal", gen) + ".log")
+        for summary in store.players():
+            self._logged[summary["player_id"]] = summary["steps"]
+        # 從新的 WAL 開始寫，避免接在可能被截斷的舊檔尾端
+        self._open_wal(max([base] + wal_gens) + 1)
+        if restored or replayed:
+            print(f"♻️ 已還原 {restored} 位玩家的 checkpoint，重播 {replayed} 筆 WAL "
+                  f"({time.perf_counter() - t0:.2f}s)")
+        return restored, replayed
+
+    def _replay(self, store, path):
+        replayed = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 當機時最後一行可能只寫了一半
+                    continue
+                self._apply(store, entry)
+                replayed += 1
+        return replayed
+
+    def _apply(self, store, entry):
+        state = entry["s"]
+        cold = store.cold_summary(entry["p"])
+        if cold is not None and cold["last_updated"] >= state["last_updated"]:
+            # checkpoint 或落地檔已比這筆新，不必為了重播把 session 載回記憶體
+            return
+
+        def create():
+            session = new_session(state["mode"], store.history_depth)
+            session["last_updated"] = 0.0
+            return session
+
+        with store.session(entry["p"], create=create) as session:
+            # 重播可能與 checkpoint 或落地檔重疊：只套用不比現有狀態舊的紀錄，歷史依序號去重
+            if session["last_updated"] > state["last_updated"]:
+                return
+            session.update(state)
+            history = session["history"]
+            first = entry["t"] - len(entry["h"])
+            if history.total < first:
+                history.total = first
+            for seq, record in enumerate(entry["h"], start=first):
+                if seq >= history.total:
+                    history.append(HistoryRecord.from_dict(record))
+
+    def checkpoint(self, store):
+        """
+        切換到新的 WAL 後把所有 session 寫成新的 checkpoint，完成後刪除舊的 checkpoint 與 WAL
+        記憶體中的 session 重新序列化；尚未載回的 checkpoint 玩家直接複製原始資料，不必載入記憶體
+        """
+        with self._checkpoint_lock:
+            self.flush()
+            with self._lock:
+                self._open_wal(self.gen + 1)
+            gen = self.gen
+            path = self._path("checkpoint", gen)
+            index, offset = {}, 0
+            with open(path + ".dat", "wb") as f:
+                for player_id, summary, payload in store.checkpoint_entries(self.source):
+                    if not isinstance(payload, bytes):
+                        payload = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                    f.write(payload)
+                    index[player_id] = [offset, len(payload), summary]
+                    offset += len(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            # 索引最後寫入，存在 .idx 即代表這份 checkpoint 完整
+            with open(path + ".idx.tmp", "w", encoding="utf-8") as f:
+                json.dump({"players": index, "created": time.time()}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".idx.tmp", path + ".idx")
+            self.source.swap(path + ".dat", index)
+
+            # 刪除舊世代的檔案 (包含中途失敗、沒有索引的 checkpoint 資料檔)
+            for name in os.listdir(self.directory):
+                kind, _, rest = name.partition("-")
+                if kind in ("checkpoint", "wal") and int(rest[:8]) < gen:
+                    os.remove(os.path.join(self.directory, name))
+            self._last_checkpoint = time.monotonic()
+            return len(index)
+
+    def start(self, store):
+        # 背景執行緒：定期寫入 WAL，到達間隔或 WAL 過大時壓實成 checkpoint
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush()
+                    if (time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+                            or self._wal_bytes >= self.max_wal_bytes):
+                        self.checkpoint(store)
+                except OSError as e:
+                    print(f"⚠️ session 快照寫入失敗: {e}")
+
+        store.journal = self
+        self._thread = threading.Thread(target=run, name="session-journal", daemon=True)
+        self._thread.start()
+
+    def close(self, store):
+        # 正常關閉時寫完 WAL 並做一次 checkpoint，下次啟動不需重播
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        self.checkpoint(store)
+        store.journal = None
+        self._wal.close()
@@ -0,0 +1,575 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager, ExitStack
+from datetime import datetime
+
+# 鎖分段數量：不同玩家大多落在不同分段可平行更新，同一玩家永遠使用同一把鎖依序更新
+DEFAULT_LOCK_STRIPES = 64
+# 每位玩家保留的歷史筆數上限 (5 秒一步約 2.7 小時)，更舊的紀錄由環形緩衝區淘汰
+DEFAULT_HISTORY_DEPTH = 2000
+
+
+class HistoryRecord:
+    """
+    單步歷史紀錄，以 __slots__ 取代每步一個 dict 以節省記憶體
+    """
+    __slots__ = ("kd", "hp", "atk", "det", "spd", "action", "status", "version")
+
+    def __init__(self, kd, hp, atk, det, spd, action, status, version=None):
+        self.kd, self.hp, self.atk, self.det, self.spd = kd, hp, atk, det, spd
+        # 動作、狀態與模型版本只有少數幾種字串，intern 後所有紀錄共用同一份
+        self.action = sys.intern(action)
+        self.status = sys.intern(status)
+        self.version = sys.intern(version) if version is not None else None
+
+    def to_dict(self):
+        return {"kd": self.kd, "hp": self.hp, "atk": self.atk, "det": self.det, "spd": self.spd,
+                "action": self.action, "status": self.status, "version": self.version}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["kd"], d["hp"], d["atk"], d["det"], d["spd"], d["action"], d["status"], d.get("version"))
+
+
+class HistoryBuffer:
+    """
+    固定深度的歷史環形緩衝區；total 為累計寫入筆數，作為增量查詢的序號游標
+    """
+    __slots__ = ("_records", "total")
+
+    def __init__(self, depth=DEFAULT_HISTORY_DEPTH, records=(), total=None):
+        self._records = deque(records, maxlen=depth)
+        self.total = len(self._records) if total is None else total
+
+    @property
+    def first_seq(self):
+        return self.total - len(self._records)
+
+    def append(self, record):
+        self._records.append(record)
+        self.total += 1
+
+    def since(self, seq):
+        # 回傳序號 seq 之後的紀錄；游標已被淘汰或超出範圍時回傳全部保留紀錄並標記 reset
+        if seq < self.first_seq or seq > self.total:
+            return [r.to_dict() for r in self._records], True
+        # 只走訪新增的部分 (通常只有最後幾筆)，不必掃過整個緩衝區
+        records = self._records
+        return [records[i].to_dict() for i in range(seq - self.first_seq, len(records))], False
+
+    def to_list(self):
+        return [r.to_dict() for r in self._records]
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+
+def new_session(mode, history_depth=DEFAULT_HISTORY_DEPTH):
+    return {
+        "params": {"HP_Mult": 1.0, "ATK_Mult": 1.0, "Det_Range": 1.0, "Move_Speed": 1.0},
+        "history": HistoryBuffer(history_depth), "has_calibrated": False, "recovery_counter": 0,
+        "final_result": None, "mode": mode, "last_updated": datetime.now().timestamp()
+    }
+
+
+def session_to_dict(session):
+    # 轉成可 JSON 序列化的 dict (SQLite 後端、落地檔與 /get_history 使用)
+    data = dict(session)
+    data["history"] = session["history"].to_list()
+    data["history_total"] = session["history"].total
+    return data
+
+
+def session_from_dict(data, history_depth=DEFAULT_HISTORY_DEPTH):
+    session = dict(data)
+    records = [HistoryRecord.from_dict(d) for d in session["history"]]
+    session["history"] = HistoryBuffer(history_depth, records, session.pop("history_total", len(records)))
+    return session
+
+
+def _summary(player_id, session):
+    return {"player_id": player_id, "last_updated": session["last_updated"], "mode": session["mode"],
+            "steps": session["history"].total, "has_final_result": session["final_result"] is not None}
+
+
+class SpillDirectory:
+    """
+    閒置 session 的落地目錄，每位玩家一個 JSON 檔；與 checkpoint 相同，提供 read / release 讓 session 延遲載回
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _path(self, player_id):
+        return os.path.join(self.path, hashlib.sha1(player_id.encode("utf-8")).hexdigest() + ".json")
+
+    def scan(self, history_depth=DEFAULT_HISTORY_DEPTH):
+        # 逐一讀取落地檔，回傳 (player_id, 摘要)
+        if not self.path or not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith(".json"):
+                with open(os.path.join(self.path, name), encoding="utf-8") as f:
+                    data = json.load(f)
+                player_id = data.pop("player_id")
+                yield player_id, _summary(player_id, session_from_dict(data, history_depth))
+
+    def write(self, player_id, session):
+        os.makedirs(self.path, exist_ok=True)
+        data = session_to_dict(session)
+        data["player_id"] = player_id
+        path = self._path(player_id)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def read(self, player_id):
+        with open(self._path(player_id), encoding="utf-8") as f:
+            data = json.load(f)
+        data.pop("player_id", None)
+        return data
+
+    def release(self, player_id):
+        # session 已載回記憶體，落地檔不再需要
+        os.remove(self._path(player_id))
+
+
+class MemorySessionStore:
+    """
+    行程內的 session 儲存 (預設)，以分段鎖保護每位玩家的讀-改-寫
+    設定 idle_timeout 後，閒置過久的 session 會寫到 spill_dir 並移出記憶體，下次存取時再延遲載回
+    """
+
+    def __init__(self, lock_stripes=DEFAULT_LOCK_STRIPES, history_depth=DEFAULT_HISTORY_DEPTH, idle_timeout=None,
+                 spill_dir="session_spill"):
+        self.sessions = {}
+        self.history_depth = history_depth
+        self.idle_timeout = idle_timeout
+        self.spill = SpillDirectory(spill_dir)
+        # 不在記憶體中的玩家 (已落地或尚未從 checkpoint 載回)：player_id -> (摘要, 來源)，玩家清單不必讀檔
+        self._cold = {}
+        # 設定後，每次 session() / batch() 寫入完成都會呼叫 journal.record(player_id, session)
+        self.journal = None
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._evictor = None
+        self._stop = threading.Event()
+        for player_id, summary in self.spill.scan(history_depth):
+            self._cold[player_id] = (summary, self.spill)
+
+    def _lock_for(self, player_id):
+        return self._locks[hash(player_id) % len(self._locks)]
+
+    def register_cold(self, player_id, summary, source):
+        """
+        登記一個可延遲載回的 session (例如 checkpoint 中的玩家)；已有較新的版本時忽略，回傳是否登記
+        """
+        with self._lock_for(player_id):
+            if player_id in self.sessions:
+                return False
+            existing = self._cold.get(player_id)
+            if existing is not None:
+                if existing[0]["last_updated"] >= summary["last_updated"]:
+                    return False
+                existing[1].release(player_id)
+            self._cold[player_id] = (summary, source)
+            return True
+
+    def cold_summary(self, player_id):
+        entry = self._cold.get(player_id)
+        return entry[0] if entry is not None else None
+
+    def cold_players(self, source):
+        return [player_id for player_id, (_, s) in list(self._cold.items()) if s is source]
+
+    def _load(self, player_id):
+        # 呼叫端須持有該玩家的鎖
+        session = self.sessions.get(player_id)
+        if session is None and player_id in self._cold:
+            _, source = self._cold[player_id]
+            session = self.sessions[player_id] = session_from_dict(source.read(player_id), self.history_depth)
+            del self._cold[player_id]
+            source.release(player_id)
+        return session
+
+    @contextmanager
+    def session(self, player_id, create=None):
+        # 玩家不存在時以 create() 建立；create 為 None 則回傳 None
+        with self._lock_for(player_id):
+            session = self._load(player_id)
+            if session is None and create is not None:
+                session = self.sessions[player_id] = create()
+            yield session
+            if session is not None and self.journal is not None:
+                self.journal.record(player_id, session)
+
+    @contextmanager
+    def batch(self, player_ids, create=None):
+        # 一次鎖定多位玩家 (create 接收 player_id)；分段鎖依編號排序取得以避免死結
+        stripes = sorted({hash(player_id) % len(self._locks) for player_id in player_ids})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._locks[stripe])
+            sessions = {}
+            for player_id in player_ids:
+                session = self._load(player_id)
+                if session is None and create is not None:
+                    session = self.sessions[player_id] = create(player_id)
+                sessions[player_id] = session
+            yield sessions
+            if self.journal is not None:
+                for player_id, session in sessions.items():
+                    if session is not None:
+                        self.journal.record(player_id, session)
+
+    @contextmanager
+    def view(self, player_id):
+        # 唯讀存取單一玩家，持有鎖直到離開區塊
+        with self._lock_for(player_id):
+            yield self._load(player_id)
+
+    def evict_idle(self, now=None):
+        """
+        將超過 idle_timeout 秒未更新的 session 寫入 spill_dir 並釋放記憶體，回傳移出的數量
+        """
+        if self.idle_timeout is None:
+            return 0
+        cutoff = (now if now is not None else datetime.now().timestamp()) - self.idle_timeout
+        evicted = 0
+        for player_id, session in list(self.sessions.items()):
+            if session["last_updated"] >= cutoff:
+                continue
+            with self._lock_for(player_id):
+                session = self.sessions.get(player_id)
+                if session is None or session["last_updated"] >= cutoff:
+                    continue
+                self.spill.write(player_id, session)
+                self._cold[player_id] = (_summary(player_id, session), self.spill)
+                del self.sessions[player_id]
+                evicted += 1
+        return evicted
+
+    def checkpoint_entries(self, source):
+        """
+        逐一持鎖輸出要寫入 checkpoint 的 (player_id, 摘要, 資料)：記憶體中的 session 為 dict，
+        仍留在 source (上一份 checkpoint) 中的玩家為原始位元組；已落地的玩家有自己的檔案，不重複寫入
+        """
+        for player_id in list(self.sessions) + self.cold_players(source):
+            with self._lock_for(player_id):
+                session = self.sessions.get(player_id)
+                if session is not None:
+                    yield player_id, _summary(player_id, session), session_to_dict(session)
+                elif player_id in self._cold and self._cold[player_id][1] is source:
+                    yield player_id, self._cold[player_id][0], source.read_raw(player_id)
+
+    def start_evictor(self, interval=60.0):
+        # 背景執行緒定期移出閒置 session
+        if self.idle_timeout is None or self._evictor is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.evict_idle()
+                except OSError as e:
+                    print(f"⚠️ 閒置 session 落地失敗: {e}")
+
+        self._evictor = threading.Thread(target=run, name="session-evictor", daemon=True)
+        self._evictor.start()
+
+    def stop_evictor(self):
+        self._stop.set()
+
+    def snapshot(self):
+        # 轉成可序列化的 dict；逐一持鎖複製，避免與寫入中的歷史緩衝區衝突；已落地的 session 直接讀檔不載回
+        result = {}
+        for player_id in list(self._cold):
+            with self._lock_for(player_id):
+                if player_id in self._cold:
+                    result[player_id] = self._cold[player_id][1].read(player_id)
+        for player_id in list(self.sessions):
+            with self._lock_for(player_id):
+                session = self.sessions.get(player_id)
+                if session is not None:
+                    result[player_id] = session_to_dict(session)
+        return result
+
+    def players(self):
+        summaries = {player_id: summary for player_id, (summary, _) in list(self._cold.items())}
+        for player_id, session in list(self.sessions.items()):
+            summaries[player_id] = _summary(player_id, session)
+        return list(summaries.values())
+
+    def stats(self, active_window=60.0):
+        # 供 /metrics 使用：記憶體中與已落地的 session 數、最近 active_window 秒內有更新的玩家數與歷史總筆數
+        cutoff = datetime.now().timestamp() - active_window
+        sessions = list(self.sessions.values())
+        return {"in_memory": len(sessions), "cold": len(self._cold),
+                "active": sum(1 for s in sessions if s["last_updated"] >= cutoff),
+                "history_records": sum(len(s["history"]) for s in sessions)}
+
+    def __contains__(self, player_id):
+        return player_id in self.sessions or player_id in self._cold
+
+    def __len__(self):
+        return len(self.sessions) + len(self._cold)
+
+
+class AppendOnlyHistory:
+    """
+    SQLite 後端寫入路徑用的歷史：只帶累計筆數與最後一筆紀錄 (存在 session 列中)，新紀錄暫存在 pending，
+    交易提交時逐列附加到 history 表；每一步的成本與歷史深度無關
+    只支援寫入路徑需要的操作 (append、total、len、[-1])，完整歷史請用 view() 取得的 HistoryBuffer
+    """
+    __slots__ = ("depth", "total", "last", "pending")
+
+    def __init__(self, depth, total=0, last=None):
+        self.depth = depth
+        self.total = total
+        self.last = last
+        self.pending = []
+
+    @property
+    def first_seq(self):
+        return self.total - len(self)
+
+    def append(self, record):
+        self.pending.append(record)
+        self.last = record
+        self.total += 1
+
+    def __len__(self):
+        return min(self.total, self.depth)
+
+    def __getitem__(self, index):
+        if index != -1 or self.last is None:
+            raise IndexError("AppendOnlyHistory 只能讀取最後一筆紀錄")
+        return self.last
+
+
+def _record_row(player_id, seq, r):
+    return player_id, seq, r.kd, r.hp, r.atk, r.det, r.spd, r.action, r.status, r.version
+
+
+def _record_from_row(row):
+    return HistoryRecord(*row)
+
+
+class SQLiteSessionStore:
+    """
+    本機 SQLite session 儲存，讓多個 gunicorn worker 共用同一批玩家狀態
+    行程內以分段鎖排序，跨行程則以 BEGIN IMMEDIATE 交易保證同一玩家的更新不會遺失
+    sessions 表每位玩家一列小型狀態 (不含歷史)；歷史放在以 (player_id, seq) 為鍵的 history 表，每一步只附加一列
+    並刪除超出深度的舊列，寫入成本不隨歷史長度增加
+    """
+
+    def __init__(self, path, lock_stripes=DEFAULT_LOCK_STRIPES, history_depth=DEFAULT_HISTORY_DEPTH, timeout=30.0):
+        self.path = path
+        self.history_depth = history_depth
+        self.timeout = timeout
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                     "(player_id TEXT PRIMARY KEY, data TEXT NOT NULL, last_updated REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS history "
+                     "(player_id TEXT NOT NULL, seq INTEGER NOT NULL, kd REAL, hp REAL, atk REAL, det REAL, spd REAL, "
+                     "action TEXT, status TEXT, version TEXT, PRIMARY KEY (player_id, seq)) WITHOUT ROWID")
+        self._migrate_inline_history(conn)
+
+    def _migrate_inline_history(self, conn):
+        # 舊版把整份歷史放在 sessions.data 的 JSON 中：一次性搬到 history 表 (多個 worker 同時啟動時由交易排序)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT player_id, data FROM sessions "
+                                "WHERE json_type(data, '$.history') IS NOT NULL").fetchall()
+            for player_id, data in rows:
+                session = session_from_dict(json.loads(data), self.history_depth)
+                history = session["history"]
+                conn.executemany("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [_record_row(player_id, history.first_seq + i, r) for i, r in enumerate(history)])
+                session["history"] = AppendOnlyHistory(self.history_depth, history.total,
+                                                       history[-1] if len(history) else None)
+                conn.execute("UPDATE sessions SET data = ? WHERE player_id = ?",
+                             (self._dump(session), player_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if rows:
+            print(f"🔁 已將 {len(rows)} 位玩家的歷史搬移到 history 表")
+
+    def _conn(self):
+        # sqlite3 連線不可跨執行緒共用，每個執行緒各自建立一條
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _lock_for(self, player_id):
+        return self._locks[hash(player_id) % len(self._locks)]
+
+    @staticmethod
+    def _dump(session):
+        # session 列只存狀態、累計筆數與最後一筆紀錄 (動作判斷需要)，不含歷史
+        data = dict(session)
+        history = data.pop("history")
+        data["history_total"] = history.total
+        data["history_last"] = history[-1].to_dict() if len(history) else None
+        return json.dumps(data)
+
+    def _load(self, data):
+        session = json.loads(data)
+        last = session.pop("history_last", None)
+        session["history"] = AppendOnlyHistory(self.history_depth, session.pop("history_total", 0),
+                                               HistoryRecord.from_dict(last) if last else None)
+        return session
+
+    def _save(self, conn, items):
+        # items 為 [(player_id, session)]：更新 session 列、附加新紀錄並刪除超出深度的舊紀錄
+        conn.executemany("INSERT OR REPLACE INTO sessions (player_id, data, last_updated) VALUES (?, ?, ?)",
+                         [(player_id, self._dump(session), session["last_updated"]) for player_id, session in items])
+        rows, trims = [], []
+        for player_id, session in items:
+            history = session["history"]
+            if not history.pending:
+                continue
+            start = history.total - len(history.pending)
+            rows += [_record_row(player_id, start + i, r) for i, r in enumerate(history.pending)]
+            trims.append((player_id, history.total - self.history_depth))
+            history.pending = []
+        if rows:
+            conn.executemany("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("DELETE FROM history WHERE player_id = ? AND seq < ?", trims)
+
+    @contextmanager
+    def session(self, player_id, create=None):
+        with self._lock_for(player_id):
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT data FROM sessions WHERE player_id = ?", (player_id,)).fetchone()
+                if row:
+                    session = self._load(row[0])
+                else:
+                    session = self._fresh(create()) if create is not None else None
+                yield session
+                if session is not None:
+                    self._save(conn, [(player_id, session)])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _fresh(self, session):
+        # create() 回傳記憶體用的 HistoryBuffer，換成只附加的版本
+        history = session["history"]
+        appended = AppendOnlyHistory(self.history_depth)
+        for record in history:
+            appended.append(record)
+        session["history"] = appended
+        return session
+
+    @contextmanager
+    def batch(self, player_ids, create=None):
+        # 多位玩家在同一個交易內讀取與寫回
+        stripes = sorted({hash(player_id) % len(self._locks) for player_id in player_ids})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._locks[stripe])
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                sessions = {}
+                for player_id in player_ids:
+                    row = conn.execute("SELECT data FROM sessions WHERE player_id = ?", (player_id,)).fetchone()
+                    if row:
+                        sessions[player_id] = self._load(row[0])
+                    else:
+                        sessions[player_id] = self._fresh(create(player_id)) if create is not None else None
+                yield sessions
+                self._save(conn, [(player_id, session) for player_id, session in sessions.items()
+                                  if session is not None])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _history(self, conn, player_id, total):
+        rows = conn.execute("SELECT kd, hp, atk, det, spd, action, status, version FROM history "
+                            "WHERE player_id = ? AND seq >= ? ORDER BY seq",
+                            (player_id, total - self.history_depth)).fetchall()
+        return HistoryBuffer(self.history_depth, map(_record_from_row, rows), total)
+
+    @contextmanager
+    def view(self, player_id):
+        # 讀取路徑 (面板查詢) 才載入完整歷史；session 列與歷史在同一個讀取交易中，彼此一致
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT data FROM sessions WHERE player_id = ?", (player_id,)).fetchone()
+            session = None
+            if row:
+                session = self._load(row[0])
+                session["history"] = self._history(conn, player_id, session["history"].total)
+        finally:
+            conn.execute("COMMIT")
+        yield session
+
+    def snapshot(self):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            result = {}
+            for player_id, data in conn.execute("SELECT player_id, data FROM sessions").fetchall():
+                session = self._load(data)
+                session["history"] = self._history(conn, player_id, session["history"].total)
+                result[player_id] = session_to_dict(session)
+        finally:
+            conn.execute("COMMIT")
+        return result
+
+    def players(self):
+        # 以 SQLite JSON 函式直接取摘要欄位
+        rows = self._conn().execute(
+            "SELECT player_id, last_updated, json_extract(data, '$.mode'), json_extract(data, '$.history_total'), "
+            "json_type(data, '$.final_result') != 'null' FROM sessions").fetchall()
+        return [{"player_id": player_id, "last_updated": last_updated, "mode": mode, "steps": steps,
+                 "has_final_result": bool(has_final)}
+                for player_id, last_updated, mode, steps, has_final in rows]
+
+    def stats(self, active_window=60.0):
+        # 所有 session 都在資料庫中，沒有記憶體/落地之分，改以 stored 回報總數；
+        # history_records 的量測是記憶體中的紀錄數，資料庫後端不適用
+        total, active = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(last_updated >= ?), 0) FROM sessions",
+            (datetime.now().timestamp() - active_window,)).fetchone()
+        return {"in_memory": None, "cold": None, "stored": total, "active": active, "history_records": None}
+
+    def __contains__(self, player_id):
+        return self._conn().execute("SELECT 1 FROM sessions WHERE player_id = ?", (player_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_store(backend="memory", db_path="dda_sessions.db", lock_stripes=DEFAULT_LOCK_STRIPES,
+                         history_depth=DEFAULT_HISTORY_DEPTH, idle_timeout=None, spill_dir="session_spill"):
+    if backend == "memory":
+        return MemorySessionStore(lock_stripes, history_depth, idle_timeout, spill_dir)
+    if backend == "sqlite":
+        return SQLiteSessionStore(db_path, lock_stripes, history_depth)
+    raise ValueError(f"未知的 session 儲存後端: {backend}")
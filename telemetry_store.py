@@ -0,0 +1,367 @@
+# 以欄位式二進位區段保存實驗遙測 (完整精度倍率、K/D、動作代碼與 epoch 時間戳記)，取代只能重新解析 CSV 的分析流程
+# 每個區段是一個目錄，內含每欄一個 .npy 與 meta.json；讀取時以 mmap 開啟，依 meta 中的時間範圍與字典先略過不相關的區段
+# numpy 只在寫出區段與查詢時才匯入 (伺服器的 record_step 只排入緩衝)，不拖慢 API 啟動
+# 用法: python telemetry_store.py export steps out.csv [--player P] [--mode 1] [--start 2026-01-01] [--end ...]
+#       python telemetry_store.py compact
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from model_core import ACTIONS, PARAM_KEYS
+
+# 緩衝達到 SEGMENT_ROWS 筆或背景執行緒定期觸發時寫出一個區段；compact() 會把小區段合併到接近這個大小
+SEGMENT_ROWS = 65536
+
+# 舊版 CSV 的欄位 (flask_api 寫入的即時日誌與 export_csv 共用)
+LOG_HEADER = ["時間", "玩家ID", "模式", "場景", "狀態", "K/D值", "HP倍率", "ATK倍率", "DET倍率", "SPD倍率",
+              "HP實值", "ATK實值", "DET實值", "SPD實值", "動作", "模型版本"]
+FINAL_HEADER = ["紀錄時間", "玩家ID", "模式", "總造成傷害", "總受到傷害", "擊殺數", "死亡數", "通關時間",
+                "實驗結果", "模型版本"]
+# 同一欄位在不同版本的舊檔案中使用過的名稱 (舊名 -> 目前名稱)，遷移標題時視為同一欄
+HEADER_ALIASES = {"結果狀態": "實驗結果"}
+
+# 欄位定義：dtype 為 "str" 者在每個區段內以字典編碼 (int32 代碼 + meta 中的字串表)
+STEP_SCHEMA = (("ts", "f8"), ("player_id", "str"), ("mode", "str"), ("scene", "str"), ("status", "str"),
+               ("kd", "f8"), ("HP_Mult", "f8"), ("ATK_Mult", "f8"), ("Det_Range", "f8"), ("Move_Speed", "f8"),
+               ("kill_count", "f8"), ("death_count", "f8"), ("game_time", "f8"), ("action", "i1"),
+               ("version", "str"))
+FINAL_SCHEMA = (("ts", "f8"), ("player_id", "str"), ("mode", "str"), ("total_damage", "f8"), ("damage_taken", "f8"),
+                ("kills", "f8"), ("deaths", "f8"), ("completion_time", "f8"), ("result", "str"), ("version", "str"))
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+
+def to_number(value):
+    # Unity 傳來的數值欄位可能缺漏或是字串，無法轉換時記為 NaN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _to_epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+class ColumnarTable:
+    """
+    只可附加的欄位式資料表：append 只放進記憶體緩衝，flush 時寫成不可變的區段
+    """
+
+    def __init__(self, root, schema, attrs=None, segment_rows=SEGMENT_ROWS):
+        self.root = root
+        self.schema = schema
+        self.columns = [name for name, _ in schema]
+        self.attrs = attrs or {}
+        self.segment_rows = segment_rows
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._meta_cache = {}
+        self._seq = itertools.count()
+
+    def append(self, row):
+        # row 為依 schema 順序排列的 tuple；回傳緩衝是否已滿 (呼叫端可提早觸發 flush)
+        with self._lock:
+            self._buffer.append(row)
+            return len(self._buffer) >= self.segment_rows
+
+    def flush(self):
+        """
+        將緩衝寫成一個新區段，回傳寫入筆數；先寫到暫存目錄再改名，讀取端不會看到寫到一半的區段
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            self._write_segment(rows)
+            return len(rows)
+
+    def _segment_name(self, first_ts):
+        # 以第一筆時間 (微秒)、行程編號與流水號命名，多個 worker 共用同一目錄也不會衝突，且名稱排序即時間排序
+        return f"seg_{int(first_ts * 1e6):017d}_{os.getpid()}_{next(self._seq):06d}"
+
+    def _write_segment(self, rows, name=None):
+        import numpy as np
+        columns = list(zip(*rows))
+        name = name or self._segment_name(columns[0][0])
+        os.makedirs(self.root, exist_ok=True)
+        tmp = os.path.join(self.root, "." + name + ".tmp")
+        os.makedirs(tmp, exist_ok=True)
+        meta = {"rows": len(rows), "dictionaries": {}, "attrs": self.attrs}
+        for (col, dtype), values in zip(self.schema, columns):
+            if dtype == "str":
+                values = ["" if v is None else str(v) for v in values]
+                vocab = sorted(set(values))
+                index = {v: i for i, v in enumerate(vocab)}
+                array = np.fromiter((index[v] for v in values), dtype=np.int32, count=len(values))
+                meta["dictionaries"][col] = vocab
+            else:
+                array = np.asarray(values, dtype=dtype)
+            np.save(os.path.join(tmp, col + ".npy"), array)
+        ts = np.asarray(columns[0], dtype=float)
+        meta["ts_min"], meta["ts_max"] = float(ts.min()), float(ts.max())
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.root, name))
+        return name
+
+    def segments(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if name.startswith("seg_"))
+
+    def _meta(self, name):
+        # 區段寫出後不再變動，meta 與字典索引可永久快取
+        meta = self._meta_cache.get(name)
+        if meta is None:
+            with open(os.path.join(self.root, name, "meta.json"), encoding="utf-8") as f:
+                meta = self._meta_cache[name] = json.load(f)
+            meta["index"] = {column: {v: i for i, v in enumerate(vocab)}
+                             for column, vocab in meta["dictionaries"].items()}
+        return meta
+
+    def _codes(self, meta, column, value):
+        # 篩選值轉成該區段的字典代碼；不在字典中回傳 None (整個區段可略過)
+        if value is None:
+            return ()
+        index = meta["index"][column]
+        codes = [index[v] for v in ([value] if isinstance(value, str) else value) if v in index]
+        return codes or None
+
+    def latest_attrs(self):
+        segments = self.segments()
+        return self._meta(segments[-1])["attrs"] if segments else self.attrs
+
+    def _read_segment(self, name, meta, columns, filters, start, end):
+        import numpy as np
+        path = os.path.join(self.root, name)
+        mask = None
+        if start is not None or end is not None:
+            ts = np.load(os.path.join(path, "ts.npy"), mmap_mode="r")
+            mask = np.ones(len(ts), dtype=bool)
+            if start is not None:
+                mask &= ts >= start
+            if end is not None:
+                mask &= ts < end
+        for column, codes in filters.items():
+            if codes:
+                hit = np.isin(np.load(os.path.join(path, column + ".npy"), mmap_mode="r"), codes)
+                mask = hit if mask is None else mask & hit
+        if mask is not None and not mask.any():
+            return None
+        result = {}
+        for column in columns:
+            array = np.load(os.path.join(path, column + ".npy"), mmap_mode="r")
+            array = np.asarray(array if mask is None else array[mask])
+            if column in meta["dictionaries"]:
+                vocab = np.asarray(meta["dictionaries"][column], dtype=object)
+                array = vocab[array] if len(vocab) else array.astype(object)
+            result[column] = array
+        return result
+
+    def _buffer_part(self, columns, player_id, mode, start, end):
+        import numpy as np
+        with self._lock:
+            rows = list(self._buffer)
+        position = {name: i for i, name in enumerate(self.columns)}
+        selected = []
+        for row in rows:
+            if player_id is not None and row[position["player_id"]] not in (
+                    [player_id] if isinstance(player_id, str) else player_id):
+                continue
+            if mode is not None and row[position["mode"]] not in ([mode] if isinstance(mode, str) else mode):
+                continue
+            if (start is not None and row[0] < start) or (end is not None and row[0] >= end):
+                continue
+            selected.append(row)
+        if not selected:
+            return None
+        result = {}
+        for (column, dtype) in self.schema:
+            if column in columns:
+                values = [row[position[column]] for row in selected]
+                result[column] = np.asarray(values, dtype=object if dtype == "str" else dtype)
+        return result
+
+    def query(self, player_id=None, mode=None, start=None, end=None, columns=None):
+        """
+        依玩家、模式 (可為單一值或清單) 與時間範圍 [start, end) 讀取資料，回傳 {欄位: 陣列}
+        start / end 可為 epoch 秒、datetime 或 ISO 字串；只載入命中區段的所需欄位，尚未寫出的緩衝也會包含在內
+        """
+        import numpy as np
+        columns = list(columns or self.columns)
+        start, end = _to_epoch(start), _to_epoch(end)
+        parts = []
+        for name in self.segments():
+            meta = self._meta(name)
+            if (start is not None and meta["ts_max"] < start) or (end is not None and meta["ts_min"] >= end):
+                continue
+            filters = {"player_id": self._codes(meta, "player_id", player_id),
+                       "mode": self._codes(meta, "mode", mode)}
+            if None in filters.values():
+                continue
+            part = self._read_segment(name, meta, columns, filters, start, end)
+            if part is not None:
+                parts.append(part)
+        part = self._buffer_part(columns, player_id, mode, start, end)
+        if part is not None:
+            parts.append(part)
+        dtypes = dict(self.schema)
+        return {column: np.concatenate([p[column] for p in parts]) if parts else
+                np.empty(0, dtype=object if dtypes[column] == "str" else dtypes[column]) for column in columns}
+
+    def compact(self):
+        """
+        把相鄰的小區段合併成接近 segment_rows 的大區段，回傳合併掉的區段數 (請在沒有寫入的離線環境執行)
+        """
+        self.flush()
+        merged = 0
+        group, group_rows = [], 0
+        for name in self.segments() + [None]:
+            rows = self._meta(name)["rows"] if name is not None else 0
+            if name is not None and group_rows + rows <= self.segment_rows:
+                group.append(name)
+                group_rows += rows
+                continue
+            if len(group) > 1:
+                self._merge(group)
+                merged += len(group) - 1
+            group, group_rows = ([name], rows) if name is not None else ([], 0)
+        return merged
+
+    def _merge(self, names):
+        import numpy as np
+        parts = [self._read_segment(name, self._meta(name), self.columns, {}, None, None) for name in names]
+        merged = {column: np.concatenate([p[column] for p in parts]) for column in self.columns}
+        rows = list(zip(*(merged[column].tolist() for column in self.columns)))
+        # 新區段名稱以第一個區段為前綴，排序位置不變；先寫好再移除舊區段，中途失敗只會留下重複而不會遺失資料
+        self._write_segment(rows, f"{names[0].split('_c')[0]}_c{time.time_ns()}")
+        for name in names:
+            shutil.rmtree(os.path.join(self.root, name))
+            self._meta_cache.pop(name, None)
+
+    def export_csv(self, path, header, format_row, **filters):
+        # 依舊版 CSV 格式匯出，format_row 接收 {欄位: 值} 與最新區段的 attrs (例如寫入當時的 BASE_STATS)
+        import numpy as np
+        data = self.query(**filters)
+        attrs = self.latest_attrs()
+        order = np.argsort(data["ts"], kind="stable")
+        columns = [data[column][order].tolist() for column in self.columns]
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(format_row(dict(zip(self.columns, values)), attrs) for values in zip(*columns))
+        return len(order)
+
+
+def format_log_row(row, attrs, time_format="%H:%M:%S"):
+    base = attrs["base_stats"]
+    return [datetime.fromtimestamp(row["ts"]).strftime(time_format), row["player_id"], row["mode"], row["scene"],
+            row["status"], f"{row['kd']:.2f}", f"{row['HP_Mult']:.2f}", f"{row['ATK_Mult']:.2f}",
+            f"{row['Det_Range']:.2f}", f"{row['Move_Speed']:.2f}", f"{row['HP_Mult'] * base['HP']:.1f}",
+            f"{row['ATK_Mult'] * base['ATK']:.1f}", f"{row['Det_Range'] * base['DET']:.1f}",
+            f"{row['Move_Speed'] * base['SPD']:.2f}", ACTIONS[row["action"]], row["version"]]
+
+
+def format_final_row(row, attrs, time_format="%Y-%m-%d %H:%M:%S"):
+    # 數值欄以浮點儲存，整數值匯出時不帶小數點
+    def num(value):
+        return "" if math.isnan(value) else (int(value) if float(value).is_integer() else float(value))
+    return [datetime.fromtimestamp(row["ts"]).strftime(time_format), row["player_id"], row["mode"],
+            num(row["total_damage"]), num(row["damage_taken"]), num(row["kills"]), num(row["deaths"]),
+            num(row["completion_time"]), row["result"], row["version"]]
+
+
+class TelemetryStore:
+    """
+    實驗遙測的欄位式儲存：steps (每步調整) 與 finals (通關結果) 兩張表，背景執行緒定期把緩衝寫成區段
+    """
+
+    def __init__(self, root, attrs=None, segment_rows=SEGMENT_ROWS):
+        self.root = root
+        self.steps = ColumnarTable(os.path.join(root, "steps"), STEP_SCHEMA, attrs, segment_rows)
+        self.finals = ColumnarTable(os.path.join(root, "finals"), FINAL_SCHEMA, attrs, segment_rows)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def record_step(self, ts, player_id, mode, scene, status, kd, params, data, action, version):
+        row = (ts, player_id, mode, scene, status, kd, *(params[key] for key in PARAM_KEYS),
+               to_number(data.get("kill_count", 0)), to_number(data.get("death_count", 0)),
+               to_number(data.get("game_time", 0)), ACTION_CODES[action], version)
+        if self.steps.append(row):
+            self._wake.set()
+
+    def record_final(self, ts, player_id, mode, data, version):
+        row = (ts, player_id, mode, to_number(data.get("totalDamage", 0)), to_number(data.get("damageTaken", 0)),
+               to_number(data.get("kills", 0)), to_number(data.get("deaths", 0)),
+               to_number(data.get("completionTime", 0)), "" if data.get("result") is None else str(data.get("result")), version)
+        if self.finals.append(row):
+            self._wake.set()
+
+    def flush(self):
+        return self.steps.flush() + self.finals.flush()
+
+    def start_flusher(self, interval=30.0):
+        # 定期或緩衝已滿時寫出區段，請求執行緒不碰磁碟
+        if self._flusher is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                self._wake.wait(interval)
+                self._wake.clear()
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"⚠️ 遙測區段寫入失敗，保留在記憶體中: {e}")
+
+        self._flusher = threading.Thread(target=run, name="telemetry-flusher", daemon=True)
+        self._flusher.start()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="欄位式遙測查詢、匯出與合併")
+    parser.add_argument("--root", default=os.environ.get("DDA_TELEMETRY_DIR", "telemetry"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="依舊版 CSV 格式匯出")
+    export.add_argument("table", choices=("steps", "finals"))
+    export.add_argument("output")
+    export.add_argument("--player", action="append", help="可重複指定多位玩家")
+    export.add_argument("--mode", action="append")
+    export.add_argument("--start", help="起始時間 (ISO 格式，含)")
+    export.add_argument("--end", help="結束時間 (ISO 格式，不含)")
+    export.add_argument("--full-time", action="store_true", help="時間欄輸出完整日期 (舊版日誌只有時分秒)")
+    sub.add_parser("compact", help="合併小區段")
+    args = parser.parse_args()
+
+    store = TelemetryStore(args.root)
+    if args.command == "compact":
+        print(f"✅ 合併 {store.steps.compact() + store.finals.compact()} 個區段")
+    else:
+        table = getattr(store, args.table)
+        time_format = "%Y-%m-%d %H:%M:%S" if args.full_time or args.table == "finals" else "%H:%M:%S"
+        header, formatter = (LOG_HEADER, format_log_row) if args.table == "steps" else (FINAL_HEADER, format_final_row)
+        t0 = time.perf_counter()
+        n = table.export_csv(args.output, header, lambda row, attrs: formatter(row, attrs, time_format),
+                             player_id=args.player, mode=args.mode, start=args.start, end=args.end)
+        print(f"✅ 匯出 {n} 筆至 {args.output} ({time.perf_counter() - t0:.2f}s)")
@@ -1,8 +1,13 @@
-from deap import base, creator, tools, algorithms
+# DEAP 只在實際演化時匯入 (get_toolbox 與各演化迴圈)，只需要評估函式時 (例如平行評估行程) 不會載入
 import random
 import numpy as np
-import pickle
-from model_core import simulate_game_run, evaluate_from_unity
+import os
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Pool
+from model_core import simulate_game_run, evaluate_from_unity, simulate_game_run_batch, evaluate_from_unity_batch
+from model_registry import write_profile
 
 # --- 基因範圍重新設定 (收縮邊界避免秒殺) ---
 HP_BOUNDS = [0.8, 1.4]     # 血量最低 0.7 防止秒殺，最高 1.4 防止太坦
@@ -14,20 +19,24 @@ POP_SIZE = 50
 N_GEN = 60
 CX_PB = 0.7
 MUT_PB = 0.2
-
-if not hasattr(creator, "FitnessMax"):
-    creator.create("FitnessMax", base.Fitness, weights=(1.0,))
-if not hasattr(creator, "Individual"):
-    creator.create("Individual", list, fitness=creator.FitnessMax)
-
-toolbox = base.Toolbox()
-toolbox.register("attr_hp_mult", random.uniform, *HP_BOUNDS)
-toolbox.register("attr_atk_mult", random.uniform, *ATK_BOUNDS)
-toolbox.register("attr_det_range", random.uniform, *DET_BOUNDS)
-toolbox.register("attr_move_speed", random.uniform, *SPEED_BOUNDS)
-toolbox.register("individual", tools.initCycle, creator.Individual,
-                 (toolbox.attr_hp_mult, toolbox.attr_atk_mult, toolbox.attr_det_range, toolbox.attr_move_speed), n=1)
-toolbox.register("population", tools.initRepeat, list, toolbox.individual)
+# 批次評估切塊大小 (搭配平行 map 時，每塊交給一個行程)
+BATCH_CHUNK = 4096
+# 適應度快取：基因量化到小數第 6 位作為鍵，LRU 上限筆數
+CACHE_DECIMALS = 6
+CACHE_SIZE = 100000
+# 提早停止：最佳適應度連續 PATIENCE 代進步小於 TOL，或族群多樣性低於 MIN_DIVERSITY 即停止
+PATIENCE = 10
+TOL = 1e-6
+MIN_DIVERSITY = 1e-4
+# 代理模型模式：每代產生 SURROGATE_OVERSAMPLE 倍族群的子代，只把預測最佳的 SURROGATE_EVALS 個 (另加
+# SURROGATE_EXPLORE 個離已評估樣本最遠的候選) 交給真正的評估函式；模型只以最近 SURROGATE_MAX_POINTS 筆實際評估擬合
+SURROGATE_OVERSAMPLE = 4
+SURROGATE_EVALS = 2
+SURROGATE_EXPLORE = 1
+SURROGATE_MAX_POINTS = 400
+# 每代只加入少數新個體，停滯判定需要比一般模式更多代
+SURROGATE_PATIENCE = 25
+SURROGATE_RIDGE = 1e-8
 
 def checkBounds():
     def decorator(func):
@@ -51,21 +60,413 @@ def evaluate_weak(individual):
     sim_result = simulate_game_run(*individual)
     return (evaluate_from_unity(individual, sim_result),)
 
-toolbox.register("mate", tools.cxBlend, alpha=0.5)
-toolbox.decorate("mate", checkBounds())
-toolbox.register("mutate", tools.mutGaussian, mu=0.0, sigma=0.3, indpb=0.1)
-toolbox.decorate("mutate", checkBounds())
-toolbox.register("select", tools.selTournament, tournsize=3)
+# --- 批次評估：一次計算 (N, 4) 族群，回傳 (N,) 適應度陣列 ---
+def evaluate_strong_batch(population):
+    pop = np.asarray(population, dtype=float)
+    return -evaluate_from_unity_batch(pop, simulate_game_run_batch(pop))
+
+def evaluate_weak_batch(population):
+    pop = np.asarray(population, dtype=float)
+    return evaluate_from_unity_batch(pop, simulate_game_run_batch(pop))
+
+toolbox = None
+
+def get_toolbox():
+    """
+    第一次呼叫時匯入 DEAP、建立 creator 型別與共用的 toolbox，之後回傳同一個
+    平行評估行程以此作為 Pool 的 initializer，才能還原傳入的 creator.Individual
+    """
+    global toolbox
+    if toolbox is not None:
+        return toolbox
+    from deap import base, creator, tools
+    if not hasattr(creator, "FitnessMax"):
+        creator.create("FitnessMax", base.Fitness, weights=(1.0,))
+    if not hasattr(creator, "Individual"):
+        creator.create("Individual", list, fitness=creator.FitnessMax)
+
+    tb = base.Toolbox()
+    tb.register("attr_hp_mult", random.uniform, *HP_BOUNDS)
+    tb.register("attr_atk_mult", random.uniform, *ATK_BOUNDS)
+    tb.register("attr_det_range", random.uniform, *DET_BOUNDS)
+    tb.register("attr_move_speed", random.uniform, *SPEED_BOUNDS)
+    tb.register("individual", tools.initCycle, creator.Individual,
+                (tb.attr_hp_mult, tb.attr_atk_mult, tb.attr_det_range, tb.attr_move_speed), n=1)
+    tb.register("population", tools.initRepeat, list, tb.individual)
+    tb.register("mate", tools.cxBlend, alpha=0.5)
+    tb.decorate("mate", checkBounds())
+    tb.register("mutate", tools.mutGaussian, mu=0.0, sigma=0.3, indpb=0.1)
+    tb.decorate("mutate", checkBounds())
+    tb.register("select", tools.selTournament, tournsize=3)
+    toolbox = tb
+    return toolbox
+
+class FitnessCache:
+    """
+    以量化基因為鍵的 LRU 適應度快取；未變動的子代或被 checkBounds 夾到同一邊界的個體不必重新評估
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, decimals=CACHE_DECIMALS):
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+
+    def key(self, individual):
+        return tuple(round(float(g), self.decimals) for g in individual)
+
+    def get(self, key):
+        values = self._data.get(key)
+        if values is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return values
+
+    def put(self, key, values):
+        self._data[key] = values
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._data),
+                "hit_rate": self.hits / total if total else 0.0}
+
+def evaluate_population(individuals, toolbox, batch=False, cache=None):
+    """
+    評估所有適應度失效的個體，回傳實際呼叫評估函式的次數
+    batch=True 時以 toolbox.evaluate_batch 分塊向量化評估；給定 cache 時先查快取，同代相同基因只評估一次
+    toolbox.eval_workers > 1 (行程池) 時族群至少切成同樣多塊，每個評估行程都分得到工作
+    """
+    invalid_ind = [ind for ind in individuals if not ind.fitness.valid]
+    if cache is None:
+        groups = [[ind] for ind in invalid_ind]
+    else:
+        pending = OrderedDict()
+        for ind in invalid_ind:
+            key = cache.key(ind)
+            values = cache.get(key) if key not in pending else None
+            if values is not None:
+                ind.fitness.values = values
+            else:
+                pending.setdefault(key, []).append(ind)
+        groups = list(pending.values())
+    if not groups:
+        return 0
+
+    representatives = [group[0] for group in groups]
+    if batch:
+        genomes = np.asarray(representatives, dtype=float)
+        workers = getattr(toolbox, "eval_workers", 1)
+        size = min(BATCH_CHUNK, -(-len(genomes) // workers))
+        chunks = [genomes[i:i + size] for i in range(0, len(genomes), size)]
+        results = [(float(score),) for score in np.concatenate(list(toolbox.map(toolbox.evaluate_batch, chunks)))]
+    else:
+        results = list(toolbox.map(toolbox.evaluate, representatives))
+    for group, values in zip(groups, results):
+        for ind in group:
+            ind.fitness.values = values
+        if cache is not None:
+            cache.put(cache.key(group[0]), values)
+    return len(groups)
+
+def eaSimpleBatch(population, toolbox, cxpb, mutpb, ngen):
+    """
+    與 algorithms.eaSimple 相同的演化流程，但每一代只呼叫一次 toolbox.evaluate_batch 評估所有新個體
+    """
+    from deap import algorithms
+    evaluate_population(population, toolbox, batch=True)
+    for gen in range(1, ngen + 1):
+        offspring = toolbox.select(population, len(population))
+        offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
+        evaluate_population(offspring, toolbox, batch=True)
+        population[:] = offspring
+    return population
+
+GENE_LOWER = np.array([HP_BOUNDS[0], ATK_BOUNDS[0], DET_BOUNDS[0], SPEED_BOUNDS[0]])
+GENE_RANGES = np.array([HP_BOUNDS[1] - HP_BOUNDS[0], ATK_BOUNDS[1] - ATK_BOUNDS[0],
+                        DET_BOUNDS[1] - DET_BOUNDS[0], SPEED_BOUNDS[1] - SPEED_BOUNDS[0]])
+
+def population_diversity(population):
+    # 各基因標準差除以其邊界寬度後取平均，0 代表族群已完全收斂到同一個體
+    return float(np.mean(np.std(np.asarray(population, dtype=float), axis=0) / GENE_RANGES))
+
+def eaEarlyStop(population, toolbox, cxpb, mutpb, ngen, batch=False, cache=None, patience=PATIENCE, tol=TOL,
+                min_diversity=MIN_DIVERSITY):
+    """
+    與 eaSimple 相同的選擇/交配/突變流程，最佳適應度停滯或多樣性崩潰時提早結束
+    回傳 (族群, 統計)，統計包含實際代數、省下的代數與評估次數
+    """
+    from deap import algorithms
+    evaluations = evaluate_population(population, toolbox, batch, cache)
+    requested = len(population)
+    best = max(ind.fitness.values[0] for ind in population)
+    stale, gen, reason = 0, 0, "max generations"
+    for gen in range(1, ngen + 1):
+        offspring = toolbox.select(population, len(population))
+        offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
+        requested += sum(1 for ind in offspring if not ind.fitness.valid)
+        evaluations += evaluate_population(offspring, toolbox, batch, cache)
+        population[:] = offspring
+
+        gen_best = max(ind.fitness.values[0] for ind in population)
+        if gen_best > best + tol:
+            best, stale = gen_best, 0
+        else:
+            stale += 1
+        if stale >= patience:
+            reason = "fitness plateau"
+            break
+        if population_diversity(population) < min_diversity:
+            reason = "diversity collapse"
+            break
+
+    # 省下的評估 = 快取/同代去重省下的次數 + 未執行世代的預估評估數 (以已執行世代的平均需求估算)
+    per_gen = requested / (gen + 1)
+    return population, {"generations": gen, "generations_saved": ngen - gen, "stop_reason": reason,
+                        "evaluations": evaluations, "cache_saved": requested - evaluations,
+                        "evaluations_saved": requested - evaluations + round(per_gen * (ngen - gen))}
 
-def train_zombie(eval_func, save_path, label):
+class SurrogateModel:
+    """
+    適應度代理模型：以實際評估過的基因擬合 rbf (三次徑向基底加線性項) 或 poly (二次多項式) 迴歸
+    基因先依邊界正規化到 [0, 1]，只保留最近 max_points 筆，族群收斂後模型也跟著聚焦在目前的搜尋區域
+    """
+
+    def __init__(self, kind="rbf", max_points=SURROGATE_MAX_POINTS, ridge=SURROGATE_RIDGE):
+        if kind not in ("rbf", "poly"):
+            raise ValueError(f"未知的代理模型: {kind}")
+        self.kind = kind
+        self.max_points = max_points
+        self.ridge = ridge
+        self._x = np.empty((0, 4))
+        self._y = np.empty(0)
+        self._coef = None
+
+    def __len__(self):
+        return len(self._y)
+
+    @staticmethod
+    def _normalize(genomes):
+        return (np.asarray(genomes, dtype=float).reshape(-1, 4) - GENE_LOWER) / GENE_RANGES
+
+    @staticmethod
+    def _poly_features(x):
+        # [1, x_i, x_i * x_j (i <= j)]，4 個基因共 15 項
+        rows, cols = np.triu_indices(4)
+        return np.hstack([np.ones((len(x), 1)), x, x[:, rows] * x[:, cols]])
+
+    @staticmethod
+    def _distances(a, b):
+        return np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2)
+
+    def add(self, genomes, values):
+        self._x = np.vstack([self._x, self._normalize(genomes)])[-self.max_points:]
+        self._y = np.concatenate([self._y, np.asarray(values, dtype=float)])[-self.max_points:]
+        self._coef = None
+
+    def distance(self, genomes):
+        # 每個基因到最近一筆已評估樣本的正規化距離
+        x = self._normalize(list(genomes))
+        return self._distances(x, self._x).min(axis=1) if len(self._y) else np.full(len(x), np.inf)
+
+    def fit(self):
+        x, y, n = self._x, self._y, len(self._y)
+        if self.kind == "poly":
+            features = self._poly_features(x)
+            gram = features.T @ features + self.ridge * np.eye(features.shape[1])
+            self._coef = np.linalg.lstsq(gram, features.T @ y, rcond=None)[0]
+            return
+        # 插值條件 Φw + Pc = y 與正交條件 Pᵀw = 0 組成的鞍點系統
+        tail = np.hstack([np.ones((n, 1)), x])
+        system = np.zeros((n + 5, n + 5))
+        system[:n, :n] = self._distances(x, x) ** 3 + self.ridge * np.eye(n)
+        system[:n, n:] = tail
+        system[n:, :n] = tail.T
+        rhs = np.concatenate([y, np.zeros(5)])
+        try:
+            self._coef = np.linalg.solve(system, rhs)
+        except np.linalg.LinAlgError:
+            # 重複或共線的樣本會讓系統奇異，改用最小平方解
+            self._coef = np.linalg.lstsq(system, rhs, rcond=None)[0]
+
+    def predict(self, genomes):
+        if self._coef is None:
+            self.fit()
+        x = self._normalize(genomes)
+        if self.kind == "poly":
+            return self._poly_features(x) @ self._coef
+        n = len(self._y)
+        return self._distances(x, self._x) ** 3 @ self._coef[:n] + self._coef[n] + x @ self._coef[n + 1:]
+
+def eaSurrogate(population, toolbox, cxpb, mutpb, ngen, surrogate, batch=False, cache=None,
+                oversample=SURROGATE_OVERSAMPLE, n_eval=SURROGATE_EVALS, n_explore=SURROGATE_EXPLORE,
+                patience=PATIENCE, tol=TOL, min_diversity=MIN_DIVERSITY):
+    """
+    代理模型輔助的演化：選擇/交配/突變與 eaSimple 相同，但每代產生 oversample 倍的子代，
+    先以代理模型預測適應度，只實際評估最有希望的 n_eval 個與 n_explore 個離已評估樣本最遠的候選，
+    再與父代合併保留最佳的 len(population) 個 (族群中只有實際評估過的適應度)
+    回傳 (族群, 統計)；省下的評估數以「同樣的族群與代數、不用代理模型」每代需要評估的子代數估算
+    """
+    from deap import algorithms, tools
+    pop_size = len(population)
+    evaluations = evaluate_population(population, toolbox, batch, cache)
+    surrogate.add(population, [ind.fitness.values[0] for ind in population])
+    baseline = pop_size
+    screened, errors = 0, []
+    best = max(ind.fitness.values[0] for ind in population)
+    stale, gen, reason = 0, 0, "max generations"
+    for gen in range(1, ngen + 1):
+        offspring = toolbox.select(population, pop_size * oversample)
+        offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
+        # 前 pop_size 個子代就是一般 GA 這一代會產生的子代 (選擇為獨立抽樣)
+        baseline += sum(1 for ind in offspring[:pop_size] if not ind.fitness.valid)
+        candidates = [ind for ind in offspring if not ind.fitness.valid]
+        if candidates:
+            screened += len(candidates)
+            surrogate.fit()
+            predicted = surrogate.predict(candidates)
+            order = np.argsort(-predicted, kind="stable")
+            chosen = list(order[:n_eval])
+            rest = order[n_eval:]
+            if n_explore and len(rest):
+                # 探索名額給離已評估樣本最遠的候選：模型外插最不可靠的區域 (例如適應度的階梯邊界另一側)
+                distance = surrogate.distance(candidates[i] for i in rest)
+                chosen += [rest[i] for i in np.argsort(-distance, kind="stable")[:n_explore]]
+            selected = [candidates[i] for i in chosen]
+            evaluations += evaluate_population(selected, toolbox, batch, cache)
+            actual = [ind.fitness.values[0] for ind in selected]
+            errors.extend(np.abs(predicted[chosen] - actual).tolist())
+            surrogate.add(selected, actual)
+        else:
+            selected = []
+        # 未變動的子代只是父代的複本，新個體直接與父代競爭 (μ + λ)
+        population[:] = tools.selBest(population + selected, pop_size)
+
+        gen_best = population[0].fitness.values[0]
+        if gen_best > best + tol:
+            best, stale = gen_best, 0
+        else:
+            stale += 1
+        if stale >= patience:
+            reason = "fitness plateau"
+            break
+        if population_diversity(population) < min_diversity:
+            reason = "diversity collapse"
+            break
+
+    baseline += round(baseline / (gen + 1) * (ngen - gen)) if ngen > gen else 0
+    return population, {"generations": gen, "stop_reason": reason, "evaluations": evaluations,
+                        "screened": screened, "baseline_evaluations": baseline,
+                        "evaluations_saved": baseline - evaluations,
+                        "surrogate_mae": float(np.mean(errors)) if errors else None}
+
+def train_zombie(eval_func, save_path, label, batch_eval=None, pop_size=POP_SIZE, n_gen=N_GEN, seed=None,
+                 map_func=None, cache_size=0, early_stop=False, surrogate=None, surrogate_evals=SURROGATE_EVALS,
+                 eval_workers=1):
+    from deap import algorithms, tools
+    toolbox = get_toolbox()
+    # 固定亂數種子，讓同一組參數每次訓練出相同結果
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    # 註冊平行 map (例如 Pool.map)，適應度評估會分散到多個行程
+    toolbox.register("map", map_func if map_func is not None else map)
+    toolbox.eval_workers = eval_workers if map_func is not None else 1
     toolbox.register("evaluate", eval_func)
-    pop = toolbox.population(n=POP_SIZE)
-    algorithms.eaSimple(pop, toolbox, cxpb=CX_PB, mutpb=MUT_PB, ngen=N_GEN, verbose=False)
+    if batch_eval is not None:
+        toolbox.register("evaluate_batch", batch_eval)
+    pop = toolbox.population(n=pop_size)
+    if surrogate:
+        # 代理模型模式：適合每次評估都很昂貴 (實際重播或 headless Unity) 的情況，可與快取、提早停止併用
+        cache = FitnessCache(cache_size) if cache_size else None
+        _, info = eaSurrogate(pop, toolbox, CX_PB, MUT_PB, n_gen, SurrogateModel(surrogate),
+                              batch=batch_eval is not None, cache=cache, n_eval=surrogate_evals,
+                              patience=SURROGATE_PATIENCE if early_stop else n_gen + 1,
+                              min_diversity=MIN_DIVERSITY if early_stop else -1.0)
+        mae = f"{info['surrogate_mae']:.3f}" if info["surrogate_mae"] is not None else "-"
+        print(f"🧠 {label}: 代理模型 {surrogate} 執行 {info['generations']}/{n_gen} 代 ({info['stop_reason']})，"
+              f"篩選 {info['screened']} 個候選，實際評估 {info['evaluations']} 次 "
+              f"(一般 GA 約 {info['baseline_evaluations']} 次，省下 {info['evaluations_saved']} 次)，預測誤差 MAE {mae}")
+    elif early_stop or cache_size:
+        # 快取 + 提早停止模式 (未開啟 early_stop 時 patience 設為不會觸發)
+        cache = FitnessCache(cache_size) if cache_size else None
+        patience = PATIENCE if early_stop else n_gen + 1
+        diversity = MIN_DIVERSITY if early_stop else -1.0
+        _, info = eaEarlyStop(pop, toolbox, CX_PB, MUT_PB, n_gen, batch=batch_eval is not None, cache=cache,
+                              patience=patience, min_diversity=diversity)
+        print(f"⏱️ {label}: 執行 {info['generations']}/{n_gen} 代 ({info['stop_reason']})，"
+              f"實際評估 {info['evaluations']} 次，省下 {info['generations_saved']} 代 / 約 {info['evaluations_saved']} 次評估")
+        if cache is not None:
+            print(f"   快取統計: {cache.stats()}")
+    elif batch_eval is not None:
+        # 批次模式：整個族群每代只做一次向量化評估，適合數萬個體的大族群
+        eaSimpleBatch(pop, toolbox, cxpb=CX_PB, mutpb=MUT_PB, ngen=n_gen)
+    else:
+        algorithms.eaSimple(pop, toolbox, cxpb=CX_PB, mutpb=MUT_PB, ngen=n_gen, verbose=False)
     best = tools.selBest(pop, 1)[0]
     print(f"✅ {label} 完成！最佳基因: HP={best[0]:.2f}, ATK={best[1]:.2f}, DET={best[2]:.2f}, SPD={best[3]:.2f}")
-    with open(save_path, "wb") as f:
-        pickle.dump({"HP_Mult": best[0], "ATK_Mult": best[1], "Det_Range": best[2], "Move_Speed": best[3]}, f)
+    if save_path is not None:
+        save_profile(best, save_path)
+    return best
+
+def save_profile(best, save_path):
+    # JSON 模型檔：API 伺服器啟動時不需 unpickle (也不會因 numpy 浮點數而連帶匯入 numpy)
+    write_profile(save_path, {"HP_Mult": best[0], "ATK_Mult": best[1], "Det_Range": best[2], "Move_Speed": best[3]})
+
+
+# --- 平行訓練：強/弱兩組設定 × 多個種子重啟，同時在行程池中執行 ---
+PROFILES = {
+    "strong": (evaluate_strong, evaluate_strong_batch, "P_Strong.json", "極強殭屍"),
+    "weak": (evaluate_weak, evaluate_weak_batch, "P_Weak.json", "極弱殭屍"),
+}
+
+def _train_job(profile, seed, eval_workers, train_kwargs):
+    eval_func, batch_eval, _, label = PROFILES[profile]
+    label = f"{label} (seed={seed})"
+    if eval_workers > 1:
+        with Pool(eval_workers, initializer=get_toolbox) as pool:
+            best = train_zombie(eval_func, None, label, batch_eval=batch_eval, seed=seed, map_func=pool.map,
+                                eval_workers=eval_workers, **train_kwargs)
+    else:
+        best = train_zombie(eval_func, None, label, batch_eval=batch_eval, seed=seed, **train_kwargs)
+    return profile, seed, list(best), best.fitness.values[0]
+
+def train_all_parallel(restarts=4, base_seed=0, workers=None, eval_workers=1, **train_kwargs):
+    """
+    以行程池同時訓練 P_Strong 與 P_Weak 的多個種子重啟，每組設定保留適應度最高者並匯出
+    """
+    seeds = [base_seed + i for i in range(restarts)]
+    results = {profile: [] for profile in PROFILES}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_train_job, profile, seed, eval_workers, train_kwargs) for profile in PROFILES for seed in seeds]
+        for future in futures:
+            profile, seed, genes, fitness = future.result()
+            results[profile].append((fitness, -seed, genes))
+
+    best_per_profile = {}
+    for profile, runs in results.items():
+        # 適應度相同時取種子較小者，確保匯出結果可重現
+        fitness, neg_seed, genes = max(runs)
+        save_profile(genes, PROFILES[profile][2])
+        best_per_profile[profile] = genes
+        print(f"🏆 {PROFILES[profile][3]} 最佳重啟 seed={-neg_seed}, fitness={fitness:.4f} -> {PROFILES[profile][2]}")
+    return best_per_profile
 
 if __name__ == "__main__":
-    train_zombie(evaluate_strong, "P_Strong.pkl", "極強殭屍")
-    train_zombie(evaluate_weak, "P_Weak.pkl", "極弱殭屍")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="GA 殭屍參數訓練")
+    parser.add_argument("--restarts", type=int, default=4, help="每組設定的獨立種子重啟次數")
+    parser.add_argument("--seed", type=int, default=0, help="起始亂數種子")
+    parser.add_argument("--workers", type=int, default=None, help="訓練行程數 (預設為 CPU 核心數)")
+    parser.add_argument("--eval-workers", type=int, default=1, help="每個訓練工作內的平行評估行程數")
+    parser.add_argument("--cache-size", type=int, default=0, help="適應度快取筆數上限 (0 為不使用)")
+    parser.add_argument("--early-stop", action="store_true", help="最佳適應度停滯或多樣性崩潰時提早結束")
+    parser.add_argument("--surrogate", choices=("rbf", "poly"), help="以代理模型預篩子代，只實際評估最有希望的候選")
+    parser.add_argument("--surrogate-evals", type=int, default=SURROGATE_EVALS, help="代理模型模式下每代實際評估的候選數")
+    args = parser.parse_args()
+    train_all_parallel(args.restarts, args.seed, args.workers, args.eval_workers, cache_size=args.cache_size,
+                       early_stop=args.early_stop, surrogate=args.surrogate, surrogate_evals=args.surrogate_evals)